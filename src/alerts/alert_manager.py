@@ -5,65 +5,144 @@ Alert Manager
 Monitors real-time metrics for anomalies, performance drops, or low attribution confidence.
 """
 
-from typing import List, Dict, Optional
+import os
+import sys
+from typing import List, Dict, Optional, Sequence
 import time
 
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from alerts.anomaly_detector import StreamingAnomalyDetector, flatten_metrics
+
+# Metric groups whose numeric leaves are monitored for anomalies
+MONITORED_METRICS = ('health', 'attribution', 'attribution_stats', 'events_sec')
+
+ANOMALY_CATEGORIES = {
+    'health': 'Campaign Health',
+    'attribution': 'Attribution',
+    'attribution_stats': 'Data Quality',
+}
+
 class AlertManager:
     """
     Monitors metrics and generates alerts for the dashboard.
+    
+    An alert lives for as long as its condition holds: it keeps the id it
+    was raised with and is cleared only after the condition has been absent
+    for clear_after consecutive checks.
     """
     
-    def __init__(self, thresholds: Optional[Dict] = None):
+    def __init__(self, thresholds: Optional[Dict] = None,
+                 detector: Optional[StreamingAnomalyDetector] = None,
+                 detect_anomalies: bool = True,
+                 monitored: Sequence[str] = MONITORED_METRICS,
+                 clear_after: int = 3):
+        """
+        Args:
+            thresholds: Static limits (see defaults below)
+            detector: Anomaly detector to use (default: a new
+                StreamingAnomalyDetector)
+            detect_anomalies: Also raise z-score anomaly alerts
+            monitored: Top-level metric groups fed to the detector
+            clear_after: Consecutive passing checks before a threshold
+                alert is cleared
+        """
         self.thresholds = thresholds or {
             'min_fill_rate': 0.90,
             'min_attribution_confidence': 0.75,
             'max_frequency_cap': 5.0,
             'min_ctr': 0.015
         }
+        self.detector = detector if detector is not None else (
+            StreamingAnomalyDetector(clear_after=clear_after) if detect_anomalies else None)
+        self.monitored = tuple(monitored)
+        self.clear_after = clear_after
+        self._threshold_alerts: Dict[str, Dict] = {}
+        self._passing: Dict[str, int] = {}
         self.active_alerts = []
         
-    def check_metrics(self, metrics: Dict) -> List[Dict]:
-        """
-        Check current metrics against thresholds and return active alerts.
-        """
-        new_alerts = []
-        timestamp = time.time()
+    def _threshold_conditions(self, metrics: Dict) -> Dict[str, Dict]:
+        """Threshold conditions currently failing, keyed by condition."""
+        conditions = {}
         
         # 1. Check Fill Rate
         fill_rate = metrics.get('health', {}).get('fill_rate', 1.0)
         if fill_rate < self.thresholds['min_fill_rate']:
-            new_alerts.append({
-                'id': f"alert_fill_{int(timestamp)}",
+            conditions['fill'] = {
                 'type': 'CRITICAL',
                 'message': f"Fill rate dropped to {fill_rate:.1%} (Target: >{self.thresholds['min_fill_rate']:.0%})",
-                'timestamp': timestamp,
                 'category': 'Campaign Health'
-            })
+            }
             
         # 2. Check Frequency
         avg_freq = metrics.get('health', {}).get('frequency_avg', 0.0)
         if avg_freq > self.thresholds['max_frequency_cap']:
-            new_alerts.append({
-                'id': f"alert_freq_{int(timestamp)}",
+            conditions['freq'] = {
                 'type': 'WARNING',
                 'message': f"High frequency detected ({avg_freq:.1f}). Viewer fatigue risk.",
-                'timestamp': timestamp,
                 'category': 'Ad Operations'
-            })
+            }
             
         # 3. Check Attribution Confidence
-        # (Assuming confidence is passed in metrics)
-        confidence = metrics.get('attribution_stats', {}).get('confidence', 1.0)
-        if confidence < self.thresholds['min_attribution_confidence']:
-            new_alerts.append({
-                'id': f"alert_conf_{int(timestamp)}",
+        # (the engine's bootstrap confidence, see StreamingOrchestrator;
+        # None when the bootstrap is off, then nothing is measured)
+        confidence = metrics.get('attribution_stats', {}).get('confidence')
+        if confidence is not None and confidence < self.thresholds['min_attribution_confidence']:
+            conditions['conf'] = {
                 'type': 'INFO',
                 'message': f"Low attribution confidence ({confidence:.1%}). Needs more impressions.",
-                'timestamp': timestamp,
                 'category': 'Data Quality'
-            })
+            }
+        return conditions
+        
+    def _update_threshold_alerts(self, conditions: Dict[str, Dict], timestamp: float):
+        for key, condition in conditions.items():
+            self._passing.pop(key, None)
+            alert = self._threshold_alerts.get(key)
+            if alert is None:
+                alert = {'id': f"alert_{key}_{int(timestamp)}", 'timestamp': timestamp}
+                self._threshold_alerts[key] = alert
+            alert.update(condition, last_seen=timestamp)
             
-        self.active_alerts = new_alerts
+        for key in list(self._threshold_alerts):
+            if key not in conditions:
+                self._passing[key] = self._passing.get(key, 0) + 1
+                if self._passing[key] >= self.clear_after:
+                    del self._threshold_alerts[key]
+                    del self._passing[key]
+                    
+    def _anomaly_alert(self, episode: Dict) -> Dict:
+        series = episode['series']
+        z = episode['z']
+        direction = "above" if z > 0 else "below"
+        return {
+            'id': episode['id'],
+            'type': 'CRITICAL' if abs(episode['peak_z']) >= 2 * self.detector.z_enter else 'WARNING',
+            'message': (f"{series} is {abs(z):.1f} sigma {direction} baseline "
+                        f"({episode['value']:.4g} vs {episode['baseline']:.4g})"),
+            'timestamp': episode['started_at'],
+            'last_seen': episode['last_seen'],
+            'category': ANOMALY_CATEGORIES.get(series.split('.', 1)[0], 'Anomaly'),
+            'series': series,
+            'z_score': z,
+            'peak_z_score': episode['peak_z'],
+        }
+        
+    def check_metrics(self, metrics: Dict, timestamp: Optional[float] = None) -> List[Dict]:
+        """
+        Check current metrics against thresholds and running baselines,
+        and return active alerts.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        self._update_threshold_alerts(self._threshold_conditions(metrics), timestamp)
+        alerts = list(self._threshold_alerts.values())
+        
+        if self.detector is not None:
+            self.detector.update(flatten_metrics(metrics, self.monitored), timestamp)
+            alerts.extend(self._anomaly_alert(e) for e in self.detector.active_episodes())
+            
+        self.active_alerts = alerts
         return self.active_alerts
 
 if __name__ == "__main__":
@@ -75,3 +154,14 @@ if __name__ == "__main__":
     alerts = manager.check_metrics(sample_metrics)
     for a in alerts:
         print(f"[{a['type']}] {a['message']}")
+        
+    # Streaming baseline: steady shares, then a shift in Search's share
+    import random
+    manager = AlertManager()
+    start = time.time()
+    for i in range(60):
+        search = 0.25 + random.gauss(0, 0.005) + (0.08 if i >= 50 else 0.0)
+        alerts = manager.check_metrics({'attribution': {'Search': search, 'Social': 1 - search}},
+                                       timestamp=start + 5 * i)
+    for a in alerts:
+        print(f"[{a['type']}] {a['id']}: {a['message']}")
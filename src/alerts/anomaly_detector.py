@@ -0,0 +1,255 @@
+"""
+Streaming Anomaly Detector
+==========================
+
+Z-score anomaly detection over many metric series at once, with O(1)
+state updates per observation.
+
+Every series keeps, in flat numpy arrays indexed by series:
+- Welford running mean/variance over its whole history (reported as the
+  long-run baseline)
+- an EWMA mean/variance that follows drift; z-scores are taken against it
+- optionally, a seasonal EWMA per phase of a period (e.g. hour of day),
+  used instead of the plain EWMA once that phase has enough samples
+
+An update scores the new values against the baselines as they were before
+the update, then folds them in. Values are clipped to the entry band before
+updating the EWMAs so one spike cannot drag the baseline with it, while a
+lasting level shift is still absorbed over a few dozen updates.
+
+Anomalies are episodes, not samples: a series enters when |z| reaches
+z_enter and leaves only after clear_after consecutive updates at or below
+z_exit. Each episode keeps one id for its whole life.
+"""
+
+import math
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+class StreamingAnomalyDetector:
+    """
+    Vectorized running statistics and hysteresis for named series.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        z_enter: float = 4.0,
+        z_exit: float = 2.0,
+        clear_after: int = 3,
+        min_samples: int = 30,
+        min_relative_std: float = 0.01,
+        season_period: Optional[float] = None,
+        season_buckets: int = 24,
+        capacity: int = 64
+    ):
+        """
+        Initialize detector.
+
+        Args:
+            alpha: EWMA smoothing factor (weight of the newest value)
+            z_enter: |z| at which a series becomes anomalous
+            z_exit: |z| at or below which an anomalous series counts as calm
+            clear_after: Consecutive calm updates before an episode ends
+            min_samples: Updates (per series, and per season phase) before
+                it is scored
+            min_relative_std: Standard deviation floor as a fraction of the
+                baseline, so near-constant series don't alert on rounding
+            season_period: Seasonal period in seconds (None: no seasonality)
+            season_buckets: Phases per season_period
+            capacity: Initial number of series slots (grows as needed)
+        """
+        if z_exit > z_enter:
+            raise ValueError("z_exit must not exceed z_enter")
+        self.alpha = alpha
+        self.z_enter = z_enter
+        self.z_exit = z_exit
+        self.clear_after = clear_after
+        self.min_samples = min_samples
+        self.min_relative_std = min_relative_std
+        self.season_period = season_period
+        self.season_buckets = season_buckets if season_period else 0
+
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.episodes: Dict[int, Dict] = {}
+        self._capacity = 0
+        self._grow(capacity)
+
+    # Per-series state arrays and their dtypes
+    _SERIES_FIELDS = (('count', np.int64), ('mean', np.float64), ('m2', np.float64),
+                      ('ewma', np.float64), ('ewvar', np.float64), ('last_z', np.float64),
+                      ('active', bool), ('calm_streak', np.int64))
+    _SEASON_FIELDS = (('season_count', np.int64), ('season_mean', np.float64),
+                      ('season_var', np.float64))
+
+    def _grow(self, capacity: int):
+        fields = [(name, dtype, capacity) for name, dtype in self._SERIES_FIELDS]
+        if self.season_buckets:
+            fields += [(name, dtype, (capacity, self.season_buckets)) for name, dtype in self._SEASON_FIELDS]
+        for name, dtype, shape in fields:
+            grown = np.zeros(shape, dtype=dtype)
+            if self._capacity:
+                grown[:self._capacity] = getattr(self, name)
+            setattr(self, name, grown)
+        self._capacity = capacity
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def series_index(self, names: Iterable[str]) -> np.ndarray:
+        """Indices of named series, registering new ones."""
+        index = self.index
+        indices = []
+        for name in names:
+            i = index.get(name)
+            if i is None:
+                i = len(self.names)
+                index[name] = i
+                self.names.append(name)
+            indices.append(i)
+        if len(self.names) > self._capacity:
+            self._grow(max(len(self.names), 2 * self._capacity))
+        return np.array(indices, dtype=np.int64)
+
+    def update(self, values: Dict[str, float], timestamp: Optional[float] = None) -> Dict[str, List[int]]:
+        """Score and absorb one observation per named series (see update_indexed)."""
+        idx = self.series_index(values.keys())
+        return self.update_indexed(idx, np.fromiter(values.values(), dtype=np.float64, count=len(idx)),
+                                   timestamp)
+
+    def update_indexed(self, idx: np.ndarray, values: np.ndarray,
+                       timestamp: Optional[float] = None) -> Dict[str, List[int]]:
+        """
+        Score and absorb observations for series given by index.
+
+        Args:
+            idx: Series indices from series_index (unique)
+            values: One value per index; NaNs are ignored
+            timestamp: Observation time (default: now), for seasonality and
+                episode times
+
+        Returns:
+            Dict with the 'raised' and 'cleared' series indices
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        finite = np.isfinite(values)
+        if not finite.all():
+            idx, values = idx[finite], values[finite]
+        if len(idx) == 0:
+            return {'raised': [], 'cleared': []}
+
+        # Baseline before this update: seasonal phase when warm, else EWMA
+        baseline = self.ewma[idx]
+        variance = self.ewvar[idx]
+        ready = self.count[idx] >= self.min_samples
+        if self.season_buckets:
+            phase = int(timestamp // (self.season_period / self.season_buckets)) % self.season_buckets
+            seasonal = self.season_count[idx, phase] >= self.min_samples
+            baseline = np.where(seasonal, self.season_mean[idx, phase], baseline)
+            variance = np.where(seasonal, self.season_var[idx, phase], variance)
+        std = np.maximum(np.sqrt(variance), self.min_relative_std * np.abs(baseline) + 1e-12)
+        z = np.where(ready, (values - baseline) / std, 0.0)
+        self.last_z[idx] = z
+
+        # Welford (unclipped: the long-run view includes the anomalies)
+        count = self.count[idx] + 1
+        delta = values - self.mean[idx]
+        mean = self.mean[idx] + delta / count
+        self.m2[idx] += delta * (values - mean)
+        self.mean[idx] = mean
+        self.count[idx] = count
+
+        # EWMAs on values clipped to the entry band
+        band = self.z_enter * std
+        clipped = np.where(ready, np.clip(values, baseline - band, baseline + band), values)
+        first = count == 1
+        self.ewma[idx], self.ewvar[idx] = self._ewm(self.ewma[idx], self.ewvar[idx], clipped, first)
+        if self.season_buckets:
+            season_first = self.season_count[idx, phase] == 0
+            self.season_mean[idx, phase], self.season_var[idx, phase] = self._ewm(
+                self.season_mean[idx, phase], self.season_var[idx, phase], clipped, season_first)
+            self.season_count[idx, phase] += 1
+
+        return self._transition(idx, values, baseline, z, timestamp)
+
+    def _ewm(self, mean: np.ndarray, var: np.ndarray, values: np.ndarray, first: np.ndarray):
+        diff = values - mean
+        increment = self.alpha * diff
+        mean = np.where(first, values, mean + increment)
+        var = np.where(first, 0.0, (1 - self.alpha) * (var + diff * increment))
+        return mean, var
+
+    def _transition(self, idx: np.ndarray, values: np.ndarray, baseline: np.ndarray,
+                    z: np.ndarray, timestamp: float) -> Dict[str, List[int]]:
+        active = self.active[idx]
+        magnitude = np.abs(z)
+        raised = ~active & (magnitude >= self.z_enter)
+        calm = active & (magnitude <= self.z_exit)
+        streak = np.where(calm, self.calm_streak[idx] + 1, 0)
+        cleared = calm & (streak >= self.clear_after)
+        self.calm_streak[idx] = np.where(cleared, 0, streak)
+        self.active[idx] = (active | raised) & ~cleared
+
+        for j in np.flatnonzero(raised).tolist():
+            i = int(idx[j])
+            name = self.names[i]
+            self.episodes[i] = {
+                'id': f"anomaly_{name}_{int(timestamp)}",
+                'series': name,
+                'started_at': timestamp,
+                'peak_z': 0.0,
+            }
+        for j in np.flatnonzero(active | raised).tolist():
+            episode = self.episodes.get(int(idx[j]))
+            if episode is None:
+                continue
+            episode['last_seen'] = timestamp
+            episode['value'] = float(values[j])
+            episode['baseline'] = float(baseline[j])
+            episode['z'] = float(z[j])
+            if abs(z[j]) > abs(episode['peak_z']):
+                episode['peak_z'] = float(z[j])
+        cleared_idx = idx[cleared].tolist()
+        for i in cleared_idx:
+            self.episodes.pop(i, None)
+        return {'raised': idx[raised].tolist(), 'cleared': cleared_idx}
+
+    def stats(self, name: str) -> Dict:
+        """Running statistics of one series."""
+        i = self.index[name]
+        count = int(self.count[i])
+        return {
+            'count': count,
+            'mean': float(self.mean[i]),
+            'std': math.sqrt(self.m2[i] / (count - 1)) if count > 1 else 0.0,
+            'ewma': float(self.ewma[i]),
+            'ewm_std': math.sqrt(max(self.ewvar[i], 0.0)),
+            'z': float(self.last_z[i]),
+            'active': bool(self.active[i]),
+        }
+
+    def active_episodes(self) -> List[Dict]:
+        return sorted(self.episodes.values(), key=lambda e: e['started_at'])
+
+
+def flatten_metrics(metrics: Dict, roots: Sequence[str]) -> Dict[str, float]:
+    """
+    Numeric leaves under the given top-level keys as dotted series names,
+    e.g. {'attribution': {'Search': 0.3}} -> {'attribution.Search': 0.3}.
+    """
+    flat: Dict[str, float] = {}
+
+    def walk(prefix: str, value):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                walk(f"{prefix}.{key}", child)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = float(value)
+
+    for root in roots:
+        if root in metrics:
+            walk(root, metrics[root])
+    return flat
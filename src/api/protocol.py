@@ -0,0 +1,179 @@
+"""
+Dashboard Wire Protocol
+=======================
+
+Opt-in compact protocol for /ws clients, negotiated with query parameters:
+
+    /ws                                      full JSON snapshot per update (default)
+    /ws?mode=delta                           snapshot, then JSON deltas
+    /ws?mode=delta&encoding=msgpack          ... as MessagePack binary frames
+    /ws?mode=delta&encoding=msgpack&compress=zlib
+
+Frames in delta mode:
+
+    {"type": "snapshot", "seq": n, "data": {...full state...}}
+    {"type": "delta", "seq": n, "base": n - 1, "set": {...}, "del": [[key, ...], ...]}
+
+"set" holds changed fields only; nested dicts are partial and are merged
+into the client's state, any other value replaces the old one. "del" lists
+key paths that disappeared. A client whose last seq is not "base" has
+missed a frame and should reconnect; the server also sends a fresh snapshot
+whenever it had to drop frames for a slow client.
+
+Each update is encoded at most once per protocol variant, however many
+clients share it.
+"""
+
+import copy
+import json
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MODES = ('full', 'delta')
+ENCODINGS = ('json', 'msgpack')
+COMPRESSIONS = ('none', 'zlib')
+
+Frame = Union[str, bytes]
+
+
+class Protocol(NamedTuple):
+    mode: str = 'full'
+    encoding: str = 'json'
+    compress: str = 'none'
+
+    @classmethod
+    def from_params(cls, params) -> 'Protocol':
+        """
+        Build from /ws query parameters.
+
+        Raises:
+            ValueError: Unknown option, or msgpack requested but not installed
+        """
+        protocol = cls(
+            params.get('mode', 'full'),
+            params.get('encoding', 'json'),
+            params.get('compress', 'none'),
+        )
+        if (protocol.mode not in MODES or protocol.encoding not in ENCODINGS
+                or protocol.compress not in COMPRESSIONS):
+            raise ValueError(f"Unsupported protocol: {dict(protocol._asdict())}")
+        if protocol.encoding == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack encoding is not available on this server")
+        return protocol
+
+
+def diff_state(old: Dict, new: Dict) -> Tuple[Dict, List[List[str]]]:
+    """
+    Changed and removed fields between two states.
+
+    Returns:
+        (set, deleted) as carried by a delta frame
+    """
+    changed: Dict = {}
+    deleted: List[List[str]] = []
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub_changed, sub_deleted = diff_state(old[key], value)
+            if sub_changed:
+                changed[key] = sub_changed
+            deleted.extend([key] + path for path in sub_deleted)
+        elif value != old[key]:
+            changed[key] = value
+    deleted.extend([key] for key in old if key not in new)
+    return changed, deleted
+
+
+def apply_delta(state: Dict, frame: Dict) -> Dict:
+    """Client-side reference: apply a decoded snapshot or delta frame in place."""
+    if frame['type'] == 'snapshot':
+        state.clear()
+        state.update(frame['data'])
+        return state
+    _merge(state, frame['set'])
+    for path in frame['del']:
+        parent = state
+        for key in path[:-1]:
+            parent = parent[key]
+        parent.pop(path[-1], None)
+    return state
+
+
+def _merge(target: Dict, changes: Dict):
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def encode(message: Dict, protocol: Protocol) -> Frame:
+    if protocol.encoding == 'msgpack':
+        data = msgpack.packb(message, use_bin_type=True)
+    else:
+        data = json.dumps(message)
+        if protocol.compress == 'none':
+            return data
+        data = data.encode()
+    if protocol.compress == 'zlib':
+        data = zlib.compress(data)
+    return data
+
+
+def decode(frame: Frame, protocol: Protocol) -> Dict:
+    """Client-side reference decoder."""
+    if protocol.compress == 'zlib':
+        frame = zlib.decompress(frame)
+    if protocol.encoding == 'msgpack':
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
+
+
+class Update:
+    """
+    One published state version with lazily encoded, shared frames.
+    """
+
+    def __init__(self, seq: int, state: Dict, previous: Optional['Update'] = None):
+        self.seq = seq
+        self.state = copy.deepcopy(state)
+        self._previous = previous
+        if previous is not None:
+            # Only one step of history is ever needed
+            previous._previous = None
+        self._delta: Optional[Dict] = None
+        self._frames: Dict[Tuple[Protocol, bool], Frame] = {}
+
+    def delta(self) -> Optional[Dict]:
+        """Delta message against the previous update (None for the first)."""
+        if self._delta is None:
+            if self._previous is None:
+                return None
+            changed, deleted = diff_state(self._previous.state, self.state)
+            self._delta = {'type': 'delta', 'seq': self.seq, 'base': self._previous.seq,
+                           'set': changed, 'del': deleted}
+            self._previous = None
+        return self._delta
+
+    def frame(self, protocol: Protocol, snapshot: bool = False) -> Frame:
+        """Encoded frame for a protocol; snapshot forces a full resync frame."""
+        if protocol.mode == 'full':
+            snapshot = True
+        key = (protocol, snapshot)
+        frame = self._frames.get(key)
+        if frame is None:
+            if protocol.mode == 'full':
+                message = self.state
+            elif snapshot or self.delta() is None:
+                message = {'type': 'snapshot', 'seq': self.seq, 'data': self.state}
+            else:
+                message = self.delta()
+            frame = encode(message, protocol)
+            self._frames[key] = frame
+        return frame
@@ -0,0 +1,193 @@
+"""
+Metrics Publishers
+==================
+
+Ways for the orchestrator to push metrics to the dashboard server.
+
+- HttpPublisher: POST /update over a pooled keep-alive session
+- WebSocketPublisher: one persistent WebSocket to /ingest
+- UnixSocketPublisher: newline-delimited JSON over a Unix domain socket
+  (server started with --unix-socket)
+- InProcessPublisher: orchestrator and FastAPI app in one process, handing
+  over metrics dicts on the server loop; no serialization or sockets at all
+
+Metrics with a "stream" key are routed to that stream by the server.
+
+All publishers are called from the orchestrator's reporting thread and keep
+their connection open between calls, so publish intervals well below a
+second are cheap. Socket publishers reconnect lazily after a failure.
+"""
+
+import json
+import socket
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from websockets.sync.client import connect as websocket_connect
+except ImportError:
+    websocket_connect = None
+
+PUBLISHERS = ('http', 'ws', 'unix', 'inprocess')
+
+
+class Publisher:
+    """Base class: deliver one metrics dict to the dashboard server."""
+
+    def publish(self, metrics: Dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HttpPublisher(Publisher):
+    """POST /update, reusing pooled keep-alive connections."""
+
+    def __init__(self, url: str = "http://localhost:8000/update", timeout: float = 1.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+    def publish(self, metrics: Dict):
+        response = self.session.post(self.url, json=metrics, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class WebSocketPublisher(Publisher):
+    """Push JSON frames over one persistent WebSocket to /ingest."""
+
+    def __init__(self, url: str = "ws://localhost:8000/ingest", timeout: float = 1.0):
+        if websocket_connect is None:
+            raise RuntimeError("WebSocketPublisher needs the websockets package")
+        self.url = url
+        self.timeout = timeout
+        self._connection = None
+
+    def publish(self, metrics: Dict):
+        if self._connection is None:
+            self._connection = websocket_connect(self.url, open_timeout=self.timeout)
+        try:
+            self._connection.send(json.dumps(metrics))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            finally:
+                self._connection = None
+
+
+class UnixSocketPublisher(Publisher):
+    """Push newline-delimited JSON over a Unix domain stream socket."""
+
+    def __init__(self, path: str = "/tmp/attribution-dashboard.sock", timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+
+    def publish(self, metrics: Dict):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+        try:
+            self._sock.sendall(json.dumps(metrics).encode() + b'\n')
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class InProcessPublisher(Publisher):
+    """
+    Hand metrics to the server's event loop without serialization.
+
+    Only the newest metrics of each stream (metrics["stream"]) are kept
+    pending: a publish replaces that stream's pending entry, since each one
+    is a full state. Streams are applied in the order they became pending,
+    so a stream publishing often cannot crowd out the others.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 handler: Callable[[Dict], Awaitable]):
+        """
+        Args:
+            loop: The server's running event loop
+            handler: Coroutine function applying one metrics dict (the
+                server's apply_update)
+        """
+        self.loop = loop
+        self.handler = handler
+        self.pending: Dict[Optional[str], Dict] = {}
+        self.replaced = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._started = threading.Event()
+        loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        self._task = self.loop.create_task(self._consume())
+        self._started.set()
+
+    async def _consume(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.pending:
+                stream = next(iter(self.pending))
+                metrics = self.pending.pop(stream)
+                try:
+                    await self.handler(metrics)
+                except Exception as e:
+                    print(f"In-process publish error: {e}")
+
+    def _offer(self, metrics: Dict):
+        stream = metrics.get("stream")
+        if stream in self.pending:
+            self.replaced += 1
+        # Replacing keeps the stream's place in line
+        self.pending[stream] = metrics
+        self._ready.set()
+
+    def publish(self, metrics: Dict):
+        self.loop.call_soon_threadsafe(self._offer, metrics)
+
+    def close(self):
+        if self._started.is_set() and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._task.cancel)
+
+
+def make_publisher(kind: str, url: Optional[str] = None, **kwargs) -> Publisher:
+    """
+    Build a socket publisher by name ('http', 'ws' or 'unix'); 'inprocess'
+    needs the server's loop and is created by the process hosting the app.
+    """
+    if kind == 'http':
+        return HttpPublisher(url or "http://localhost:8000/update", **kwargs)
+    if kind == 'ws':
+        return WebSocketPublisher(url or "ws://localhost:8000/ingest", **kwargs)
+    if kind == 'unix':
+        return UnixSocketPublisher(url or "/tmp/attribution-dashboard.sock", **kwargs)
+    raise ValueError(f"Unknown publisher: {kind} (expected one of {PUBLISHERS[:3]})")
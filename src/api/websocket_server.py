@@ -4,15 +4,36 @@ WebSocket Server for Real-Time Attribution
 
 FastAPI server that broadcasts attribution updates and campaign health
 metrics to connected React clients.
+
+Updates belong to a stream (an advertiser, tenant or live event; "default"
+unless the update names one). Each stream keeps its own metrics and
+subscribers: /ws/{stream} clients only receive that stream's frames, so
+a busy stream's broadcasts never touch other streams' clients. Streams
+with no clients and no updates for --stream-idle-timeout seconds are
+dropped. /ws is the default stream.
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+import os
+import sys
 import json
 import asyncio
+import argparse
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 import uvicorn
+import numpy as np
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from api.protocol import Protocol, Update
+from engine.registry import validate_stream_id
+from engine.scheduler import PublishScheduler
+from telemetry.histogram import REGISTRY, histogram_if
+from telemetry.timeseries import TimeSeriesStore
 
 app = FastAPI()
 
@@ -25,28 +46,169 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class ClientConnection:
+    """
+    One dashboard socket with a bounded outbound queue drained by its own
+    writer task, so a slow client only delays itself.
+    """
+
+    def __init__(self, websocket: WebSocket, protocol: Protocol, queue_size: int,
+                 timed: bool = False):
+        """
+        Args:
+            timed: Queue (frame, enqueue time) pairs so the writer can
+                record queue-to-send latency
+        """
+        self.websocket = websocket
+        self.protocol = protocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.timed = timed
+        self.dropped_frames = 0
+        self.bytes_sent = 0
+
+    def offer(self, update: Update):
+        """Queue an update's frame without waiting; if full, drop the stale frames."""
+        snapshot = False
+        if self.queue.full():
+            # Replace the backlog with one snapshot, which also resyncs delta clients
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped_frames += 1
+            snapshot = True
+        self.put(update.frame(self.protocol, snapshot=snapshot))
+
+    def put(self, frame):
+        self.queue.put_nowait((frame, time.perf_counter()) if self.timed else frame)
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size: int = 8, send_timeout: float = 10.0, instrument: bool = False):
+        """
+        Args:
+            queue_size: Frames buffered per client before conflation
+            send_timeout: Seconds a single send may take before the client
+                is dropped
+            instrument: Record publish/send latency histograms
+        """
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.latest: Optional[Update] = None
+        self.seq = 0
+        self.instrument(instrument)
+
+    def instrument(self, enabled: bool = True):
+        """Turn latency histograms on or off (affects clients connecting later)."""
+        self._publish_hist = histogram_if(enabled, 'ws_publish_seconds',
+                                          'Duration of one publish to all client queues')
+        self._send_hist = histogram_if(enabled, 'ws_send_seconds',
+                                       'Frame enqueue to socket send completion')
+        self._event_hist = histogram_if(enabled, 'ws_event_to_publish_seconds',
+                                        'Oldest scored event generation to dashboard publish')
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, protocol: Protocol = Protocol()):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, protocol, self.queue_size,
+                                  timed=self._send_hist is not None)
+        if self.latest is not None:
+            client.put(self.latest.frame(protocol, snapshot=True))
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None and client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    async def _writer(self, client: ClientConnection):
+        try:
+            while True:
+                frame = await client.queue.get()
+                if client.timed:
+                    frame, enqueued = frame
+                if isinstance(frame, bytes):
+                    send = client.websocket.send_bytes(frame)
+                else:
+                    send = client.websocket.send_text(frame)
+                await asyncio.wait_for(send, self.send_timeout)
+                client.bytes_sent += len(frame)
+                if client.timed and self._send_hist is not None:
+                    self._send_hist.record(time.perf_counter() - enqueued)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Broken or stalled socket: drop the client
+            self.disconnect(client.websocket)
             try:
-                await connection.send_text(message)
+                await client.websocket.close()
             except Exception:
-                # Remove stale connections
-                self.active_connections.remove(connection)
+                pass
+
+    async def publish(self, state: Dict):
+        """
+        Publish a new state version to every client's queue.
+
+        Frames are encoded once per protocol variant in use, not per client.
+        """
+        if self._publish_hist is not None:
+            start = time.perf_counter()
+        self.seq += 1
+        self.latest = Update(self.seq, state, previous=self.latest)
+        for client in list(self.clients.values()):
+            client.offer(self.latest)
+        if self._publish_hist is not None:
+            self._publish_hist.record(time.perf_counter() - start)
+            marks = state.get("latency_marks") or {}
+            if marks.get("oldest_event_at") is not None:
+                self._event_hist.record(time.time() - marks["oldest_event_at"])
+
+    def stats(self) -> Dict:
+        return {
+            "clients": len(self.clients),
+            "queued_frames": sum(c.queue.qsize() for c in self.clients.values()),
+            "dropped_frames": sum(c.dropped_frames for c in self.clients.values()),
+            "bytes_sent": sum(c.bytes_sent for c in self.clients.values()),
+            "seq": self.seq,
+        }
 
-manager = ConnectionManager()
+class StreamState:
+    """One stream's latest metrics and its subscribers."""
 
-# Global state for metrics
+    def __init__(self, metrics: Optional[Dict] = None):
+        self.manager = ConnectionManager(instrument=instrumented)
+        self.metrics: Dict = metrics if metrics is not None else {}
+        self.last_active = time.monotonic()
+
+    def idle_seconds(self, now: float) -> float:
+        return now - self.last_active
+
+DEFAULT_STREAM = "default"
+# Set by --latency (see instrument)
+instrumented = False
+# Streams without clients or updates for this long are dropped
+stream_idle_timeout = 300.0
+
+# Every default-stream update is recorded for /history (see configure_history)
+history = TimeSeriesStore()
+
+def configure_history(directory: Optional[str]):
+    """Spill history to files in directory (and load what is there)."""
+    global history
+    history = TimeSeriesStore(directory=directory)
+
+def instrument(enabled: bool = True):
+    """Turn latency histograms on or off for all streams."""
+    global instrumented
+    instrumented = enabled
+    for state in streams.values():
+        state.manager.instrument(enabled)
+
+# Global state for metrics (the default stream)
 current_metrics = {
     "attribution": {
         "Search": 0.25,
@@ -64,41 +226,193 @@ current_metrics = {
     "events_sec": 0,
     "timestamp": time.time()
 }
+streams: Dict[str, StreamState] = {DEFAULT_STREAM: StreamState(current_metrics)}
+manager = streams[DEFAULT_STREAM].manager
+
+def get_stream(stream: str) -> StreamState:
+    """The stream's state, created on first use (ValueError for a bad id)."""
+    state = streams.get(stream)
+    if state is None:
+        state = streams[validate_stream_id(stream)] = StreamState()
+    return state
+
+def evict_idle_streams(now: Optional[float] = None) -> List[str]:
+    """Drop streams (except the default) with no clients that stopped updating."""
+    now = time.monotonic() if now is None else now
+    idle = [stream for stream, state in streams.items()
+            if stream != DEFAULT_STREAM and not state.manager.clients
+            and state.idle_seconds(now) >= stream_idle_timeout]
+    for stream in idle:
+        del streams[stream]
+    return idle
 
 @app.get("/")
 async def get():
-    return {"status": "online", "message": "Real-time Attribution Server"}
+    return {"status": "online", "message": "Real-time Attribution Server", "connections": manager.stats(),
+            "streams": len(streams)}
+
+@app.get("/streams")
+async def list_streams():
+    """Known streams with their subscriber stats and seconds since last active."""
+    now = time.monotonic()
+    return {stream: {**state.manager.stats(), "idle_seconds": state.idle_seconds(now)}
+            for stream, state in streams.items()}
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    await subscribe(websocket, DEFAULT_STREAM)
+
+@app.websocket("/ws/{stream}")
+async def stream_websocket_endpoint(websocket: WebSocket, stream: str):
+    await subscribe(websocket, stream)
+
+async def subscribe(websocket: WebSocket, stream: str):
+    # Opt-in compact protocol: /ws?mode=delta&encoding=msgpack&compress=zlib
+    try:
+        protocol = Protocol.from_params(websocket.query_params)
+        state = get_stream(stream)
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+        return
+    if state.manager.latest is None and state.metrics:
+        await state.manager.publish(state.metrics)
+    await state.manager.connect(websocket, protocol)
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        state.manager.disconnect(websocket)
+        state.last_active = time.monotonic()
+
+async def apply_update(data: Dict, stream: Optional[str] = None):
+    """
+    Merge a metrics update into its stream and push it to that stream's
+    clients (shared by all ingest paths).
+
+    Args:
+        data: Metrics; data["stream"] names the stream when stream is None
+        stream: Stream id (default: data["stream"], else the default stream)
+    """
+    stream = stream or data.get("stream") or DEFAULT_STREAM
+    state = get_stream(stream)
+    metrics = state.metrics
+    metrics.update(data)
+    metrics["stream"] = stream
+    metrics["timestamp"] = time.time()
+    state.last_active = time.monotonic()
+    if stream == DEFAULT_STREAM:
+        history.record(metrics, metrics["timestamp"])
+    if state.manager._publish_hist is not None:
+        # Server-side histograms join any the publisher sent
+        metrics["latency"] = {**(data.get("latency") or {}), **REGISTRY.summary()}
+    await state.manager.publish(metrics)
+
+@app.get("/metrics")
+async def metrics():
+    """Latency histograms in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+@app.get("/history")
+async def get_history(start: Optional[float] = None, end: Optional[float] = None,
+                      window: float = 3600.0, resolution: Optional[int] = None,
+                      fields: Optional[str] = None, max_points: int = 2000):
+    """
+    Recorded default-stream metrics between start and end (epoch seconds;
+    default: the last window seconds), e.g.
+    /history?window=86400&fields=attribution,health.
+
+    The resolution defaults to the finest tier (1s, 1min, 1h) that fits in
+    max_points; gaps are null.
+    """
+    end = time.time() if end is None else end
+    start = end - window if start is None else start
+    prefixes = [f for f in fields.split(',') if f] if fields else None
+    try:
+        result = history.query(start, end, resolution=resolution, prefixes=prefixes,
+                               max_points=max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "start": start,
+        "end": end,
+        "resolution": result['resolution'],
+        "timestamps": result['timestamps'].tolist(),
+        "series": {name: np.where(np.isnan(values), None, values).tolist()
+                   for name, values in result['series'].items()},
+    }
 
 # Endpoint for internal processes to update metrics
 @app.post("/update")
 async def update_metrics(data: Dict):
-    global current_metrics
-    current_metrics.update(data)
-    current_metrics["timestamp"] = time.time()
-    await manager.broadcast(json.dumps(current_metrics))
+    try:
+        await apply_update(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"status": "success"}
 
-async def mock_updater():
-    """Periodically drift metrics for visual demo if no real source is active."""
+@app.post("/update/{stream}")
+async def update_stream_metrics(stream: str, data: Dict):
+    try:
+        await apply_update(data, stream)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success"}
+
+# Persistent push channel for publishers (see api/publishers.py)
+@app.websocket("/ingest")
+async def ingest_endpoint(websocket: WebSocket):
+    await ingest(websocket, None)
+
+@app.websocket("/ingest/{stream}")
+async def stream_ingest_endpoint(websocket: WebSocket, stream: str):
+    await ingest(websocket, stream)
+
+async def ingest(websocket: WebSocket, stream: Optional[str]):
+    await websocket.accept()
+    try:
+        while True:
+            await apply_update(json.loads(await websocket.receive_text()), stream)
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+
+async def handle_unix_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Newline-delimited JSON updates from a UnixSocketPublisher."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                await apply_update(json.loads(line))
+            except ValueError as e:
+                print(f"Rejected Unix socket update: {e}")
+    finally:
+        writer.close()
+
+# Set by --unix-socket to also accept updates on a Unix domain socket
+unix_socket_path: Optional[str] = None
+unix_server: Optional[asyncio.AbstractServer] = None
+reaper_task: Optional[asyncio.Task] = None
+
+async def mock_updater(scheduler: Optional[PublishScheduler] = None):
+    """
+    Drift metrics for visual demo if no real source is active, broadcasting
+    only when the shares moved past the scheduler's epsilon (or on its
+    heartbeat).
+    """
     import random
+    scheduler = scheduler or PublishScheduler(min_interval=0.5, max_interval=5.0, epsilon=0.01)
     while True:
         if not manager.active_connections:
-            await asyncio.sleep(5)
+            await asyncio.sleep(scheduler.max_interval)
             continue
             
         # Simulate slight changes
         for channel in current_metrics["attribution"]:
-            current_metrics["attribution"][channel] += random.uniform(-0.02, 0.02)
+            current_metrics["attribution"][channel] += random.uniform(-0.005, 0.005)
         
         # Normalize
         total = sum(current_metrics["attribution"].values())
@@ -108,14 +422,49 @@ async def mock_updater():
         current_metrics["health"]["fill_rate"] = random.uniform(0.85, 0.98)
         current_metrics["events_sec"] = random.randint(180000, 220000)
         
-        await manager.broadcast(json.dumps(current_metrics))
-        await asyncio.sleep(5)
+        if scheduler.should_publish(current_metrics["attribution"]):
+            await manager.publish(current_metrics)
+        await asyncio.sleep(scheduler.min_interval)
+
+async def stream_reaper():
+    """Periodically drop idle streams."""
+    while True:
+        await asyncio.sleep(max(1.0, stream_idle_timeout / 4))
+        evict_idle_streams()
 
 @app.on_event("startup")
 async def startup_event():
     # Optional: Start mock updater if you want the dashboard to look alive immediately
     # asyncio.create_task(mock_updater())
-    pass
+    global unix_server, reaper_task
+    if unix_socket_path:
+        if os.path.exists(unix_socket_path):
+            os.unlink(unix_socket_path)
+        unix_server = await asyncio.start_unix_server(handle_unix_client, path=unix_socket_path)
+    reaper_task = asyncio.create_task(stream_reaper())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    history.flush()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description='Real-time attribution WebSocket server')
+    parser.add_argument('--host', type=str, default="0.0.0.0",
+                        help='Bind address (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port (default: 8000)')
+    parser.add_argument('--unix-socket', type=str, default=None,
+                        help='Also accept metrics updates on this Unix socket path')
+    parser.add_argument('--latency', action='store_true',
+                        help='Record latency histograms (/metrics and payload "latency")')
+    parser.add_argument('--history-dir', type=str, default=None,
+                        help='Persist /history beyond the in-memory rings to files here')
+    parser.add_argument('--stream-idle-timeout', type=float, default=300.0,
+                        help='Seconds before a stream without clients or updates is dropped (default: 300)')
+
+    args = parser.parse_args()
+    unix_socket_path = args.unix_socket
+    stream_idle_timeout = args.stream_idle_timeout
+    configure_history(args.history_dir)
+    instrument(args.latency)
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,511 @@
+"""
+Benchmark Suite
+===============
+
+One command for the throughput and latency numbers the README quotes:
+
+- engine:    process_conversion / process_conversions_batch paths/sec across
+             channel counts and path lengths
+- scoring:   get_current_scores latency as the transition matrix grows
+- simulator: EventStreamSimulator events/sec (per-event and batch paths)
+- broadcast: ConnectionManager.publish fan-out latency to N local
+             WebSocket clients (real sockets through uvicorn)
+- history:   TimeSeriesStore samples/sec and /history range-query latency
+             (24h chart from memory and from the spill files)
+- source:    FileSource consumer pipeline messages/sec (poll, parse,
+             attribute, commit) by worker count over 8 partitions
+
+Results are written as JSON. Given a baseline file from an earlier run,
+each result is compared by name and any that got worse by more than the
+tolerance is flagged; the exit status is 1 when something regressed.
+
+Usage:
+    python src/benchmarks/run_benchmarks.py --output bench.json
+    python src/benchmarks/run_benchmarks.py --baseline bench.json --output new.json
+    python src/benchmarks/run_benchmarks.py --quick --suite engine --suite scoring
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.streaming_attribution import StreamingAttributionEngine
+from simulator.event_generator import EventStreamSimulator, EVENT_TYPES, EVENT_WEIGHTS
+from telemetry.timeseries import TimeSeriesStore
+
+SUITES = ('engine', 'scoring', 'simulator', 'broadcast', 'history', 'source')
+
+
+def result(name: str, value: float, unit: str, higher_is_better: bool, spread: float) -> Dict:
+    """
+    One benchmark result; spread is its relative run-to-run noise, which
+    widens the regression threshold for this result.
+    """
+    return dict(name=name, value=value, unit=unit, higher_is_better=higher_is_better, spread=spread)
+
+
+def best_of(repeat: int, fn: Callable[[], float]):
+    """
+    Fastest of several timed runs (seconds), the least noisy estimate.
+
+    Returns:
+        (best, spread) with spread the median's relative distance from best
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        times.append(fn())
+    best = min(times)
+    return best, float(np.median(times)) / best - 1
+
+
+def throughput(name: str, count: int, unit: str, timing) -> Dict:
+    best, spread = timing
+    return result(name, count / best, unit, True, spread)
+
+
+def latency_results(name: str, tag: str, seconds: List[float]) -> List[Dict]:
+    """p50 and p99 in ms; the spread is the interquartile range relative to p50."""
+    p25, p50, p75, p99 = np.percentile(seconds, [25, 50, 75, 99])
+    spread = float((p75 - p25) / p50)
+    return [result(f"{name}.p50{tag}", 1000 * float(p50), 'ms', False, spread),
+            result(f"{name}.p99{tag}", 1000 * float(p99), 'ms', False, 2 * spread)]
+
+
+def make_batch(n_paths: int, n_channels: int, path_len: int, seed: int):
+    """Fixed-length encoded paths (channel_idx, offsets, values)."""
+    rng = np.random.default_rng(seed)
+    channel_idx = rng.integers(0, n_channels, size=n_paths * path_len).astype(np.int16)
+    offsets = np.arange(0, n_paths * path_len + 1, path_len, dtype=np.int64)
+    values = rng.uniform(10, 500, size=n_paths)
+    return channel_idx, offsets, values
+
+
+def bench_engine(quick: bool, repeat: int) -> List[Dict]:
+    n_paths = 20000 if quick else 100000
+    results = []
+    for n_channels in (4, 16, 64):
+        channels = [f"channel_{i:03d}" for i in range(n_channels)]
+        for path_len in (1, 4, 16):
+            channel_idx, offsets, values = make_batch(n_paths, n_channels, path_len, seed=n_channels + path_len)
+            paths = [[channels[c] for c in channel_idx[offsets[i]:offsets[i + 1]]] for i in range(n_paths)]
+            tag = f"[channels={n_channels},path_len={path_len}]"
+
+            def per_call():
+                engine = StreamingAttributionEngine(channels)
+                start = time.perf_counter()
+                for path, value in zip(paths, values):
+                    engine.process_conversion(path, value)
+                return time.perf_counter() - start
+
+            def batched():
+                engine = StreamingAttributionEngine(channels)
+                start = time.perf_counter()
+                engine.process_conversions_batch(channel_idx, offsets, values)
+                return time.perf_counter() - start
+
+            results.append(throughput(f"engine.process_conversion{tag}", n_paths, 'paths/sec',
+                                      best_of(repeat, per_call)))
+            results.append(throughput(f"engine.process_conversions_batch{tag}", n_paths, 'paths/sec',
+                                      best_of(repeat, batched)))
+
+    # Higher-order chains: state interning on top of the first-order update
+    n_channels, path_len = 16, 4
+    channels = [f"channel_{i:03d}" for i in range(n_channels)]
+    channel_idx, offsets, values = make_batch(n_paths, n_channels, path_len, seed=n_channels + path_len)
+    paths = [[channels[c] for c in channel_idx[offsets[i]:offsets[i + 1]]] for i in range(n_paths)]
+    for order in (2, 3):
+        tag = f"[channels={n_channels},path_len={path_len},order={order}]"
+
+        def per_call():
+            engine = StreamingAttributionEngine(channels, markov_order=order)
+            start = time.perf_counter()
+            for path, value in zip(paths, values):
+                engine.process_conversion(path, value)
+            return time.perf_counter() - start
+
+        def batched():
+            engine = StreamingAttributionEngine(channels, markov_order=order)
+            start = time.perf_counter()
+            for i in range(0, n_paths, 1000):
+                engine.process_conversions_batch(channel_idx, offsets[i:i + 1001], values[i:i + 1000])
+            return time.perf_counter() - start
+
+        results.append(throughput(f"engine.process_conversion{tag}", n_paths, 'paths/sec',
+                                  best_of(repeat, per_call)))
+        results.append(throughput(f"engine.process_conversions_batch{tag}", n_paths, 'paths/sec',
+                                  best_of(repeat, batched)))
+
+    # Bootstrap replicates on the first-order update
+    for n_channels in (4, 16):
+        channels = [f"channel_{i:03d}" for i in range(n_channels)]
+        channel_idx, offsets, values = make_batch(n_paths, n_channels, path_len, seed=n_channels + path_len)
+        paths = [[channels[c] for c in channel_idx[offsets[i]:offsets[i + 1]]] for i in range(n_paths)]
+        for replicates in (32, 64):
+            tag = f"[channels={n_channels},path_len={path_len},bootstrap={replicates}]"
+
+            def per_call():
+                engine = StreamingAttributionEngine(channels, bootstrap_replicates=replicates, bootstrap_seed=0)
+                start = time.perf_counter()
+                for path, value in zip(paths, values):
+                    engine.process_conversion(path, value)
+                engine.get_current_scores()
+                return time.perf_counter() - start
+
+            def batched():
+                engine = StreamingAttributionEngine(channels, bootstrap_replicates=replicates, bootstrap_seed=0)
+                start = time.perf_counter()
+                for i in range(0, n_paths, 10000):
+                    engine.process_conversions_batch(channel_idx, offsets[i:i + 10001], values[i:i + 10000])
+                return time.perf_counter() - start
+
+            results.append(throughput(f"engine.process_conversion{tag}", n_paths, 'paths/sec',
+                                      best_of(repeat, per_call)))
+            results.append(throughput(f"engine.process_conversions_batch{tag}", n_paths, 'paths/sec',
+                                      best_of(repeat, batched)))
+    return results
+
+
+def bench_scoring(quick: bool, repeat: int) -> List[Dict]:
+    """
+    get_current_scores latency per matrix size and transitions backend,
+    both after a small batch of new conversions (the dashboard's steady
+    state) and from cold.
+    """
+    calls = 50 if quick else 200
+    cases = [('dense', n) for n in (4, 16, 64)] + [('sparse', 64)]
+    if not quick:
+        cases += [('dense', 256), ('sparse', 256), ('sparse', 1024)]
+    results = []
+    for backend, n_channels in cases:
+        channels = [f"channel_{i:03d}" for i in range(n_channels)]
+        engine = StreamingAttributionEngine(channels, transitions_backend=backend)
+        engine.process_conversions_batch(*make_batch(50000, n_channels, 4, seed=n_channels))
+        engine.get_current_scores()
+
+        latencies = []
+        for i in range(calls + 10):
+            engine.process_conversions_batch(*make_batch(100, n_channels, 4, seed=i))
+            start = time.perf_counter()
+            engine.get_current_scores()
+            latencies.append(time.perf_counter() - start)
+        latencies = latencies[10:]  # warm-up
+
+        def cold():
+            fresh = StreamingAttributionEngine(channels, transitions_backend=backend)
+            fresh.load_state(engine.export_state())
+            start = time.perf_counter()
+            fresh.get_current_scores()
+            return time.perf_counter() - start
+
+        tag = f"[channels={n_channels}]" if backend == 'dense' else f"[channels={n_channels},backend={backend}]"
+        results.extend(latency_results("scoring.get_current_scores", tag, latencies))
+        best, spread = best_of(repeat, cold)
+        results.append(result(f"scoring.get_current_scores.cold{tag}", 1000 * best, 'ms', False, spread))
+    return results
+
+
+def bench_simulator(quick: bool, repeat: int) -> List[Dict]:
+    n_events = 50000 if quick else 200000
+    n_batch = 200000 if quick else 1000000
+
+    def per_event():
+        sim = EventStreamSimulator(seed=7)
+        rng = random.Random(7)
+        start = time.perf_counter()
+        for event_type in rng.choices(EVENT_TYPES, weights=EVENT_WEIGHTS, k=n_events):
+            if event_type == 'impression':
+                sim.generate_impression_event()
+            else:
+                user_id = sim.random_active_user()
+                if user_id is not None:
+                    if event_type == 'click':
+                        sim.generate_click_event(user_id)
+                    else:
+                        sim.generate_conversion_event(user_id)
+        return time.perf_counter() - start
+
+    def batched():
+        sim = EventStreamSimulator(seed=7)
+        start = time.perf_counter()
+        for _ in range(0, n_batch, 100000):
+            sim.generate_batch(100000)
+        return time.perf_counter() - start
+
+    return [
+        throughput("simulator.per_event", n_events, 'events/sec', best_of(repeat, per_event)),
+        throughput("simulator.generate_batch", n_batch, 'events/sec', best_of(repeat, batched)),
+    ]
+
+
+def bench_broadcast(quick: bool, repeat: int) -> List[Dict]:
+    return asyncio.run(_bench_broadcast(quick))
+
+
+async def _bench_broadcast(quick: bool) -> List[Dict]:
+    """
+    Serve the dashboard app on a free local port, connect N clients to /ws
+    and time each publish until every client has received the frame. Then
+    time a quiet stream's publishes while another stream broadcasts to
+    many clients nonstop.
+    """
+    import uvicorn
+    from websockets.asyncio.client import connect
+    from api import websocket_server
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(websocket_server.app, host='127.0.0.1', port=port,
+                                           log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    manager = websocket_server.manager
+    state = dict(websocket_server.current_metrics)
+    state['attribution'] = {f"channel_{i:03d}": 1 / 16 for i in range(16)}
+    publishes = 50 if quick else 200
+    results = []
+    try:
+        for n_clients in ((1, 10, 50) if quick else (1, 10, 100)):
+            clients = [await connect(f"ws://127.0.0.1:{port}/ws", max_size=None)
+                       for _ in range(n_clients)]
+            for client in clients:
+                await client.recv()
+            latencies = []
+            for i in range(publishes + 5):
+                state['events_sec'] = i
+                start = time.perf_counter()
+                await manager.publish(state)
+                await asyncio.gather(*(client.recv() for client in clients))
+                latencies.append(time.perf_counter() - start)
+            latencies = latencies[5:]  # warm-up
+            for client in clients:
+                await client.close()
+
+            results.extend(latency_results("broadcast.fanout", f"[clients={n_clients}]", latencies))
+
+        # Stream isolation: one quiet-stream client while a busy stream
+        # fans out to many
+        busy_clients = 50 if quick else 100
+        busy = [await connect(f"ws://127.0.0.1:{port}/ws/busy", max_size=None) for _ in range(busy_clients)]
+        quiet = await connect(f"ws://127.0.0.1:{port}/ws/quiet", max_size=None)
+        flooding = True
+
+        async def flood():
+            i = 0
+            while flooding:
+                i += 1
+                await websocket_server.apply_update({**state, 'events_sec': i}, 'busy')
+                await asyncio.gather(*(client.recv() for client in busy))
+
+        async def drain():
+            # Conflation may have dropped frames; wait for the flood to stop
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.gather(*(client.recv() for client in busy)), 0.5)
+                except asyncio.TimeoutError:
+                    return
+
+        flooder = asyncio.create_task(flood())
+        latencies = []
+        for i in range(publishes + 5):
+            start = time.perf_counter()
+            await websocket_server.apply_update({**state, 'events_sec': i}, 'quiet')
+            await quiet.recv()
+            latencies.append(time.perf_counter() - start)
+        flooding = False
+        await flooder
+        await drain()
+        for client in busy + [quiet]:
+            await client.close()
+        results.extend(latency_results("broadcast.stream_isolation", f"[busy_clients={busy_clients}]",
+                                       latencies[5:]))
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+def bench_history(quick: bool, repeat: int) -> List[Dict]:
+    """One sample per second for two days (one in quick mode), then 24h queries."""
+    import tempfile
+    n_samples = 86400 if quick else 2 * 86400
+    channels = [f"channel_{i:03d}" for i in range(16)]
+    rng = np.random.default_rng(3)
+    shares = rng.dirichlet(np.ones(16), size=1024)
+    samples = [{
+        'attribution': dict(zip(channels, row.tolist())),
+        'health': {'fill_rate': 0.94, 'ctr': 0.023, 'conversion_rate': 0.051, 'frequency_avg': 2.1},
+        'events_sec': 200000.0,
+    } for row in shares]
+    end = 1.7e9 + n_samples
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        def record():
+            store = TimeSeriesStore(directory=directory)
+            start = time.perf_counter()
+            for i in range(n_samples):
+                store.record(samples[i % len(samples)], 1.7e9 + i)
+            elapsed = time.perf_counter() - start
+            store.flush()
+            return elapsed
+        results.append(throughput("history.record", n_samples, 'samples/sec', best_of(1, record)))
+        for source, store in (('memory', None), ('disk', TimeSeriesStore(directory=directory))):
+            if store is None:
+                store = TimeSeriesStore()
+                for i in range(n_samples):
+                    store.record(samples[i % len(samples)], 1.7e9 + i)
+            latencies = []
+            for _ in range(20 if quick else 100):
+                start = time.perf_counter()
+                store.query(end - 86400, end)
+                latencies.append(time.perf_counter() - start)
+            results.extend(latency_results("history.query_24h", f"[{source}]", latencies))
+    return results
+
+
+def bench_source(quick: bool, repeat: int) -> List[Dict]:
+    """Consume a simulated 8-partition file topic from the start, per worker count."""
+    import tempfile
+    from engine.pipeline import Pipeline, ConsumerStage, AttributeStage, CommitStage
+    from engine.sources import FileSource, produce_simulated
+    n_events = 100000 if quick else 1000000
+    channels = ["Search", "Social", "Display", "Email"]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        produce_simulated(FileSource(directory, 8), n_events, seed=11)
+        for workers in (1, 2, 4):
+            def consume():
+                # A fresh group each run, so every run reads the whole topic
+                source = FileSource(directory, group=f"bench-{time.monotonic_ns()}")
+                pipeline = Pipeline([ConsumerStage(source, channels, workers, follow=False),
+                                     AttributeStage(StreamingAttributionEngine(channels)),
+                                     CommitStage(source)])
+                start = time.perf_counter()
+                asyncio.run(pipeline.run())
+                return time.perf_counter() - start
+            results.append(throughput(f"source.file_consume[workers={workers}]", n_events, 'messages/sec',
+                                      best_of(repeat, consume)))
+    return results
+
+
+BENCHMARKS = {
+    'engine': bench_engine,
+    'scoring': bench_scoring,
+    'simulator': bench_simulator,
+    'broadcast': bench_broadcast,
+    'history': bench_history,
+    'source': bench_source,
+}
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.time(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[Dict]:
+    """
+    Compare results with a baseline run by name.
+
+    A result regresses when it is worse by more than tolerance plus the
+    larger of the two runs' measured spreads, so noisy latency tails need
+    a bigger slowdown to be flagged than stable throughput numbers.
+
+    Returns:
+        One entry per shared benchmark with baseline, change (fractional,
+        positive is better), threshold and regressed
+    """
+    previous = {r['name']: r for r in baseline.get('results', [])}
+    comparison = []
+    for r in results:
+        old = previous.get(r['name'])
+        if old is None or not old['value']:
+            continue
+        if r['higher_is_better']:
+            change = r['value'] / old['value'] - 1
+        else:
+            change = old['value'] / r['value'] - 1 if r['value'] else 0.0
+        threshold = tolerance + max(r.get('spread', 0.0), old.get('spread', 0.0))
+        comparison.append({'name': r['name'], 'baseline': old['value'], 'value': r['value'],
+                           'change': change, 'threshold': threshold, 'regressed': change < -threshold})
+    return comparison
+
+
+def run(suites: List[str], quick: bool = False, repeat: int = 3) -> Dict:
+    report = {'environment': environment(), 'quick': quick, 'results': []}
+    for suite in suites:
+        start = time.perf_counter()
+        suite_results = BENCHMARKS[suite](quick, repeat)
+        for r in suite_results:
+            print(f"  {r['name']:<60} {r['value']:>14,.3f} {r['unit']}")
+        print(f"[{suite}] {len(suite_results)} results in {time.perf_counter() - start:.1f}s")
+        report['results'].extend(suite_results)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the benchmark suite')
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help='Suite to run (repeatable; default: all)')
+    parser.add_argument('--quick', action='store_true',
+                        help='Smaller workloads for a fast smoke run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timed runs per throughput benchmark, best kept (default: 3)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write results JSON here')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed slowdown before a result is flagged (default: 0.10)')
+
+    args = parser.parse_args()
+    report = run(args.suite or list(SUITES), quick=args.quick, repeat=args.repeat)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment'),
+                              'tolerance': args.tolerance}
+        report['comparison'] = compare(report['results'], baseline, args.tolerance)
+        print(f"\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for c in report['comparison']:
+            flag = "REGRESSED" if c['regressed'] else ""
+            print(f"  {c['name']:<60} {c['change']:>+8.1%} (allowed -{c['threshold']:.0%}) {flag}")
+        regressions = [c for c in report['comparison'] if c['regressed']]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed")
+        sys.exit(1)
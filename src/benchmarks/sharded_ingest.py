@@ -0,0 +1,89 @@
+"""
+Sharded Ingestion Benchmark
+===========================
+
+Measures conversion paths/sec of ShardedAttributionEngine for an increasing
+number of shards, against a single in-process StreamingAttributionEngine.
+
+Usage:
+    python src/benchmarks/sharded_ingest.py --paths 2000000 --max-shards 4
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.streaming_attribution import StreamingAttributionEngine
+from engine.sharded_engine import ShardedAttributionEngine
+
+
+def make_batches(n_paths: int, n_channels: int, max_path_len: int, batch_size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    batches = []
+    for start in range(0, n_paths, batch_size):
+        size = min(batch_size, n_paths - start)
+        lengths = rng.integers(1, max_path_len + 1, size=size)
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        idx = rng.integers(0, n_channels, size=int(offsets[-1]))
+        user_ids = rng.integers(1000000, 9999999, size=size)
+        values = rng.uniform(10, 500, size=size)
+        batches.append((user_ids, idx, offsets, values))
+    return batches
+
+
+def run(n_paths: int, n_channels: int, max_path_len: int, batch_size: int,
+        max_shards: int, seed: int, **engine_kwargs):
+    channels = [f"channel_{i:03d}" for i in range(n_channels)]
+    batches = make_batches(n_paths, n_channels, max_path_len, batch_size, seed)
+
+    engine = StreamingAttributionEngine(channels, **engine_kwargs)
+    start = time.perf_counter()
+    for _, idx, offsets, values in batches:
+        engine.process_conversions_batch(idx, offsets, values)
+    single = n_paths / (time.perf_counter() - start)
+    print(f"Paths: {n_paths:,} | Channels: {n_channels} | Batch size: {batch_size:,} "
+          f"| CPUs: {os.cpu_count()}")
+    print(f"  in-process engine:  {single:>14,.0f} paths/sec")
+
+    shards = 1
+    while shards <= max_shards:
+        with ShardedAttributionEngine(channels, n_shards=shards, **engine_kwargs) as sharded:
+            start = time.perf_counter()
+            for user_ids, idx, offsets, values in batches:
+                sharded.process_conversions_batch(user_ids, idx, offsets, values)
+            sharded.flush(timeout=600)
+            rate = n_paths / (time.perf_counter() - start)
+            merged = sharded.get_current_scores()
+        assert round(merged['total_conversions']) == n_paths
+        print(f"  {shards:>2} shard(s):        {rate:>14,.0f} paths/sec ({rate / single:.2f}x)")
+        shards *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sharded ingestion scaling')
+    parser.add_argument('--paths', type=int, default=2000000,
+                        help='Number of conversion paths (default: 2000000)')
+    parser.add_argument('--channels', type=int, default=4,
+                        help='Number of channels (default: 4)')
+    parser.add_argument('--max-path-len', type=int, default=5,
+                        help='Maximum touchpoints per path (default: 5)')
+    parser.add_argument('--batch-size', type=int, default=20000,
+                        help='Paths per batch call (default: 20000)')
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count() or 1,
+                        help='Largest shard count to try (default: CPU count)')
+    parser.add_argument('--half-life', type=float, default=None,
+                        help='Optional decay half-life for shard engines')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    kwargs = {'decay_half_life': args.half_life} if args.half_life else {}
+    run(args.paths, args.channels, args.max_path_len, args.batch_size,
+        args.max_shards, args.seed, **kwargs)
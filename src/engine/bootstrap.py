@@ -0,0 +1,335 @@
+"""
+Streaming Poisson Bootstrap
+===========================
+
+Uncertainty for the Markov removal-effect attribution without storing
+paths. Each of B replicate transition matrices counts every conversion
+path with its own Poisson(1) weight, the online equivalent of resampling
+the paths with replacement. Scoring solves all replicates at once, and the
+spread of their channel shares gives per-channel intervals.
+
+Batch updates are kept to a few operations on small arrays:
+
+- identical paths share one draw, since the sum of m independent Poisson(1)
+  weights is Poisson(m); done when the taxonomy is small enough for
+  duplicates to be common, else the grouping costs more than it saves
+- Poisson weights are uint8 draws from 16-bit inverse-CDF lookup tables
+  (probabilities exact to 1/65536; the normal approximation for groups
+  larger than TABLE_MAX_MEAN)
+- the replicate deltas are one float32 (B x paths) @ (paths x transitions)
+  product when that matrix is small, else segment sums of the uint8
+  weight rows per transition (transitions radix-sorted as int16), in
+  narrow integer accumulators, block by block
+- single paths are buffered and applied as a batch
+
+The update still touches B weights per path transition, so its cost over
+the plain count update grows with B and with the number of distinct paths
+(roughly 1.3x at 4 channels; 4x at B=32 and 4.6x at B=64 with 16
+channels and 4-touch paths, where nearly every path is distinct).
+
+Counts are stored replicate-minor, (n_states, n_states, B), so a batch's
+deltas land as whole rows.
+"""
+
+import itertools
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# Largest (distinct paths x distinct transitions) matrix for the product
+MAX_DENSE_CELLS = 1 << 21
+# Weights gathered per block in the segment-sum fallback
+BLOCK_CELLS = 1 << 20
+
+
+def _poisson_table(max_mean: int) -> np.ndarray:
+    """Inverse CDFs of Poisson(1..max_mean) sampled at 2**16 points."""
+    k = np.arange(4 * max_mean + 32)
+    log_factorial = np.array([math.lgamma(int(i) + 1) for i in k])
+    table = np.empty((max_mean + 1, 1 << 16), dtype=np.uint8)
+    table[0] = 0
+    for mean in range(1, max_mean + 1):
+        cdf = np.cumsum(np.exp(k * math.log(mean) - mean - log_factorial)) * (1 << 16)
+        table[mean] = np.minimum(np.searchsorted(cdf, np.arange(1 << 16), side='right'), 255)
+    return table
+
+# Poisson(m) draws for multiplicities up to TABLE_MAX_MEAN are lookups;
+# larger ones use the normal approximation
+TABLE_MAX_MEAN = 32
+POISSON_TABLE = _poisson_table(TABLE_MAX_MEAN)
+
+
+def poisson_weights(rng: np.random.Generator, means: np.ndarray, n_replicates: int) -> np.ndarray:
+    """
+    Poisson draws for every replicate.
+
+    Args:
+        rng: Random generator
+        means: Integer mean per row (path multiplicity)
+        n_replicates: Draws per row
+
+    Returns:
+        Array (len(means), n_replicates) of draws: uint8, or int32 when
+        some mean exceeds TABLE_MAX_MEAN
+    """
+    u = rng.integers(0, 1 << 16, size=(len(means), n_replicates), dtype=np.uint16)
+    if (means == 1).all():
+        return POISSON_TABLE[1].take(u)
+    rows = np.minimum(means, TABLE_MAX_MEAN).astype(np.int32) << 16
+    weights = POISSON_TABLE.ravel().take(rows[:, None] | u)
+    large = np.flatnonzero(means > TABLE_MAX_MEAN)
+    if large.size:
+        weights = weights.astype(np.int32)
+        m = means[large, None].astype(np.float64)
+        z = rng.standard_normal((large.size, n_replicates))
+        weights[large] = np.maximum(np.rint(m + np.sqrt(m) * z), 0.0)
+    return weights
+
+
+def batch_removal_effects(counts: np.ndarray, n_channels: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Conversion probability and removal effects of many chains at once
+    (AbsorbingChainSolver's formulas, batched).
+
+    Args:
+        counts: Transition counts, shape (B, n_channels + 2, n_channels + 2)
+            with Start at n_channels and Conversion at n_channels + 1
+        n_channels: Number of channel states
+
+    Returns:
+        (conversion probability per chain, removal effects (B, n_channels))
+    """
+    m = n_channels + 1
+    sums = counts[:, :m].sum(axis=2, keepdims=True)
+    probs = counts[:, :m] / np.where(sums > 0, sums, 1)
+    A = np.eye(m) - probs[:, :, :m]
+    try:
+        N = np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+        N = np.linalg.pinv(A)
+    x = np.einsum('bij,bj->bi', N, probs[:, :, m])
+    base = x[:, n_channels]
+    diag = np.diagonal(N, axis1=1, axis2=2)[:, :n_channels]
+    removed = base[:, None] - N[:, n_channels, :n_channels] * x[:, :n_channels] / diag
+    safe = np.where(base > 0, base, 1)[:, None]
+    effects = np.where(base[:, None] > 0, np.clip(1.0 - removed / safe, 0.0, 1.0), 0.0)
+    return base, effects
+
+
+class PoissonBootstrap:
+    """
+    B replicate transition matrices with Poisson(1) path weights.
+    """
+
+    def __init__(self, n_channels: int, n_replicates: int = 64, seed: Optional[int] = None,
+                 flush_size: int = 4096):
+        """
+        Initialize replicates.
+
+        Args:
+            n_channels: Number of channel states (Start is index n_channels,
+                Conversion is index n_channels + 1)
+            n_replicates: Number of replicates B
+            seed: Random seed for the replicate weights
+            flush_size: Single paths buffered before they are applied as a batch
+        """
+        if n_replicates < 2:
+            raise ValueError("The bootstrap needs at least 2 replicates")
+        self.n_channels = n_channels
+        self.n_states = n_channels + 2
+        self.n_replicates = n_replicates
+        self.START_IDX = n_channels
+        self.CONV_IDX = n_channels + 1
+        self.counts = np.zeros((self.n_states, self.n_states, n_replicates))
+        self.rng = np.random.default_rng(seed)
+        self.flush_size = flush_size
+        self._pending: List[List[int]] = []
+        self._pending_weights: List[float] = []
+        # Bumped on every change; scoring skips the solve when unchanged
+        self.version = 0
+
+    def add_path(self, path: List[int], weight: float = 1.0):
+        """
+        Count one non-empty path of channel indices in every replicate.
+
+        Paths are buffered and applied flush_size at a time through the
+        batch update; reads flush first.
+        """
+        self._pending.append(path)
+        self._pending_weights.append(weight)
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+        self.version += 1
+
+    def flush(self):
+        """Apply buffered add_path calls."""
+        if not self._pending:
+            return
+        paths, weights = self._pending, np.asarray(self._pending_weights)
+        self._pending, self._pending_weights = [], []
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in paths], out=offsets[1:])
+        channel_idx = np.fromiter(itertools.chain.from_iterable(paths), dtype=np.int64,
+                                  count=offsets[-1])
+        path_weights = None if (weights == 1).all() else weights
+        self.apply_batch(self.prepare_batch(channel_idx, offsets, path_weights))
+
+    def prepare_batch(self, channel_idx: np.ndarray, offsets: np.ndarray,
+                      path_weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Replicate count deltas for a batch, without touching the replicates.
+
+        Args:
+            channel_idx: Flat channel indices of non-empty paths
+            offsets: Path boundaries into channel_idx (starting at 0)
+            path_weights: Decay weight per path (default: 1)
+
+        Returns:
+            (flat cell keys, deltas of shape (len(keys), B)) for apply_batch
+        """
+        B = self.n_replicates
+        n_paths = len(offsets) - 1
+        if path_weights is None and self.n_channels ** (channel_idx.size / n_paths) <= n_paths:
+            # Identical paths share one Poisson(multiplicity) draw
+            channel_idx, offsets, multiplicity = self._distinct_paths(channel_idx, offsets)
+            n_paths = len(multiplicity)
+        else:
+            multiplicity = np.ones(n_paths, dtype=np.int64)
+        weights = poisson_weights(self.rng, multiplicity, B)
+        if path_weights is not None:
+            weights = weights * path_weights[:, None].astype(np.float32)
+
+        n = self.n_states
+        lengths = np.diff(offsets)
+        last_pos = offsets[1:] - 1
+        interior = np.ones(channel_idx.size, dtype=bool)
+        interior[last_pos] = False
+        interior_pos = np.flatnonzero(interior)
+        flat = np.concatenate((
+            self.START_IDX * n + channel_idx[offsets[:-1]],
+            channel_idx[interior_pos] * n + channel_idx[interior_pos + 1],
+            channel_idx[last_pos] * n + self.CONV_IDX,
+        ))
+        path_of_pos = np.repeat(np.arange(n_paths), lengths)
+        owner = np.concatenate((np.arange(n_paths), path_of_pos[interior_pos], np.arange(n_paths)))
+        # Group by transition; int16 cells get NumPy's radix sort
+        order = np.argsort(flat.astype(np.int16) if n * n <= 1 << 15 else flat, kind='stable')
+        flat, owner = flat[order], owner[order]
+        heads = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1])))
+        keys = flat[heads]
+        k = len(keys)
+
+        if n_paths * k <= MAX_DENSE_CELLS:
+            # Transition counts per path, then one product for all replicates
+            cell = np.repeat(np.arange(k), np.diff(np.append(heads, len(flat))))
+            per_path = np.bincount(owner * k + cell, minlength=n_paths * k).astype(np.float32)
+            return keys, per_path.reshape(n_paths, k).T @ weights.astype(np.float32)
+        # Too many paths and transitions: sum weight rows per transition
+        if weights.dtype.kind == 'f':
+            delta = np.zeros((k, B), dtype=np.float32)
+        else:
+            delta = np.zeros((k, B), dtype=np.int64)
+            max_weight = int(weights.max()) or 1
+        rows = max(1, BLOCK_CELLS // B)
+        for start in range(0, len(owner), rows):
+            block = flat[start:start + rows]
+            block_heads = np.flatnonzero(np.concatenate(([True], block[1:] != block[:-1])))
+            acc = np.float32
+            if weights.dtype.kind != 'f':
+                # Narrowest accumulator the longest segment cannot overflow
+                longest = int(np.diff(np.append(block_heads, len(block))).max())
+                acc = np.uint16 if longest * max_weight < 1 << 16 else np.int64
+            sums = np.add.reduceat(weights[owner[start:start + rows]], block_heads, axis=0, dtype=acc)
+            delta[np.searchsorted(keys, block[block_heads])] += sums
+        return keys, delta
+
+    def _distinct_paths(self, channel_idx: np.ndarray,
+                        offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Collapse identical paths; paths too long for an int64 key stay
+        distinct.
+
+        Returns:
+            (channel_idx, offsets, multiplicity) of the distinct paths
+        """
+        lengths = np.diff(offsets)
+        n_paths = len(lengths)
+        base = self.n_channels + 1
+        max_digits = int(62 // math.log2(base))
+        digit = np.arange(channel_idx.size) - np.repeat(offsets[:-1], lengths)
+        powers = base ** np.arange(max_digits, dtype=np.int64)
+        # Digits are channel + 1, so a key encodes the path and its length
+        terms = (channel_idx.astype(np.int64) + 1) * powers[np.minimum(digit, max_digits - 1)]
+        path_keys = np.add.reduceat(terms, offsets[:-1])
+        too_long = lengths > max_digits
+        if too_long.any():
+            path_keys[too_long] = -1 - np.flatnonzero(too_long)
+        # Any member can represent its group, so an unstable sort will do
+        order = np.argsort(path_keys)
+        sorted_keys = path_keys[order]
+        group_start = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        first = order[group_start]
+        multiplicity = np.diff(np.append(group_start, n_paths))
+        distinct_lengths = lengths[first]
+        distinct_offsets = np.zeros(len(first) + 1, dtype=np.int64)
+        np.cumsum(distinct_lengths, out=distinct_offsets[1:])
+        # Gather the representative paths
+        starts = np.repeat(offsets[first] - distinct_offsets[:-1], distinct_lengths)
+        distinct_idx = channel_idx[np.arange(distinct_offsets[-1]) + starts]
+        return distinct_idx, distinct_offsets, multiplicity
+
+    def apply_batch(self, delta: Tuple[np.ndarray, np.ndarray], weight: float = 1.0):
+        keys, counts = delta
+        # keys are unique, so fancy-index += is safe
+        self.counts.reshape(-1, self.n_replicates)[keys] += counts * weight if weight != 1 else counts
+        self.version += 1
+
+    def scale(self, factor: float):
+        self.flush()
+        self.counts *= factor
+
+    def snapshot(self) -> np.ndarray:
+        """Replicate counts as (B, n_states, n_states)."""
+        self.flush()
+        return np.moveaxis(self.counts, 2, 0).copy()
+
+    def intervals(self, counts: np.ndarray, level: float = 0.95) -> Dict:
+        """
+        Channel share intervals from a snapshot().
+
+        Returns:
+            Dict with lower/upper share bounds per channel (arrays),
+            conversion probability bounds, and confidence: one minus half
+            the summed interval widths (1 when the shares are pinned down,
+            0 when the intervals span all of the share mass)
+        """
+        conversion_probability, effects = batch_removal_effects(counts, self.n_channels)
+        totals = effects.sum(axis=1, keepdims=True)
+        shares = effects / np.where(totals > 0, totals, 1)
+        tail = 100 * (1 - level) / 2
+        lower, upper = np.percentile(shares, [tail, 100 - tail], axis=0)
+        p_lower, p_upper = np.percentile(conversion_probability, [tail, 100 - tail])
+        confidence = 0.0
+        if (totals > 0).any():
+            confidence = float(np.clip(1.0 - (upper - lower).sum() / 2, 0.0, 1.0))
+        return {
+            'lower': lower,
+            'upper': upper,
+            'conversion_probability': (float(p_lower), float(p_upper)),
+            'confidence': confidence,
+        }
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Copy of the replicates as (meta, arrays) for a checkpoint."""
+        self.flush()
+        return {'n_replicates': self.n_replicates}, {'counts': self.counts.copy()}
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        if arrays['counts'].shape != self.counts.shape:
+            raise ValueError("Checkpoint has a different replicate count or channel count")
+        self._pending, self._pending_weights = [], []
+        self.counts = arrays['counts']
+        self.version += 1
+
+    def memory_usage(self) -> int:
+        return self.counts.nbytes
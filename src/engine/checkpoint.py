@@ -0,0 +1,353 @@
+"""
+Engine Checkpoints
+==================
+
+Periodic snapshots of StreamingAttributionEngine state plus a write-ahead
+log (WAL) of the conversions ingested since, so a restarted process picks up
+where the previous one stopped.
+
+Checkpoint file: a magic line, an 8-byte header length, a JSON header
+(engine meta and an array table of dtype/shape/offset) and the raw arrays,
+each 64-byte aligned. Files are written to a temporary name and renamed into
+place, so a crash mid-write leaves the previous checkpoint intact. Restore
+maps the file copy-on-write: engine arrays are views of the page cache until
+first written, so loading costs page faults, not parsing.
+
+WAL: JSON lines in numbered segments (wal-0000000001.log, ...), appended by
+the engine under its ingest lock. Taking a checkpoint rotates the log in the
+same critical section; the checkpoint records the first segment it does not
+cover, and older segments are deleted once the checkpoint is on disk.
+Restore loads the checkpoint and replays the segments from there on. Lines
+are buffered and flushed every wal_flush_interval, which bounds what a hard
+crash can lose.
+
+Usage:
+    checkpointer = Checkpointer(engine, "state/", interval=30)
+    checkpointer.restore()      # before ingesting
+    checkpointer.start()
+    ...
+    checkpointer.stop()         # writes a final checkpoint
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAGIC = b'ATTRCKP1\n'
+ALIGN = 64
+CHECKPOINT_FILE = 'engine.ckpt'
+WAL_PATTERN = re.compile(r'^wal-(\d{10})\.log$')
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_checkpoint(path: str, meta: Dict, arrays: Dict[str, np.ndarray], fsync: bool = True) -> int:
+    """
+    Write meta and arrays to path atomically.
+
+    Returns:
+        File size in bytes
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    table = {}
+    # Offsets are relative to the data section, which starts aligned after the header
+    offset = 0
+    for name, a in arrays.items():
+        offset = _aligned(offset)
+        table[name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+        offset += a.nbytes
+    header = json.dumps({'version': 1, 'created_at': time.time(), 'meta': meta, 'arrays': table}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(data_start + table[name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return data_start + offset
+
+
+def read_checkpoint(path: str) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """
+    Map a checkpoint copy-on-write.
+
+    Returns:
+        (header, arrays): header holds 'meta' and 'created_at'; arrays are
+        writable views whose writes stay private to this process
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an engine checkpoint")
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = _aligned(len(MAGIC) + 8 + length)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=count,
+                                     offset=data_start + spec['offset']).reshape(spec['shape'])
+    return header, arrays
+
+
+def _dumps(record: Dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record) + b'\n'
+    return json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+
+def _tolist(values) -> Optional[list]:
+    return None if values is None else np.asarray(values).tolist()
+
+
+class WriteAheadLog:
+    """
+    Segmented JSON-lines log of engine ingestion calls.
+    """
+
+    def __init__(self, directory: str, fsync: bool = False):
+        """
+        Open a new segment after any existing ones (existing segments are
+        kept until a checkpoint covers them).
+
+        Args:
+            directory: Directory holding the segments
+            fsync: fsync on every flush, not only on rotation
+        """
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segments()
+        self.segment = (existing[-1] + 1) if existing else 1
+        self._file = open(self._path(self.segment), 'ab')
+        self.records = 0
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'wal-{segment:010d}.log')
+
+    def segments(self, start: int = 0) -> List[int]:
+        """Numbers of the segments on disk from start on, ascending."""
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = WAL_PATTERN.match(name)
+            if match and int(match.group(1)) >= start:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def append_conversion(self, touchpoints: List[str], value: float,
+                          timestamp: Optional[float], labels: Optional[Dict]):
+        self._file.write(_dumps({'p': list(touchpoints), 'v': value, 't': timestamp, 'l': labels}))
+        self.records += 1
+
+    def append_batch(self, channel_idx: np.ndarray, offsets: np.ndarray, values: np.ndarray,
+                     timestamps: Optional[np.ndarray], timestamp: Optional[float],
+                     labels: Optional[Dict[str, np.ndarray]]):
+        """Log a batch; timestamp is the batch time used when timestamps is None."""
+        self._file.write(_dumps({
+            'i': _tolist(channel_idx[offsets[0]:offsets[-1]]),
+            'o': _tolist(offsets - offsets[0]),
+            'v': _tolist(values),
+            'ts': _tolist(timestamps),
+            't': timestamp,
+            'l': {dim: _tolist(codes) for dim, codes in labels.items()} if labels else None,
+        }))
+        self.records += 1
+
+    def append_channels(self, names: List[str]):
+        self._file.write(_dumps({'channels': list(names)}))
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self) -> int:
+        """Close the current segment and start the next one; returns its number."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.segment += 1
+        self._file = open(self._path(self.segment), 'ab')
+        return self.segment
+
+    def prune(self, before: int):
+        """Delete segments numbered below before."""
+        for segment in self.segments():
+            if segment < before:
+                os.remove(self._path(segment))
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def replay_wal(directory: str, engine, start: int = 0) -> Dict:
+    """
+    Re-apply logged ingestion calls to an engine (without a WAL attached).
+
+    A torn final line, from a crash mid-write, is skipped.
+
+    Returns:
+        Dict with segments, records and conversions replayed
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    stats = {'segments': 0, 'records': 0, 'conversions': 0}
+    numbers = sorted(int(m.group(1)) for m in map(WAL_PATTERN.match, os.listdir(directory)) if m)
+    for segment in (n for n in numbers if n >= start):
+        with open(os.path.join(directory, f'wal-{segment:010d}.log'), 'rb') as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    continue
+                if 'channels' in record:
+                    engine.add_channels(record['channels'])
+                elif 'p' in record:
+                    engine.process_conversion(record['p'], record['v'], timestamp=record['t'],
+                                              labels=record['l'])
+                    stats['conversions'] += 1
+                else:
+                    offsets = np.array(record['o'], dtype=np.int64)
+                    timestamps = record['ts']
+                    if timestamps is None and record['t'] is not None:
+                        timestamps = np.full(len(offsets) - 1, record['t'])
+                    labels = record['l']
+                    if labels:
+                        labels = {dim: np.array(codes, dtype=object) for dim, codes in labels.items()}
+                    engine.process_conversions_batch(np.array(record['i'], dtype=np.int64), offsets,
+                                                     np.array(record['v'], dtype=np.float64),
+                                                     timestamps=timestamps, labels=labels)
+                    stats['conversions'] += len(offsets) - 1
+                stats['records'] += 1
+        stats['segments'] += 1
+    return stats
+
+
+class Checkpointer:
+    """
+    Restores an engine from a directory, then keeps the directory current:
+    a checkpoint every interval seconds and a write-ahead log in between.
+    """
+
+    def __init__(self, engine, directory: str, interval: float = 30.0, wal: bool = True,
+                 wal_flush_interval: float = 0.1, fsync: bool = True):
+        """
+        Args:
+            engine: StreamingAttributionEngine to checkpoint
+            directory: Holds engine.ckpt and the WAL segments
+            interval: Seconds between checkpoints
+            wal: Log conversions between checkpoints
+            wal_flush_interval: Seconds between WAL buffer flushes
+            fsync: fsync checkpoint files (and WAL segments on rotation)
+        """
+        self.engine = engine
+        self.directory = directory
+        self.interval = interval
+        self.use_wal = wal
+        self.wal_flush_interval = wal_flush_interval
+        self.fsync = fsync
+        self.path = os.path.join(directory, CHECKPOINT_FILE)
+        self.wal: Optional[WriteAheadLog] = None
+        self.last_checkpoint: Optional[Dict] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def restore(self) -> Dict:
+        """
+        Load the latest checkpoint and replay the WAL after it, then attach
+        a fresh WAL segment. Call before ingesting.
+
+        Returns:
+            Dict with restored (bool), checkpoint age, WAL replay counts and
+            elapsed_seconds
+        """
+        start = time.perf_counter()
+        stats = {'restored': False, 'checkpoint_age_seconds': None}
+        wal_start = 0
+        if os.path.exists(self.path):
+            header, arrays = read_checkpoint(self.path)
+            self.engine.restore_checkpoint_state(header['meta'], arrays)
+            wal_start = header['meta'].get('wal_segment') or 0
+            stats.update(restored=True, checkpoint_age_seconds=time.time() - header['created_at'])
+        if self.use_wal:
+            replayed = replay_wal(self.directory, self.engine, start=wal_start)
+            stats['restored'] = stats['restored'] or replayed['records'] > 0
+            stats.update({f'wal_{k}': v for k, v in replayed.items()})
+            self.wal = WriteAheadLog(self.directory)
+            self.engine.attach_wal(self.wal)
+        stats['elapsed_seconds'] = time.perf_counter() - start
+        return stats
+
+    def checkpoint(self) -> Dict:
+        """
+        Write a checkpoint now. The ingest lock is held only while the
+        engine copies its state; serialization happens in the caller.
+        """
+        start = time.perf_counter()
+        meta, arrays = self.engine.checkpoint_state()
+        locked = time.perf_counter() - start
+        size = write_checkpoint(self.path, meta, arrays, fsync=self.fsync)
+        if self.wal is not None and meta.get('wal_segment'):
+            self.wal.prune(meta['wal_segment'])
+        self.last_checkpoint = {
+            'bytes': size,
+            'snapshot_seconds': locked,
+            'elapsed_seconds': time.perf_counter() - start,
+            'written_at': time.time(),
+        }
+        return self.last_checkpoint
+
+    def _loop(self):
+        next_checkpoint = time.monotonic() + self.interval
+        while not self._stop.wait(self.wal_flush_interval):
+            try:
+                if self.wal is not None:
+                    with self.engine.lock:
+                        self.wal.flush()
+                if time.monotonic() >= next_checkpoint:
+                    self.checkpoint()
+                    next_checkpoint = time.monotonic() + self.interval
+            except Exception as e:
+                print(f"Checkpoint error: {e}", file=sys.stderr)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, final_checkpoint: bool = True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if final_checkpoint:
+            self.checkpoint()
+        if self.wal is not None:
+            self.engine.attach_wal(None)
+            self.wal.close()
+            self.wal = None
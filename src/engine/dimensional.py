@@ -0,0 +1,448 @@
+"""
+Dimensional Attribution
+=======================
+
+Attribution state per (campaign, device, ...) cell, with every roll-up
+pre-aggregated so any slice is answered from its own counters.
+
+For d dimensions the cube keeps 2^d groupings: one per subset of the
+dimensions, e.g. (campaign, device), (campaign,), (device,) and () for
+d = 2. Each conversion is added to one cell of every grouping, so
+"per campaign", "per device", "campaign X on mobile" and "global" are
+all direct lookups rather than sums over finer cells or rescans of events.
+
+Transition counts are sparse: the key cell * n_states^2 + from * n_states
++ to maps through an open-addressing hash index (the session store's
+IntHashIndex) to a row of one flat counts array. Memory therefore grows
+with the transitions actually observed per cell, not with
+cells x n_states^2. Per-cell conversion, value and last-touch totals are
+dense, as cells number in the thousands at most.
+
+Labels are any hashable values (campaign ids, device names); each
+dimension assigns them integer codes on first sight. Queries solve the
+absorbing chain of every requested cell in one batched inversion.
+"""
+
+import os
+import sys
+import threading
+import itertools
+import numpy as np
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from simulator.session_store import IntHashIndex
+
+DEFAULT_DIMENSIONS = ('campaign', 'device')
+# Label used for conversions that don't carry a dimension
+UNKNOWN = 'unknown'
+
+
+class DimensionalCube:
+    """
+    Sparse transition tensor and value counters indexed by dimension labels.
+    """
+
+    def __init__(self, channels: List[str], dimensions: Sequence[str] = DEFAULT_DIMENSIONS,
+                 capacity: int = 4096):
+        """
+        Initialize cube.
+
+        Args:
+            channels: Channel names, in the engine's index order
+            dimensions: Dimension names, e.g. ('campaign', 'device')
+            capacity: Initial number of (cell, transition) rows
+        """
+        if len(set(dimensions)) != len(dimensions):
+            raise ValueError(f"Duplicate dimensions: {dimensions}")
+        self.channels = list(channels)
+        self.n_channels = len(channels)
+        self.n_states = self.n_channels + 2
+        self.START_IDX = self.n_channels
+        self.CONV_IDX = self.n_channels + 1
+        self.dimensions = tuple(dimensions)
+
+        # Label <-> code per dimension
+        self._codes: List[Dict[Hashable, int]] = [{} for _ in self.dimensions]
+        self._labels: List[List[Hashable]] = [[] for _ in self.dimensions]
+
+        # Groupings: every subset of dimension positions, finest first
+        d = len(self.dimensions)
+        self.groupings: List[Tuple[int, ...]] = [
+            combo for size in range(d, -1, -1) for combo in itertools.combinations(range(d), size)
+        ]
+        self._grouping_of = {frozenset(g): i for i, g in enumerate(self.groupings)}
+
+        # Cells: (grouping, codes) -> id, and per-grouping cell lists
+        self._cells: Dict[Tuple[int, Tuple[int, ...]], int] = {}
+        self._cell_keys: List[Tuple[int, Tuple[int, ...]]] = []
+        self._grouping_cells: List[List[int]] = [[] for _ in self.groupings]
+        self.conversions = np.zeros(0)
+        self.values = np.zeros(0)
+        self.last_values = np.zeros((0, self.n_channels))
+
+        # Sparse transition counts
+        self.index = IntHashIndex(capacity)
+        self.counts = np.zeros(capacity)
+        self._n_rows = 0
+
+        self.lock = threading.Lock()
+
+    @property
+    def n_cells(self) -> int:
+        return len(self._cell_keys)
+
+    def labels(self, dimension: str) -> List[Hashable]:
+        """Labels seen so far for a dimension."""
+        return list(self._labels[self._position(dimension)])
+
+    def _position(self, dimension: str) -> int:
+        try:
+            return self.dimensions.index(dimension)
+        except ValueError:
+            raise ValueError(f"Unknown dimension: {dimension} (have {self.dimensions})") from None
+
+    def _code(self, position: int, label: Hashable) -> int:
+        codes = self._codes[position]
+        code = codes.get(label)
+        if code is None:
+            code = len(codes)
+            codes[label] = code
+            self._labels[position].append(label)
+        return code
+
+    def _codes_of(self, position: int, labels: np.ndarray) -> np.ndarray:
+        """Vectorized _code: one dictionary lookup per distinct label."""
+        unique, inverse = np.unique(labels, return_inverse=True)
+        mapped = np.array([self._code(position, label) for label in unique.tolist()], dtype=np.int64)
+        return mapped[inverse.reshape(-1)]
+
+    def _cell(self, grouping: int, codes: Tuple[int, ...]) -> int:
+        key = (grouping, codes)
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = len(self._cell_keys)
+            self._cells[key] = cell
+            self._cell_keys.append(key)
+            self._grouping_cells[grouping].append(cell)
+            if cell >= len(self.conversions):
+                size = max(64, 2 * len(self.conversions))
+                self.conversions = np.concatenate((self.conversions, np.zeros(size - len(self.conversions))))
+                self.values = np.concatenate((self.values, np.zeros(size - len(self.values))))
+                self.last_values = np.vstack((
+                    self.last_values, np.zeros((size - len(self.last_values), self.n_channels))
+                ))
+        return cell
+
+    def _new_rows(self, count: int) -> np.ndarray:
+        start = self._n_rows
+        if start + count > len(self.counts):
+            grown = np.zeros(max(2 * len(self.counts), start + count))
+            grown[:start] = self.counts[:start]
+            self.counts = grown
+        self._n_rows += count
+        return np.arange(start, start + count)
+
+    def add(self, path: Sequence[int], value: float, labels: Dict[str, Hashable]):
+        """
+        Add one conversion.
+
+        Args:
+            path: Channel indices of the touchpoints, in order (non-empty)
+            value: Conversion value
+            labels: Label per dimension; missing ones count as 'unknown'
+        """
+        n = self.n_states
+        states = [self.START_IDX] + list(path) + [self.CONV_IDX]
+        transitions = [a * n + b for a, b in zip(states, states[1:])]
+        with self.lock:
+            codes = tuple(self._code(i, _label(labels.get(dim))) for i, dim in enumerate(self.dimensions))
+            for g, positions in enumerate(self.groupings):
+                cell = self._cell(g, tuple(codes[p] for p in positions))
+                base = cell * n * n
+                for transition in transitions:
+                    key = base + transition
+                    row = self.index.get(key)
+                    if row < 0:
+                        row = int(self._new_rows(1)[0])
+                        self.index.put(key, row)
+                    self.counts[row] += 1
+                self.conversions[cell] += 1
+                self.values[cell] += value
+                self.last_values[cell, path[-1]] += value
+
+    def add_batch(self, channel_idx: np.ndarray, offsets: np.ndarray, values: np.ndarray,
+                  labels: Dict[str, np.ndarray]):
+        """
+        Add a batch of conversions, as ragged paths in the format taken by
+        StreamingAttributionEngine.process_conversions_batch.
+
+        Args:
+            labels: Array of labels per dimension, one per path; missing
+                dimensions count as 'unknown'
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        channel_idx = np.asarray(channel_idx)[offsets[0]:offsets[-1]]
+        offsets = offsets - offsets[0]
+        lengths = np.diff(offsets)
+        nonempty = lengths > 0
+        n_paths = int(nonempty.sum())
+        if n_paths == 0:
+            return
+        starts = offsets[:-1][nonempty]
+        last_pos = offsets[1:][nonempty] - 1
+        values = np.asarray(values, dtype=np.float64)[nonempty]
+        last = channel_idx[last_pos].astype(np.int64)
+
+        # Transition codes and the path each belongs to
+        n = self.n_states
+        interior = np.ones(channel_idx.size, dtype=bool)
+        interior[last_pos] = False
+        interior_pos = np.flatnonzero(interior)
+        position_path = np.repeat(np.arange(len(lengths)), lengths)
+        path_number = np.cumsum(nonempty) - 1
+        transitions = np.concatenate((
+            self.START_IDX * n + channel_idx[starts].astype(np.int64),
+            channel_idx[interior_pos].astype(np.int64) * n + channel_idx[interior_pos + 1],
+            last * n + self.CONV_IDX,
+        ))
+        transition_path = np.concatenate((
+            np.arange(n_paths), path_number[position_path[interior_pos]], np.arange(n_paths),
+        ))
+
+        with self.lock:
+            codes = np.empty((n_paths, len(self.dimensions)), dtype=np.int64)
+            for i, dim in enumerate(self.dimensions):
+                column = labels.get(dim)
+                if column is None:
+                    codes[:, i] = self._code(i, UNKNOWN)
+                else:
+                    column = np.asarray(column)[nonempty]
+                    if column.dtype == object:
+                        column = np.array([_label(x) for x in column.tolist()], dtype=object)
+                    codes[:, i] = self._codes_of(i, column)
+
+            cells = np.empty((len(self.groupings), n_paths), dtype=np.int64)
+            for g, positions in enumerate(self.groupings):
+                if not positions:
+                    cells[g] = self._cell(g, ())
+                    continue
+                unique, inverse = np.unique(codes[:, list(positions)], axis=0, return_inverse=True)
+                ids = np.array([self._cell(g, tuple(row)) for row in unique.tolist()], dtype=np.int64)
+                cells[g] = ids[inverse.reshape(-1)]
+
+            keys = (cells[:, transition_path] * (n * n) + transitions).reshape(-1)
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            totals = np.bincount(inverse, minlength=len(unique_keys)).astype(np.float64)
+            rows = self.index.lookup(unique_keys)
+            new = rows < 0
+            if new.any():
+                rows[new] = self._new_rows(int(new.sum()))
+                self.index.insert(unique_keys[new], rows[new])
+            self.counts[rows] += totals
+
+            flat_cells = cells.reshape(-1)
+            size = len(self.conversions)
+            self.conversions += np.bincount(flat_cells, minlength=size)
+            self.values += np.bincount(flat_cells, weights=np.tile(values, len(self.groupings)),
+                                       minlength=size)
+            last_keys = (cells * self.n_channels + last).reshape(-1)
+            self.last_values += np.bincount(
+                last_keys, weights=np.tile(values, len(self.groupings)),
+                minlength=size * self.n_channels
+            ).reshape(size, self.n_channels)
+
+    def _transitions(self, cells: List[int]) -> np.ndarray:
+        """Dense transition counts of cells, shape (len(cells), n, n) (call under self.lock)."""
+        n = self.n_states
+        keys = (np.asarray(cells, dtype=np.int64)[:, None] * (n * n) + np.arange(n * n)).reshape(-1)
+        rows = self.index.lookup(keys)
+        hit = rows >= 0
+        dense = np.zeros(len(keys))
+        dense[hit] = self.counts[rows[hit]]
+        return dense.reshape(len(cells), n, n)
+
+    def _removal_effects(self, transitions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Conversion probability and removal effects of many chains at once,
+        with the same absorbing-chain algebra as AbsorbingChainSolver.
+        """
+        n, m = self.n_channels, self.n_channels + 1
+        sums = transitions.sum(axis=2, keepdims=True)
+        probs = transitions / np.where(sums > 0, sums, 1)
+        A = np.eye(m) - probs[:, :m, :m]
+        try:
+            N = np.linalg.inv(A)
+        except np.linalg.LinAlgError:
+            N = np.linalg.pinv(A)
+        x = np.einsum('cij,cj->ci', N, probs[:, :m, m])
+        base = x[:, n]
+        diag = np.diagonal(N, axis1=1, axis2=2)[:, :n]
+        removed = base[:, None] - N[:, n, :n] * x[:, :n] / diag
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effects = np.where(base[:, None] > 0, np.clip(1.0 - removed / base[:, None], 0.0, 1.0), 0.0)
+        return base, effects
+
+    def _scores(self, cells: List[int]) -> List[Dict]:
+        """Scores of cells (call under self.lock)."""
+        if not cells:
+            return []
+        probability, effects = self._removal_effects(self._transitions(cells))
+        results = []
+        for k, cell in enumerate(cells):
+            total_value = float(self.values[cell])
+            weights = effects[k] / effects[k].sum() if effects[k].sum() > 0 else effects[k]
+            last_touch_values = self.last_values[cell]
+            last_total = last_touch_values.sum()
+            last_shares = last_touch_values / last_total if last_total > 0 else last_touch_values
+            results.append({
+                'total_conversions': float(self.conversions[cell]),
+                'total_value': total_value,
+                'conversion_probability': float(probability[k]),
+                'attribution': dict(zip(self.channels, (weights * total_value).tolist())),
+                'shares': dict(zip(self.channels, weights.tolist())),
+                'removal_effects': dict(zip(self.channels, effects[k].tolist())),
+                'last_touch': {
+                    'attribution': dict(zip(self.channels, last_touch_values.tolist())),
+                    'shares': dict(zip(self.channels, last_shares.tolist())),
+                },
+            })
+        return results
+
+    def _empty_scores(self) -> Dict:
+        zeros = dict.fromkeys(self.channels, 0.0)
+        return {
+            'total_conversions': 0.0,
+            'total_value': 0.0,
+            'conversion_probability': 0.0,
+            'attribution': dict(zeros),
+            'shares': dict(zeros),
+            'removal_effects': dict(zeros),
+            'last_touch': {'attribution': dict(zeros), 'shares': dict(zeros)},
+        }
+
+    def _resolve(self, filters: Dict[str, Hashable], by: Sequence[str] = ()) -> Tuple[int, Dict[int, int]]:
+        """Grouping covering filters and by, plus the filters as position -> code."""
+        positions = {self._position(dim) for dim in list(filters) + list(by)}
+        grouping = self._grouping_of[frozenset(positions)]
+        wanted = {}
+        for dim, label in filters.items():
+            i = self._position(dim)
+            wanted[i] = self._codes[i].get(_label(label), -1)
+        return grouping, wanted
+
+    def scores(self, **filters: Hashable) -> Dict:
+        """
+        Markov and last-touch scores for one slice, e.g. scores() (global),
+        scores(campaign='campaign_001') or scores(campaign='campaign_001',
+        device='Mobile'). A slice never seen scores as empty.
+        """
+        with self.lock:
+            grouping, wanted = self._resolve(filters)
+            codes = tuple(wanted[p] for p in self.groupings[grouping])
+            cell = self._cells.get((grouping, codes))
+            if cell is None:
+                return self._empty_scores()
+            return self._scores([cell])[0]
+
+    def rollup(self, by: Union[str, Sequence[str]], **filters: Hashable) -> Dict:
+        """
+        Scores of every slice along one or more dimensions, optionally
+        within fixed labels of others.
+
+        Examples:
+            rollup('campaign')                 -> {campaign: scores}
+            rollup('campaign', device='TV')    -> {campaign: scores on TV}
+            rollup(('campaign', 'device'))     -> {(campaign, device): scores}
+
+        Returns:
+            Dict keyed by label (or label tuple when by has several
+            dimensions)
+        """
+        by = (by,) if isinstance(by, str) else tuple(by)
+        with self.lock:
+            grouping, wanted = self._resolve(filters, by)
+            positions = self.groupings[grouping]
+            by_positions = [self._position(dim) for dim in by]
+            keys, cells = [], []
+            for cell in self._grouping_cells[grouping]:
+                codes = dict(zip(positions, self._cell_keys[cell][1]))
+                if all(codes[p] == code for p, code in wanted.items()):
+                    labels = tuple(self._labels[p][codes[p]] for p in by_positions)
+                    keys.append(labels[0] if len(by) == 1 else labels)
+                    cells.append(cell)
+            return dict(zip(keys, self._scores(cells)))
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """
+        Copy of the cube state as (JSON-able meta, arrays) for a
+        checkpoint. Labels must be JSON-serializable.
+        """
+        with self.lock:
+            n_cells, n_rows = self.n_cells, self._n_rows
+            cells = np.full((n_cells, 1 + len(self.dimensions)), -1, dtype=np.int64)
+            for cell, (grouping, codes) in enumerate(self._cell_keys):
+                cells[cell, 0] = grouping
+                cells[cell, 1 + np.array(self.groupings[grouping], dtype=np.int64)] = codes
+            live = self.index.keys >= 0
+            arrays = {
+                'cells': cells,
+                'conversions': self.conversions[:n_cells].copy(),
+                'values': self.values[:n_cells].copy(),
+                'last_values': self.last_values[:n_cells].copy(),
+                'index_keys': self.index.keys[live],
+                'index_rows': self.index.values[live],
+                'counts': self.counts[:n_rows].copy(),
+            }
+            return {'dimensions': list(self.dimensions), 'labels': self._labels}, arrays
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        """Replace the cube state with a checkpoint() result."""
+        if tuple(meta['dimensions']) != self.dimensions:
+            raise ValueError(f"Checkpoint has dimensions {meta['dimensions']}, cube has {self.dimensions}")
+        if arrays['last_values'].shape[1:] != (self.n_channels,):
+            raise ValueError("Checkpoint has a different channel count")
+        with self.lock:
+            self._labels = [list(labels) for labels in meta['labels']]
+            self._codes = [{label: code for code, label in enumerate(labels)} for labels in self._labels]
+            self._cells, self._cell_keys = {}, []
+            self._grouping_cells = [[] for _ in self.groupings]
+            for cell, row in enumerate(arrays['cells'].tolist()):
+                grouping = row[0]
+                key = (grouping, tuple(row[1 + p] for p in self.groupings[grouping]))
+                self._cells[key] = cell
+                self._cell_keys.append(key)
+                self._grouping_cells[grouping].append(cell)
+            self.conversions = np.array(arrays['conversions'], dtype=np.float64)
+            self.values = np.array(arrays['values'], dtype=np.float64)
+            self.last_values = np.array(arrays['last_values'], dtype=np.float64).reshape(-1, self.n_channels)
+            self.index = IntHashIndex(max(2 * len(arrays['index_keys']), 4096))
+            self.index.insert(np.asarray(arrays['index_keys']), np.asarray(arrays['index_rows']))
+            self._n_rows = len(arrays['counts'])
+            self.counts = np.zeros(max(2 * self._n_rows, 4096))
+            self.counts[:self._n_rows] = arrays['counts']
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by the cube.
+
+        Returns:
+            Dict with cells, rows (stored cell transitions), counts_bytes,
+            index_bytes, cell_bytes and total_bytes
+        """
+        cell_bytes = self.conversions.nbytes + self.values.nbytes + self.last_values.nbytes
+        usage = {
+            'cells': self.n_cells,
+            'rows': self._n_rows,
+            'counts_bytes': self.counts.nbytes,
+            'index_bytes': self.index.nbytes,
+            'cell_bytes': cell_bytes,
+        }
+        usage['total_bytes'] = usage['counts_bytes'] + usage['index_bytes'] + cell_bytes
+        return usage
+
+
+def _label(label: Optional[Hashable]) -> Hashable:
+    return UNKNOWN if label is None else label
@@ -0,0 +1,436 @@
+"""
+Higher-Order Markov Chain
+=========================
+
+k-th order attribution chain: a state is the last k channels of a path, so
+Display -> Search -> Email is scored differently from Email -> Search ->
+Email. Histories shorter than k are padded with a Start marker, e.g. the
+first touch of a path is the state (Start, c0).
+
+Tuples are packed into int64 keys, one base-(n_channels + 2) digit per
+position: channel c is digit c + 2, the Start marker is 1, and 0 means
+"no older position". Keys are interned into compact state ids through an
+open-addressing hash index (the session store's IntHashIndex), and
+transition counts are keyed by (from id, to id) the same way, so only
+observed tuples and transitions are allocated.
+
+The number of states is capped. Past max_states the rarest tuples (fewest
+visits) are pruned by backing off: a state and its counts merge into its
+suffix (the tuple without its oldest channel). Single-channel states are
+never pruned, so the chain degrades towards first order under pressure
+instead of losing paths. A pruned tuple that keeps occurring is interned
+again and competes for a slot.
+
+Removing a channel removes every state that contains it. All removals are
+solved together with one warm-started Jacobi iteration over a
+(states x channels + 1) matrix.
+"""
+
+import os
+import sys
+import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from simulator.session_store import IntHashIndex
+
+START_KEY = 0
+CONV_KEY = 1
+START_ID = 0
+CONV_ID = 1
+# Transition keys pack (from id, to id) into one int64
+ID_BITS = 31
+
+
+class HigherOrderChain:
+    """
+    Interned k-tuple states with sparse transition counts.
+    """
+
+    def __init__(
+        self,
+        n_channels: int,
+        order: int = 2,
+        max_states: int = 100000,
+        prune_fraction: float = 0.1,
+        tol: float = 1e-10,
+        max_iter: int = 10000
+    ):
+        """
+        Initialize chain.
+
+        Args:
+            n_channels: Number of channels (indices 0..n_channels - 1)
+            order: Channels of history per state (k)
+            max_states: Cap on tracked states, Start and Conversion included
+            prune_fraction: Fraction of max_states freed by each prune
+            tol: Convergence threshold of the removal-effect solve
+            max_iter: Iteration cap of the removal-effect solve
+        """
+        if order < 1:
+            raise ValueError("order must be at least 1")
+        self.n_channels = n_channels
+        self.order = order
+        self.base = n_channels + 2
+        if self.base ** order >= 1 << 63:
+            raise ValueError(f"{n_channels} channels at order {order} overflow int64 state keys")
+        if max_states < n_channels + 2:
+            raise ValueError("max_states must cover Start, Conversion and one state per channel")
+        self.max_states = max_states
+        self.prune_fraction = prune_fraction
+        self.tol = tol
+        self.max_iter = max_iter
+        self.prunes = 0
+
+        self._reset_states(np.array([START_KEY, CONV_KEY], dtype=np.int64))
+        self._reset_transitions(np.zeros(0, dtype=np.int64), np.zeros(0))
+        # Warm start of the removal solve, valid while state ids are stable
+        self._solution: Optional[np.ndarray] = None
+
+    @property
+    def n_states(self) -> int:
+        return len(self.state_index)
+
+    @property
+    def n_transitions(self) -> int:
+        return len(self.transition_index)
+
+    def _reset_states(self, keys: np.ndarray):
+        self.state_index = IntHashIndex(max(2 * len(keys), 1024))
+        self.state_index.insert(keys, np.arange(len(keys), dtype=np.int64))
+        self.state_keys = np.zeros(max(2 * len(keys), 1024), dtype=np.int64)
+        self.state_keys[:len(keys)] = keys
+
+    def _reset_transitions(self, pair_keys: np.ndarray, counts: np.ndarray):
+        self.transition_index = IntHashIndex(max(2 * len(pair_keys), 1024))
+        self.transition_index.insert(pair_keys, np.arange(len(pair_keys), dtype=np.int64))
+        self.pair_keys = np.zeros(max(2 * len(pair_keys), 1024), dtype=np.int64)
+        self.pair_keys[:len(pair_keys)] = pair_keys
+        self.counts = np.zeros(len(self.pair_keys))
+        self.counts[:len(counts)] = counts
+
+    # Tuple keys
+
+    def path_keys(self, path: Sequence[int]) -> list:
+        """State key at each position of one path of channel indices."""
+        base, order = self.base, self.order
+        keys = []
+        for p in range(len(path)):
+            key, scale = 0, 1
+            for j in range(order):
+                q = p - j
+                if q < -1:
+                    break
+                key += (path[q] + 2 if q >= 0 else 1) * scale
+                scale *= base
+            keys.append(key)
+        return keys
+
+    def batch_keys(self, channel_idx: np.ndarray, position: np.ndarray) -> np.ndarray:
+        """
+        State key at each position of a flat path batch.
+
+        Args:
+            channel_idx: Flat channel indices of all paths
+            position: Position of each entry within its path
+        """
+        keys = channel_idx + 2
+        scale = 1
+        for j in range(1, self.order):
+            scale *= self.base
+            older = np.zeros_like(keys)
+            inside = position >= j
+            older[j:] = channel_idx[:-j] + 2
+            digit = np.where(inside, older, np.where(position == j - 1, 1, 0))
+            keys = keys + digit * scale
+        return keys
+
+    def _suffix(self, key: int) -> int:
+        """Key without its oldest position."""
+        scale = 1
+        while key // (scale * self.base):
+            scale *= self.base
+        return key % scale
+
+    # Ingestion
+
+    def add_path(self, path: Sequence[int], weight: float = 1.0):
+        """Count the transitions of one path of channel indices."""
+        ids = [START_ID]
+        index = self.state_index
+        # Python ints: numpy scalars overflow in the index's scalar hash
+        for key in self.path_keys([int(c) for c in path]):
+            state = index.get(key)
+            if state < 0:
+                state = self._new_state(key)
+            ids.append(state)
+        ids.append(CONV_ID)
+        transitions = self.transition_index
+        for from_id, to_id in zip(ids, ids[1:]):
+            pair = (from_id << ID_BITS) | to_id
+            row = transitions.get(pair)
+            if row < 0:
+                row = self._new_transition(pair)
+            self.counts[row] += weight
+        if self.n_states > self.max_states:
+            self.prune()
+
+    def _new_state(self, key: int) -> int:
+        state = self.n_states
+        if state == len(self.state_keys):
+            self.state_keys = np.concatenate((self.state_keys, np.zeros_like(self.state_keys)))
+        self.state_keys[state] = key
+        self.state_index.put(key, state)
+        return state
+
+    def _new_transition(self, pair: int) -> int:
+        row = self.n_transitions
+        if row == len(self.pair_keys):
+            self._grow_transitions(row + 1)
+        self.pair_keys[row] = pair
+        self.transition_index.put(pair, row)
+        return row
+
+    def _grow_transitions(self, needed: int):
+        size = max(needed, 2 * len(self.pair_keys))
+        self.pair_keys = np.concatenate((self.pair_keys, np.zeros(size - len(self.pair_keys), dtype=np.int64)))
+        self.counts = np.concatenate((self.counts, np.zeros(size - len(self.counts))))
+
+    def prepare_batch(self, channel_idx: np.ndarray, offsets: np.ndarray,
+                      path_weights: Optional[np.ndarray] = None) -> Dict:
+        """
+        Aggregate a path batch into (from key, to key) transition counts
+        without touching chain state.
+
+        Args:
+            channel_idx: Flat channel indices, offsets starting at 0
+            offsets: Path boundaries, only non-empty paths
+            path_weights: Optional weight per path
+        """
+        lengths = np.diff(offsets)
+        position = np.arange(len(channel_idx)) - np.repeat(offsets[:-1], lengths)
+        keys = self.batch_keys(channel_idx, position)
+        first = offsets[:-1]
+        last = offsets[1:] - 1
+        interior = np.ones(len(channel_idx), dtype=bool)
+        interior[last] = False
+        interior_pos = np.flatnonzero(interior)
+        from_keys = np.concatenate((np.full(len(first), START_KEY), keys[interior_pos], keys[last]))
+        to_keys = np.concatenate((keys[first], keys[interior_pos + 1], np.full(len(last), CONV_KEY)))
+        weights = None
+        if path_weights is not None:
+            path_of_pos = np.repeat(np.arange(len(lengths)), lengths)
+            weights = np.concatenate((path_weights, path_weights[path_of_pos[interior_pos]], path_weights))
+        # Aggregate repeated pairs (keys can use all 63 bits, so no packing)
+        order = np.lexsort((to_keys, from_keys))
+        from_keys, to_keys = from_keys[order], to_keys[order]
+        boundary = np.r_[True, (from_keys[1:] != from_keys[:-1]) | (to_keys[1:] != to_keys[:-1])]
+        starts = np.flatnonzero(boundary)
+        if weights is None:
+            counts = np.diff(np.r_[starts, len(order)]).astype(np.float64)
+        else:
+            counts = np.add.reduceat(weights[order], starts)
+        return {'from': from_keys[starts], 'to': to_keys[starts], 'counts': counts}
+
+    def apply_batch(self, prepared: Dict, weight: float = 1.0):
+        """Count prepared transitions, interning new states and pairs."""
+        from_ids = self._intern(prepared['from'])
+        to_ids = self._intern(prepared['to'])
+        pairs = (from_ids << ID_BITS) | to_ids
+        rows = self.transition_index.lookup(pairs)
+        new = rows < 0
+        if new.any():
+            start = self.n_transitions
+            rows[new] = np.arange(start, start + int(new.sum()))
+            if start + new.sum() > len(self.pair_keys):
+                self._grow_transitions(int(start + new.sum()))
+            self.pair_keys[rows[new]] = pairs[new]
+            self.transition_index.insert(pairs[new], rows[new])
+        counts = prepared['counts'] * weight if weight != 1 else prepared['counts']
+        # Pairs are unique within a prepared batch
+        self.counts[rows] += counts
+        if self.n_states > self.max_states:
+            self.prune()
+
+    def _intern(self, keys: np.ndarray) -> np.ndarray:
+        ids = self.state_index.lookup(keys)
+        missing = ids < 0
+        if missing.any():
+            unique, inverse = np.unique(keys[missing], return_inverse=True)
+            start = self.n_states
+            new_ids = np.arange(start, start + len(unique), dtype=np.int64)
+            while start + len(unique) > len(self.state_keys):
+                self.state_keys = np.concatenate((self.state_keys, np.zeros_like(self.state_keys)))
+            self.state_keys[new_ids] = unique
+            self.state_index.insert(unique, new_ids)
+            ids[missing] = new_ids[inverse]
+        return ids
+
+    def scale(self, factor: float):
+        """Multiply all counts (decay rebase)."""
+        self.counts *= factor
+
+    # Pruning
+
+    def prune(self):
+        """
+        Merge the rarest multi-channel states into their suffixes until
+        (1 - prune_fraction) * max_states states remain.
+        """
+        target = int(self.max_states * (1 - self.prune_fraction))
+        # Suffix states created by a pass can keep the count above target
+        while self.n_states > target:
+            before = self.n_states
+            self._prune_pass(target)
+            if self.n_states >= before:
+                break
+        self._solution = None
+        self.prunes += 1
+
+    def _prune_pass(self, target: int):
+        n_states, n_rows = self.n_states, self.n_transitions
+        keys = self.state_keys[:n_states].copy()
+        pair_keys = self.pair_keys[:n_rows]
+        from_ids = pair_keys >> ID_BITS
+        to_ids = pair_keys & ((1 << ID_BITS) - 1)
+        counts = self.counts[:n_rows]
+        visits = np.bincount(from_ids, weights=counts, minlength=n_states)
+
+        prunable = np.flatnonzero(keys >= self.base)
+        excess = n_states - target
+        if excess <= 0 or prunable.size == 0:
+            return
+        victims = prunable[np.argsort(visits[prunable], kind='stable')[:excess]]
+
+        # Resolve each victim to its nearest surviving suffix, adding
+        # suffix states that don't exist yet (they hold merged mass)
+        removed = set(victims.tolist())
+        key_to_id = {}
+        mapping = np.arange(n_states, dtype=np.int64)
+        extra_keys = []
+        for victim in victims.tolist():
+            key = self._suffix(int(keys[victim]))
+            while True:
+                state = key_to_id.get(key)
+                if state is None:
+                    state = self.state_index.get(key)
+                    if state < 0:
+                        state = n_states + len(extra_keys)
+                        extra_keys.append(key)
+                    key_to_id[key] = state
+                if state not in removed:
+                    break
+                key = self._suffix(key)
+            mapping[victim] = state
+
+        # Relabel survivors compactly: victims take their suffix's new id
+        all_keys = np.concatenate((keys, np.array(extra_keys, dtype=np.int64)))
+        alive = np.ones(len(all_keys), dtype=bool)
+        alive[victims] = False
+        new_id = np.cumsum(alive) - 1
+        mapping = np.concatenate((mapping, np.arange(n_states, len(all_keys))))
+        final = new_id[mapping]
+        new_pairs = (final[from_ids] << ID_BITS) | final[to_ids]
+        unique, inverse = np.unique(new_pairs, return_inverse=True)
+        merged = np.bincount(inverse, weights=counts, minlength=len(unique))
+
+        self._reset_states(all_keys[alive])
+        self._reset_transitions(unique, merged)
+
+    # Scoring
+
+    def snapshot(self) -> Dict:
+        """Copy of the state needed by solve() (take under the engine lock)."""
+        n_rows = self.n_transitions
+        return {
+            'keys': self.state_keys[:self.n_states].copy(),
+            'pairs': self.pair_keys[:n_rows].copy(),
+            'counts': self.counts[:n_rows].copy(),
+            'prunes': self.prunes,
+        }
+
+    def solve(self, snapshot: Dict) -> Tuple[float, np.ndarray]:
+        """
+        Conversion probability from Start and the removal effect of each
+        channel.
+
+        Returns:
+            (conversion_probability, removal effects of length n_channels)
+        """
+        keys = snapshot['keys']
+        m, n = len(keys), self.n_channels
+        from_ids = snapshot['pairs'] >> ID_BITS
+        to_ids = snapshot['pairs'] & ((1 << ID_BITS) - 1)
+        counts = snapshot['counts']
+        sums = np.bincount(from_ids, weights=counts, minlength=m)
+        probs = counts / np.where(sums > 0, sums, 1)[from_ids]
+
+        converts = to_ids == CONV_ID
+        r = np.bincount(from_ids[converts], weights=probs[converts], minlength=m)
+        loop = (from_ids == to_ids) & ~converts
+        inv_diag = 1.0 / np.maximum(1.0 - np.bincount(from_ids[loop], weights=probs[loop], minlength=m), 1e-12)
+        inner = ~converts & ~loop
+        rows, cols, values = from_ids[inner], to_ids[inner], probs[inner]
+        order = np.argsort(rows, kind='stable')
+        rows, cols, values = rows[order], cols[order], values[order]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if rows.size else np.zeros(0, dtype=np.int64)
+        row_ids = rows[starts]
+
+        # Column 0: full chain; column c + 1: chain without channel c
+        keep = np.ones((m, n + 1), dtype=bool)
+        digits = keys.copy()
+        for _ in range(self.order):
+            channel = digits % self.base - 2
+            present = channel >= 0
+            keep[np.flatnonzero(present), channel[present] + 1] = False
+            digits //= self.base
+        keep[CONV_ID] = False
+
+        X = np.zeros((m, n + 1))
+        if self._solution is not None and snapshot['prunes'] == self.prunes:
+            # Same ids as the previous solve, plus any states added since
+            seen = min(len(self._solution), m)
+            X[:seen] = self._solution[:seen]
+        b = np.broadcast_to((r * inv_diag)[:, None], (m, n + 1))
+        for _ in range(self.max_iter):
+            new = b.copy()
+            if rows.size:
+                new[row_ids] += np.add.reduceat(values[:, None] * X[cols], starts, axis=0) * inv_diag[row_ids, None]
+            new[~keep] = 0.0
+            done = np.abs(new - X).max() <= self.tol
+            X = new
+            if done:
+                break
+        if snapshot['prunes'] == self.prunes:
+            self._solution = X
+
+        base = float(X[START_ID, 0])
+        if base <= 0:
+            return base, np.zeros(n)
+        return base, np.clip(1.0 - X[START_ID, 1:] / base, 0.0, 1.0)
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Copy of the chain as (meta, arrays) for a checkpoint."""
+        snapshot = self.snapshot()
+        meta = {'order': self.order, 'n_channels': self.n_channels, 'prunes': snapshot.pop('prunes')}
+        return meta, snapshot
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        if meta['order'] != self.order or meta['n_channels'] != self.n_channels:
+            raise ValueError("Checkpoint has a different chain order or channel count")
+        self._reset_states(np.asarray(arrays['keys'], dtype=np.int64))
+        self._reset_transitions(np.asarray(arrays['pairs'], dtype=np.int64),
+                                np.asarray(arrays['counts'], dtype=np.float64))
+        self.prunes = meta['prunes']
+        self._solution = None
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held per structure."""
+        return {
+            'state_index': self.state_index.nbytes,
+            'state_keys': self.state_keys.nbytes,
+            'transition_index': self.transition_index.nbytes,
+            'transitions': self.pair_keys.nbytes + self.counts.nbytes,
+        }
@@ -0,0 +1,365 @@
+"""
+Absorbing Markov Chain Solver
+=============================
+
+Conversion probability and channel removal effects over the engine's
+transition counts, maintained incrementally between score refreshes.
+
+The transient states are the channels plus the Start state; Conversion is
+the single absorbing success state (rows that never reach it leak to an
+implicit Null state). With Q the transient-to-transient probabilities and
+r the transient-to-Conversion probabilities:
+
+    N = (I - Q)^-1          (fundamental matrix)
+    x = N r                 (conversion probability from each state)
+
+Removing channel c sends every transition into c to Null. Since
+N[i, c] / N[c, c] is the probability of ever visiting c from i, the
+conversion probability from Start without c is
+
+    x_start - N[start, c] * x[c] / N[c, c]
+
+so every removal effect falls out of the cached N in O(n). When only a few
+rows of Q change, N is refreshed with a Woodbury low-rank update in
+O(n^2 k) instead of a full O(n^3) inversion.
+
+SparseChainSolver computes the same quantities without forming N, for
+chains with thousands of states and few observed transitions per state:
+
+    x = N r                 Jacobi iteration on (I - Q) x = r
+    N[start, :]             Jacobi iteration on (I - Q)^T y = e_start
+    N[c, c]                 inverse of the (I - Q) block of c's strongly
+                            connected component
+
+The last holds because a walk from c back to c never leaves c's component.
+Components are found once per sparsity pattern; for the usual mostly
+forward-moving paths they are small, and only those blocks are inverted.
+"""
+
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+class AbsorbingChainSolver:
+    """
+    Caches the fundamental matrix of the attribution chain and updates it
+    for the rows whose transition counts changed since the last refresh.
+    """
+
+    def __init__(
+        self,
+        n_channels: int,
+        max_update_fraction: float = 0.25,
+        refresh_every: int = 64
+    ):
+        """
+        Initialize solver.
+
+        Args:
+            n_channels: Number of channel states (Start is index n_channels,
+                Conversion is index n_channels + 1)
+            max_update_fraction: Above this fraction of changed rows a full
+                inversion is cheaper than a low-rank update
+            refresh_every: Full re-inversion after this many low-rank updates
+                to bound accumulated floating point error
+        """
+        self.n_channels = n_channels
+        self.n_transient = n_channels + 1
+        self.max_update_fraction = max_update_fraction
+        self.refresh_every = refresh_every
+
+        m = self.n_transient
+        # An empty chain: nothing moves, nothing converts
+        self.Q = np.zeros((m, m))
+        self.r = np.zeros(m)
+        self.N = np.eye(m)
+        self.x = np.zeros(m)
+        self._updates_since_refresh = 0
+
+    def update(self, rows: np.ndarray, transition_rows: np.ndarray):
+        """
+        Apply new transition counts for a subset of transient rows.
+
+        Args:
+            rows: Transient state indices whose counts changed
+            transition_rows: Raw transition counts for those rows, shape
+                (len(rows), n_channels + 2)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+
+        sums = transition_rows.sum(axis=1, keepdims=True)
+        probs = transition_rows / np.where(sums > 0, sums, 1)
+        new_Q = probs[:, :self.n_transient]
+        new_r = probs[:, self.n_transient]
+
+        delta = new_Q - self.Q[rows]
+        self.Q[rows] = new_Q
+        self.r[rows] = new_r
+
+        full = (
+            rows.size > self.max_update_fraction * self.n_transient
+            or self._updates_since_refresh >= self.refresh_every
+        )
+        if not full:
+            try:
+                self._low_rank_update(rows, delta)
+                self._updates_since_refresh += 1
+            except np.linalg.LinAlgError:
+                full = True
+        if full:
+            self._invert()
+
+        self.x = self.N @ self.r
+
+    def _low_rank_update(self, rows: np.ndarray, delta: np.ndarray):
+        # I - Q' = (I - Q) - E_rows @ delta, so by Woodbury:
+        # N' = N + N[:, rows] (I - delta N[:, rows])^-1 delta N
+        N_cols = self.N[:, rows]
+        delta_N = delta @ self.N
+        K = np.eye(rows.size) - delta @ N_cols
+        self.N += N_cols @ np.linalg.solve(K, delta_N)
+
+    def _invert(self):
+        A = np.eye(self.n_transient) - self.Q
+        try:
+            self.N = np.linalg.inv(A)
+        except np.linalg.LinAlgError:
+            self.N = np.linalg.pinv(A)
+        self._updates_since_refresh = 0
+
+    @property
+    def conversion_probability(self) -> float:
+        """Probability of reaching Conversion from Start."""
+        return float(self.x[self.n_channels])
+
+    def removal_effects(self, conversion_probability: Optional[float] = None) -> np.ndarray:
+        """
+        Relative drop in conversion probability when each channel is removed.
+
+        Returns:
+            Array of length n_channels with values in [0, 1]
+        """
+        base = self.conversion_probability if conversion_probability is None else conversion_probability
+        if base <= 0:
+            return np.zeros(self.n_channels)
+
+        n = self.n_channels
+        diag = np.diagonal(self.N)[:n]
+        removed = base - self.N[n, :n] * self.x[:n] / diag
+        return np.clip(1.0 - removed / base, 0.0, 1.0)
+
+
+class SparseChainSolver:
+    """
+    Conversion probability and removal effects from CSR transition counts,
+    using warm-started iterative solves.
+    """
+
+    def __init__(self, n_channels: int, tol: float = 1e-12, max_iter: int = 10000):
+        """
+        Initialize solver.
+
+        Args:
+            n_channels: Number of channel states (Start is index n_channels,
+                Conversion is index n_channels + 1)
+            tol: Convergence threshold on the largest change per iteration
+            max_iter: Iteration cap per solve
+        """
+        self.n_channels = n_channels
+        self.n_transient = n_channels + 1
+        self.tol = tol
+        self.max_iter = max_iter
+
+        m = self.n_transient
+        self.x = np.zeros(m)
+        self.visits = np.zeros(m)
+        self.N_diag = np.ones(m)
+        self.iterations = 0
+        # Cycle structure of the last sparsity pattern
+        self._pattern: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._blocks: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+
+    def update(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        """
+        Re-solve the chain for new transition counts.
+
+        Args:
+            indptr, indices, data: CSR counts over n_channels + 2 states
+        """
+        m = self.n_transient
+        rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        sums = np.bincount(rows, weights=data, minlength=len(indptr) - 1)
+        probs = data / np.where(sums > 0, sums, 1)[rows]
+        transient = rows < m
+
+        converts = transient & (indices == m)
+        r = np.bincount(rows[converts], weights=probs[converts], minlength=m)
+        inner = transient & (indices < m)
+        q_rows, q_cols, q_probs = rows[inner], indices[inner], probs[inner]
+        loop = q_rows == q_cols
+        self_loop = np.bincount(q_rows[loop], weights=q_probs[loop], minlength=m)
+        inv_diag = 1.0 / np.maximum(1.0 - self_loop, 1e-12)
+        off = ~loop
+        q_rows, q_cols, q_probs = q_rows[off], q_cols[off], q_probs[off]
+
+        start = np.zeros(m)
+        start[self.n_channels] = 1.0
+        self.x, x_iterations = self._jacobi(q_rows, q_cols, q_probs, r, inv_diag, self.x)
+        self.visits, y_iterations = self._jacobi(q_cols, q_rows, q_probs, start, inv_diag, self.visits)
+        self.iterations = max(x_iterations, y_iterations)
+
+        if self._pattern is None or not (np.array_equal(self._pattern[0], q_rows)
+                                         and np.array_equal(self._pattern[1], q_cols)):
+            self._pattern = (q_rows, q_cols)
+            self._blocks = _component_blocks(q_rows, q_cols, m)
+        self.N_diag = inv_diag.copy()
+        for members, edges, local_rows, local_cols in self._blocks:
+            A = np.diag(1.0 - self_loop[members])
+            A[local_rows, local_cols] = -q_probs[edges]
+            try:
+                self.N_diag[members] = np.diagonal(np.linalg.inv(A))
+            except np.linalg.LinAlgError:
+                self.N_diag[members] = np.diagonal(np.linalg.pinv(A))
+
+    def _jacobi(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray, b: np.ndarray,
+                inv_diag: np.ndarray, x: np.ndarray) -> Tuple[np.ndarray, int]:
+        # x_i = (b_i + sum_{j != i} Q_ij x_j) / (1 - Q_ii)
+        m = len(b)
+        for iteration in range(1, self.max_iter + 1):
+            new = (b + np.bincount(rows, weights=values * x[cols], minlength=m)) * inv_diag
+            if np.abs(new - x).max() <= self.tol:
+                return new, iteration
+            x = new
+        return x, self.max_iter
+
+    @property
+    def conversion_probability(self) -> float:
+        """Probability of reaching Conversion from Start."""
+        return float(self.x[self.n_channels])
+
+    def removal_effects(self, conversion_probability: Optional[float] = None) -> np.ndarray:
+        """
+        Relative drop in conversion probability when each channel is removed.
+
+        Returns:
+            Array of length n_channels with values in [0, 1]
+        """
+        base = self.conversion_probability if conversion_probability is None else conversion_probability
+        if base <= 0:
+            return np.zeros(self.n_channels)
+
+        n = self.n_channels
+        removed = base - self.visits[:n] * self.x[:n] / self.N_diag[:n]
+        return np.clip(1.0 - removed / base, 0.0, 1.0)
+
+
+def _component_blocks(rows: np.ndarray, cols: np.ndarray, m: int):
+    """
+    Strongly connected components with more than one state, each as
+    (members, edge positions, local rows, local cols) for building its block.
+    """
+    # Trim states with no in- or out-edges among the remaining ones: they
+    # cannot be on a cycle
+    alive = np.ones(m, dtype=bool)
+    while True:
+        live = alive[rows] & alive[cols]
+        trimmed = alive & (np.bincount(rows[live], minlength=m) > 0) & (np.bincount(cols[live], minlength=m) > 0)
+        if (trimmed == alive).all():
+            break
+        alive = trimmed
+    if not alive.any():
+        return []
+
+    # Well-connected chains tend to form one giant component: peel off the
+    # component of the busiest state with vectorized forward/backward
+    # reachability, then run Tarjan on what is left
+    components: List[List[int]] = []
+    live = alive[rows] & alive[cols]
+    degree = np.bincount(rows[live], minlength=m)
+    seed = int(np.argmax(degree))
+    giant = _reachable(seed, rows[live], cols[live], m) & _reachable(seed, cols[live], rows[live], m)
+    if giant.sum() > 1:
+        components.append(np.flatnonzero(giant).tolist())
+        alive &= ~giant
+    live = np.flatnonzero(alive[rows] & alive[cols])
+
+    # Iterative Tarjan over the remaining edges
+    order = live[np.argsort(rows[live], kind='stable')]
+    adjacency = cols[order].tolist()
+    starts = np.zeros(m + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[order], minlength=m), out=starts[1:])
+    starts = starts.tolist()
+    index = [-1] * m
+    low = [0] * m
+    on_stack = [False] * m
+    stack: List[int] = []
+    counter = 0
+    for root in np.flatnonzero(alive).tolist():
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [[root, starts[root]]]
+        while work:
+            frame = work[-1]
+            v, i = frame
+            if i < starts[v + 1]:
+                frame[1] = i + 1
+                w = adjacency[i]
+                if index[w] < 0:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append([w, starts[w]])
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                if low[v] < low[u]:
+                    low[u] = low[v]
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                if len(component) > 1:
+                    components.append(component)
+
+    label = np.full(m, -1, dtype=np.int64)
+    local = np.zeros(m, dtype=np.int64)
+    for c, component in enumerate(components):
+        label[component] = c
+        local[component] = np.arange(len(component))
+    inside = np.flatnonzero((label[rows] >= 0) & (label[rows] == label[cols]))
+    inside = inside[np.argsort(label[rows[inside]], kind='stable')]
+    bounds = np.searchsorted(label[rows[inside]], np.arange(len(components) + 1))
+    blocks = []
+    for c, component in enumerate(components):
+        edges = inside[bounds[c]:bounds[c + 1]]
+        blocks.append((np.array(component), edges, local[rows[edges]], local[cols[edges]]))
+    return blocks
+
+
+def _reachable(seed: int, sources: np.ndarray, targets: np.ndarray, m: int) -> np.ndarray:
+    """States reachable from seed along the given edges (breadth-first)."""
+    seen = np.zeros(m, dtype=bool)
+    seen[seed] = True
+    frontier = seen.copy()
+    while True:
+        step = np.zeros(m, dtype=bool)
+        step[targets[frontier[sources]]] = True
+        step &= ~seen
+        if not step.any():
+            return seen
+        seen |= step
+        frontier = step
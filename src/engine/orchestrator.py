@@ -4,120 +4,376 @@ Streaming Orchestrator
 
 Connects the Event Simulator, Attribution Engine, and WebSocket API.
 Provides the "Live" heart of the dashboard.
+
+Events flow through an asyncio pipeline (engine/pipeline.py): source ->
+sessionize -> attribute -> publish, with bounded queues between stages.
+Published metrics carry the measured throughput and queue depth of each
+stage.
+
+With stream_by, conversions are also attributed per stream (one engine per
+campaign or device in an EngineRegistry), and each stream that changed is
+published to its own dashboard stream (/ws/{stream}) with the default one.
+
+With a source (engine/sources.py: a partitioned file topic or Kafka), events
+come from its partitions instead of the simulator, consumed by worker
+processes, and each partition's position is committed once the engine has
+applied it: source -> attribute -> commit -> publish.
+
+Publication is adaptive (engine/scheduler.py): scores are recomputed once
+publish_conversions new conversions arrived (at most every
+publish_interval) and broadcast only if a channel share moved more than
+publish_epsilon, with a heartbeat every heartbeat_interval regardless.
 """
 
 import sys
 import os
 import json
 import time
-import requests
-import threading
+import asyncio
+import argparse
 from datetime import datetime
+from typing import List, Optional
 
 # Add parent dir to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from simulator.event_generator import EventStreamSimulator
 from engine.streaming_attribution import StreamingAttributionEngine
+from engine.checkpoint import Checkpointer
+from engine.registry import EngineRegistry
+from engine.scheduler import PublishScheduler
+from engine.pipeline import (Pipeline, SourceStage, SessionizeStage, AttributeStage, CommitStage,
+                             PublishStage, ConsumerStage)
+from engine.sources import Source, SOURCES, make_source
 from alerts.alert_manager import AlertManager
+from api.publishers import Publisher, HttpPublisher, PUBLISHERS, make_publisher
+from telemetry.histogram import REGISTRY
 
 class StreamingOrchestrator:
-    def __init__(self, api_url: str = "http://localhost:8000/update"):
+    def __init__(self, api_url: str = "http://localhost:8000/update",
+                 publisher: Optional[Publisher] = None, publish_interval: float = 0.1,
+                 heartbeat_interval: float = 5.0, publish_conversions: int = 100,
+                 publish_epsilon: float = 0.002,
+                 latency: bool = False, checkpoint_dir: Optional[str] = None,
+                 checkpoint_interval: float = 30.0, events_per_second: int = 1000,
+                 batch_size: Optional[int] = None, queue_size: int = 8,
+                 process_stages: Optional[List[str]] = None, seed: Optional[int] = None,
+                 bootstrap_replicates: int = 32, stream_by: Optional[str] = None,
+                 stream_idle_timeout: float = 300.0, max_streams: Optional[int] = None,
+                 stream_dir: Optional[str] = None, source: Optional[Source] = None,
+                 consumer_workers: int = 1):
+        """
+        Args:
+            api_url: Dashboard /update URL for the default HTTP publisher
+            publisher: How metrics reach the dashboard (default: keep-alive HTTP)
+            publish_interval: Minimum seconds between score recomputations
+            heartbeat_interval: Maximum seconds between publications, changed
+                or not (equal to publish_interval: fixed cadence)
+            publish_conversions: New conversions that make a recomputation due
+            publish_epsilon: Share change below which a recomputed result is
+                not published
+            latency: Timestamp events and record latency histograms, sent
+                with each publication under "latency"
+            checkpoint_dir: Restore engine state from this directory on
+                start, checkpoint it every checkpoint_interval seconds and
+                log conversions in between (default: no persistence)
+            checkpoint_interval: Seconds between checkpoints
+            events_per_second: Simulated event rate (0: as fast as the
+                pipeline drains)
+            batch_size: Events per source batch (default: 50ms of events)
+            queue_size: Batches buffered between stages before backpressure
+            process_stages: Stages run in worker processes ('source',
+                'sessionize'); the rest run as asyncio tasks
+            seed: Simulator seed
+            bootstrap_replicates: Bootstrap replicates behind the published
+                share intervals and confidence (0: off, confidence published
+                as None). Costs roughly 1.3x the plain batch update on the
+                4 orchestrator channels
+            stream_by: Also attribute per 'campaign' or 'device' stream
+            stream_idle_timeout: Seconds without conversions before a
+                stream's engine is evicted
+            max_streams: Stream engines kept in memory at most
+            stream_dir: Checkpoint evicted stream engines here and restore
+                them when the stream returns (default: start over)
+            source: Consume events from this partitioned source, resuming
+                at its committed positions (default: the simulator)
+            consumer_workers: Worker processes consuming the source's
+                partitions
+        """
+        if stream_by not in (None, 'campaign', 'device'):
+            raise ValueError(f"Unknown stream label: {stream_by}")
         self.api_url = api_url
+        self.publisher = publisher or HttpPublisher(api_url)
+        self.scheduler = PublishScheduler(publish_interval, heartbeat_interval,
+                                          publish_conversions, publish_epsilon)
         self.channels = ["Search", "Social", "Display", "Email"]
-        self.engine = StreamingAttributionEngine(self.channels)
+        self.latency = latency
+        self.bootstrap_replicates = bootstrap_replicates
+        self.engine = StreamingAttributionEngine(self.channels, instrument=latency,
+                                                 dimensions=['campaign', 'device'],
+                                                 bootstrap_replicates=bootstrap_replicates,
+                                                 bootstrap_seed=seed)
+        self.registry = None
+        # Conversions per stream at its last publication
+        self._stream_published = {}
+        if stream_by:
+            self.registry = EngineRegistry(self._stream_engine, idle_timeout=stream_idle_timeout,
+                                           max_streams=max_streams, directory=stream_dir)
         self.alert_manager = AlertManager()
-        self.simulator = EventStreamSimulator(events_per_second=1000)
+        self.checkpointer = None
+        if checkpoint_dir:
+            self.checkpointer = Checkpointer(self.engine, checkpoint_dir, interval=checkpoint_interval)
         
-        self.running = False
-        self.events_processed = 0
+        self.source = source
+        if source is not None:
+            stages = [ConsumerStage(source, self.channels, consumer_workers),
+                      AttributeStage(self.engine, self.registry, stream_by),
+                      CommitStage(source)]
+        else:
+            if batch_size is None:
+                batch_size = max(1, events_per_second // 20) if events_per_second else 10000
+            simulated = SourceStage(events_per_second, batch_size, seed=seed, instrument=latency)
+            stages = [simulated,
+                      SessionizeStage(self.channels, simulated.simulator.channels, simulated.simulator.campaigns),
+                      AttributeStage(self.engine, self.registry, stream_by)]
+        self.pipeline = Pipeline(
+            stages + [PublishStage(self._publish, self.scheduler)],
+            modes={name: 'process' for name in process_stages or []},
+            queue_size=queue_size
+        )
         self.start_time = time.time()
         
-    def start(self, duration: int = 3600):
-        self.running = True
+    def start(self, duration: Optional[float] = 3600):
+        """Run the pipeline on a new event loop until duration elapses or Ctrl-C."""
+        try:
+            asyncio.run(self.run(duration))
+        except KeyboardInterrupt:
+            pass
+            
+    async def run(self, duration: Optional[float] = 3600):
+        """Run the pipeline on the current event loop (e.g. the dashboard server's)."""
         self.start_time = time.time()
+        if self.checkpointer is not None:
+            restored = await asyncio.to_thread(self.checkpointer.restore)
+            print(f"Restored {self.engine.total_conversions} conversions in "
+                  f"{restored['elapsed_seconds'] * 1000:.0f}ms")
+            self.checkpointer.start()
         
-        # Start API reporting thread
-        report_thread = threading.Thread(target=self._reporting_loop, daemon=True)
-        report_thread.start()
-        
-        print(f"Orchestrator started. Reporting to {self.api_url}")
-        
-        # Main event loop (simplified version of simulate_events)
+        modes = ', '.join(f"{name}={mode}" for name, mode in self.pipeline.modes.items())
+        print(f"Orchestrator started ({modes}). Publishing via {type(self.publisher).__name__} "
+              f"on change (every {self.scheduler.min_interval}s at most, "
+              f"{self.scheduler.max_interval}s at least)")
         try:
-            while self.running and (time.time() - self.start_time) < duration:
-                batch_start = time.time()
-                
-                for _ in range(self.simulator.events_per_second):
-                    # Generate random event type
-                    import random
-                    event_type = random.choices(
-                        ['impression', 'click', 'conversion'],
-                        weights=[0.90, 0.08, 0.02]
-                    )[0]
-                    
-                    if event_type == 'impression':
-                        self.simulator.generate_impression_event()
-                    elif event_type == 'click':
-                        if self.simulator.active_sessions:
-                            uid = random.choice(list(self.simulator.active_sessions.keys()))
-                            self.simulator.generate_click_event(uid)
-                    else:  # conversion
-                        if self.simulator.active_sessions:
-                            uid = random.choice(list(self.simulator.active_sessions.keys()))
-                            event = self.simulator.generate_conversion_event(uid)
-                            if event:
-                                # Process path
-                                path = [tp['channel'] for tp in event['attribution_touchpoints']]
-                                self.engine.process_conversion(path, event['conversion_value'])
-                    
-                    self.events_processed += 1
+            await self.pipeline.run(duration)
+        finally:
+            if self.checkpointer is not None:
+                await asyncio.to_thread(self.checkpointer.stop)
+            if self.registry is not None:
+                await asyncio.to_thread(self.registry.close)
+            if self.source is not None:
+                self.source.close()
                 
-                # Maintain rate
-                elapsed = time.time() - batch_start
-                if elapsed < 1.0:
-                    time.sleep(1.0 - elapsed)
-                    
-        except KeyboardInterrupt:
-            self.running = False
+    def stop(self):
+        """Stop the source and let the pipeline drain (thread-safe)."""
+        self.pipeline.stop()
+        
+    def _publish(self):
+        """Score the engine and publish metrics if the scheduler deems them changed (called by the publish stage)."""
+        try:
+            scores = self.engine.get_current_scores()
+            if not self.scheduler.should_publish(scores['shares']):
+                if self.registry is not None:
+                    self._publish_streams()
+                return
+            stages = self.pipeline.summary()
             
-    def _reporting_loop(self):
-        while self.running:
-            try:
-                scores = self.engine.get_current_scores()
-                
-                # Combine with health metrics
-                metrics = {
-                    "attribution": scores['shares'],
-                    "health": {
-                        "fill_rate": 0.94 + (0.02 * (time.time() % 10) / 10), # Simulated drift
-                        "ctr": 0.023 + (0.005 * (time.time() % 5) / 5),
-                        "conversion_rate": 0.051,
-                        "frequency_avg": 2.1 + (0.5 * (time.time() % 15) / 15)
-                    },
-                    "attribution_stats": {
-                        "confidence": 0.85 + (0.1 * (time.time() % 60) / 60)
-                    },
-                    "events_sec": self.simulator.events_per_second + (random_jitter() if 'random_jitter' in globals() else 0),
-                    "total_events": self.events_processed
-                }
-                
-                # Check for alerts
-                alerts = self.alert_manager.check_metrics(metrics)
-                metrics["alerts"] = alerts
-                
-                # Post to API
-                requests.post(self.api_url, json=metrics, timeout=1)
-                
-            except Exception as e:
-                print(f"Reporting error: {e}")
+            # Combine with health metrics
+            metrics = {
+                "attribution": scores['shares'],
+                "health": {
+                    "fill_rate": 0.94 + (0.02 * (time.time() % 10) / 10), # Simulated drift
+                    "ctr": 0.023 + (0.005 * (time.time() % 5) / 5),
+                    "conversion_rate": 0.051,
+                    "frequency_avg": 2.1 + (0.5 * (time.time() % 15) / 15)
+                },
+                "attribution_stats": attribution_stats(scores),
+                # Measured: events fully attributed per second, and the
+                # throughput and queue depth of every stage
+                "events_sec": stages['attribute']['events_per_sec'],
+                "total_events": stages['source']['events'],
+                "pipeline": stages,
+                "publish": self.scheduler.stats(),
+                "campaigns": slice_summary(self.engine.get_dimensional_scores(by='campaign')),
+                "devices": slice_summary(self.engine.get_dimensional_scores(by='device'))
+            }
+            
+            # Check for alerts
+            alerts = self.alert_manager.check_metrics(metrics)
+            metrics["alerts"] = alerts
+            if self.latency:
+                metrics["latency"] = REGISTRY.summary()
+                metrics["latency_marks"] = scores.get('latency_marks')
                 
-            time.sleep(5)  # Report every 5 seconds
+            self.publisher.publish(metrics)
+            if self.registry is not None:
+                self._publish_streams()
+            
+        except Exception as e:
+            print(f"Reporting error: {e}")
+            
+    def _stream_engine(self, stream: str) -> StreamingAttributionEngine:
+        return StreamingAttributionEngine(self.channels, bootstrap_replicates=self.bootstrap_replicates)
+        
+    def _publish_streams(self):
+        """Publish every stream with new conversions, then evict idle ones."""
+        for stream in self.registry.streams():
+            engine = self.registry.peek(stream)
+            if engine is None or self._stream_published.get(stream) == engine.total_conversions:
+                continue
+            with self.registry.use(stream) as engine:
+                scores = engine.get_current_scores()
+            self._stream_published[stream] = scores['total_conversions']
+            self.publisher.publish({
+                "stream": stream,
+                "attribution": scores['shares'],
+                "attribution_stats": attribution_stats(scores),
+                "conversions": scores['total_conversions'],
+                "value": scores['total_value'],
+            })
+        for stream in self.registry.evict_idle():
+            self._stream_published.pop(stream, None)
+
+def attribution_stats(scores: dict) -> dict:
+    """Bootstrap confidence and 95% share intervals, when the engine keeps replicates."""
+    bootstrap = scores.get('bootstrap')
+    if bootstrap is None:
+        return {"confidence": None}
+    return {
+        "confidence": bootstrap['confidence'],
+        "intervals": bootstrap['intervals'],
+        "conversion_probability": bootstrap['conversion_probability'],
+        "replicates": bootstrap['replicates'],
+    }
 
-def random_jitter():
-    import random
-    return random.randint(-50, 50)
+def slice_summary(rollup: dict) -> dict:
+    """Compact per-slice payload: channel shares, conversions and value."""
+    return {
+        label: {
+            "attribution": scores['shares'],
+            "conversions": scores['total_conversions'],
+            "value": scores['total_value']
+        }
+        for label, scores in rollup.items()
+    }
+
+def run_in_process(orchestrator_kwargs: dict, host: str = "0.0.0.0", port: int = 8000,
+                   history_dir: Optional[str] = None):
+    """Host the dashboard app and the orchestrator on one event loop."""
+    import uvicorn
+    from api import websocket_server
+    from api.publishers import InProcessPublisher
+
+    if orchestrator_kwargs.get('latency'):
+        websocket_server.instrument(True)
+    websocket_server.configure_history(history_dir)
+
+    running = {}
+
+    @websocket_server.app.on_event("startup")
+    async def start_orchestrator():
+        publisher = InProcessPublisher(asyncio.get_running_loop(), websocket_server.apply_update)
+        orchestrator = StreamingOrchestrator(publisher=publisher, **orchestrator_kwargs)
+        running['orchestrator'] = orchestrator
+        running['task'] = asyncio.create_task(orchestrator.run(duration=None))
+
+    @websocket_server.app.on_event("shutdown")
+    async def stop_orchestrator():
+        running['orchestrator'].stop()
+        await running['task']
+
+    uvicorn.run(websocket_server.app, host=host, port=port)
 
 if __name__ == "__main__":
-    orchestrator = StreamingOrchestrator()
-    orchestrator.start()
+    parser = argparse.ArgumentParser(description='Run the streaming orchestrator')
+    parser.add_argument('--publisher', choices=PUBLISHERS, default='http',
+                        help='Metrics transport (default: http); inprocess also hosts the dashboard app')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Publisher target (URL, or socket path for unix)')
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='Minimum seconds between score recomputations (default: 0.1)')
+    parser.add_argument('--heartbeat', type=float, default=5.0,
+                        help='Publish at least this often in seconds, changed or not (default: 5)')
+    parser.add_argument('--publish-conversions', type=int, default=100,
+                        help='New conversions that trigger a recomputation (default: 100)')
+    parser.add_argument('--epsilon', type=float, default=0.002,
+                        help='Share change needed to publish a recomputation (default: 0.002)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Dashboard port for --publisher inprocess (default: 8000)')
+    parser.add_argument('--latency', action='store_true',
+                        help='Record end-to-end latency histograms')
+    parser.add_argument('--checkpoint-dir', type=str, default=None,
+                        help='Persist engine state here and restore it on start')
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0,
+                        help='Seconds between checkpoints (default: 30)')
+    parser.add_argument('--rate', type=int, default=1000,
+                        help='Simulated events per second, 0 for unthrottled (default: 1000)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Events per source batch (default: 50ms of events)')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='Batches buffered between stages (default: 8)')
+    parser.add_argument('--process-stages', type=str, default='',
+                        help='Comma-separated stages to run in worker processes (source, sessionize)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Simulator seed')
+    parser.add_argument('--bootstrap-replicates', type=int, default=32,
+                        help='Bootstrap replicates for attribution confidence, 0 to disable (default: 32)')
+    parser.add_argument('--history-dir', type=str, default=None,
+                        help='With --publisher inprocess: persist /history to files here')
+    parser.add_argument('--stream-by', choices=['campaign', 'device'], default=None,
+                        help='Also attribute and publish each campaign or device as its own stream')
+    parser.add_argument('--stream-idle-timeout', type=float, default=300.0,
+                        help='Seconds without conversions before a stream engine is evicted (default: 300)')
+    parser.add_argument('--max-streams', type=int, default=None,
+                        help='Stream engines kept in memory at most')
+    parser.add_argument('--source', choices=SOURCES, default='simulator',
+                        help='Event source: the simulator, a partitioned file topic or Kafka (default: simulator)')
+    parser.add_argument('--topic', type=str, default=None,
+                        help='Topic directory (--source file) or topic name (--source kafka)')
+    parser.add_argument('--brokers', type=str, default='localhost:9092',
+                        help='Kafka bootstrap servers (default: localhost:9092)')
+    parser.add_argument('--group', type=str, default='attribution',
+                        help='Consumer group whose positions are committed (default: attribution)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes consuming the source partitions (default: 1)')
+    parser.add_argument('--stream-dir', type=str, default=None,
+                        help='Checkpoint evicted stream engines here and restore them on return')
+
+    args = parser.parse_args()
+    if args.source != 'simulator' and not args.topic:
+        parser.error(f"--source {args.source} needs --topic")
+    options = {
+        'publish_interval': args.interval,
+        'heartbeat_interval': args.heartbeat,
+        'publish_conversions': args.publish_conversions,
+        'publish_epsilon': args.epsilon,
+        'latency': args.latency,
+        'checkpoint_dir': args.checkpoint_dir,
+        'checkpoint_interval': args.checkpoint_interval,
+        'events_per_second': args.rate,
+        'batch_size': args.batch_size,
+        'queue_size': args.queue_size,
+        'process_stages': [s for s in args.process_stages.split(',') if s],
+        'seed': args.seed,
+        'bootstrap_replicates': args.bootstrap_replicates,
+        'stream_by': args.stream_by,
+        'stream_idle_timeout': args.stream_idle_timeout,
+        'max_streams': args.max_streams,
+        'stream_dir': args.stream_dir,
+        'consumer_workers': args.workers,
+    }
+    if args.source != 'simulator':
+        options['source'] = make_source(args.source, args.topic, args.brokers, args.group)
+    if args.publisher == 'inprocess':
+        run_in_process(options, port=args.port, history_dir=args.history_dir)
+    else:
+        orchestrator = StreamingOrchestrator(publisher=make_publisher(args.publisher, args.url), **options)
+        orchestrator.start()
@@ -0,0 +1,559 @@
+"""
+Staged Pipeline
+===============
+
+The orchestrator's event path as a chain of stages joined by bounded
+asyncio queues:
+
+    source -> sessionize -> attribute -> publish
+
+- source: draws simulator event batches (generate_batch), paced to the
+  target rate; or ConsumerStage, which polls a partitioned Source
+  (engine/sources.py) in worker processes and emits sessionized batches
+  directly (source -> attribute -> commit -> publish)
+- sessionize: turns a batch's closed sessions into engine-encoded paths,
+  values and dimension labels
+- attribute: applies the paths with one process_conversions_batch call
+  (plus one per stream present in the batch when routing to an
+  EngineRegistry)
+- commit: commits the source positions of each batch once attributed
+- publish: drains attributed batch counts into a PublishScheduler and
+  calls the orchestrator's publish function when it says scores are due
+
+Batches are handed over whole, never per event. A full queue blocks the
+stage feeding it (backpressure), so a slow engine slows the source instead
+of growing memory. Stage work runs off the event loop: in a thread
+('task' mode) or in a dedicated worker process ('process' mode; stateful
+stages build their state in the worker). Every stage reports measured
+throughput, busy and blocked time, and the depth of its inbound queue.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.streaming_attribution import select_paths
+from engine.replay import parse_jsonl_chunk
+from engine.sources import Source, PartitionReader
+from engine.scheduler import PublishScheduler
+from simulator.event_generator import EventStreamSimulator, EVENT_TYPES, DEVICE_TYPES
+
+STAGE_MODES = ('task', 'process')
+CONVERSION = EVENT_TYPES.index('conversion')
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+
+class StageStats:
+    """
+    Counters for one stage, with throughput over a sliding window.
+    """
+
+    def __init__(self, name: str, mode: str, window: float = 5.0):
+        """
+        Args:
+            name: Stage name
+            mode: 'task' or 'process'
+            window: Seconds of history behind events_per_sec
+        """
+        self.name = name
+        self.mode = mode
+        self.window = window
+        self.batches = 0
+        self.events = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.started = time.monotonic()
+        self._recent = deque()
+
+    def record(self, events: int, busy: float):
+        now = time.monotonic()
+        self.batches += 1
+        self.events += events
+        self.busy_seconds += busy
+        self._recent.append((now, events))
+        self._trim(now)
+
+    def _trim(self, now: float):
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def rate(self) -> float:
+        """Events per second over the last window."""
+        now = time.monotonic()
+        self._trim(now)
+        span = min(self.window, now - self.started)
+        return sum(n for _, n in self._recent) / span if span > 0 else 0.0
+
+    def summary(self, queue: Optional[asyncio.Queue] = None) -> Dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'mode': self.mode,
+            'batches': self.batches,
+            'events': self.events,
+            'events_per_sec': self.rate(),
+            'queue_depth': queue.qsize() if queue is not None else 0,
+            'queue_capacity': queue.maxsize if queue is not None else 0,
+            'busy_seconds': self.busy_seconds,
+            'blocked_seconds': self.blocked_seconds,
+            'utilization': min(self.busy_seconds / elapsed, 1.0),
+        }
+
+
+class Stage:
+    """
+    One pipeline step. work() maps an input batch (a dict with 'n_events')
+    to an output batch, or None to drop it. To run in process mode a stage
+    must be picklable; state that is not gets built in setup().
+    """
+
+    name = 'stage'
+    # Stages holding state the main process reads (the engine) stay in-process
+    process_capable = True
+    # Stages with an interval also get tick() calls from their runner
+    interval: Optional[float] = None
+
+    def setup(self):
+        """Build per-worker state (in the worker process in process mode)."""
+
+    def work(self, batch: Optional[Dict]) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def tick(self):
+        """Periodic work for stages with an interval."""
+
+    def finish(self):
+        """Final work once the input is exhausted (stages with an interval)."""
+        self.tick()
+
+    def close(self):
+        """Release resources once the pipeline stops (main process)."""
+
+
+class SourceStage(Stage):
+    """
+    Simulator batches; work() ignores its argument.
+    """
+
+    name = 'source'
+
+    def __init__(self, events_per_second: int = 1000, batch_size: int = 1000,
+                 seed: Optional[int] = None, instrument: bool = False):
+        """
+        Args:
+            events_per_second: Target rate (0: unthrottled)
+            batch_size: Events per generate_batch call
+            seed: Simulator seed
+            instrument: Stamp batches with 'emitted_at'
+        """
+        self.events_per_second = events_per_second
+        self.batch_size = batch_size
+        # Copied into the worker in process mode; the main process copy
+        # then only supplies channel and campaign names
+        self.simulator = EventStreamSimulator(events_per_second=events_per_second,
+                                              seed=seed, instrument=instrument)
+
+    def work(self, batch: Optional[Dict] = None) -> Dict:
+        batch = self.simulator.generate_batch(self.batch_size)
+        batch['n_events'] = len(batch['event_id'])
+        return batch
+
+
+_consumer: Optional[PartitionReader] = None
+_consumer_channels: Dict[str, int] = {}
+
+
+def _init_consumer(source: Source, positions: Dict, channel_to_idx: Dict[str, int]):
+    global _consumer, _consumer_channels
+    _consumer = source.open(positions)
+    _consumer_channels = channel_to_idx
+
+
+def _consume(max_records: int, timeout: float) -> List[Dict]:
+    """Poll the worker's partitions and parse each one's messages, in partition order."""
+    parts = []
+    for partition, (messages, position) in sorted(_consumer.poll(max_records, timeout).items()):
+        part = parse_jsonl_chunk(b'\n'.join(messages), _consumer_channels)
+        part['position'] = position
+        parts.append((partition, part))
+    return parts
+
+
+class ConsumerStage(Stage):
+    """
+    Sessionized batches from a partitioned Source; work() ignores its
+    argument and returns None once caught up (unless following).
+
+    Partition p is consumed by worker process p % workers, which polls and
+    parses its partitions while the previous batch is being attributed.
+    Each partition is read by one worker and batches are emitted in poll
+    order, so a partition's conversions reach the engine in log order.
+    Batches carry the position to commit per partition under 'commits'.
+    """
+
+    name = 'source'
+    # Runs its own worker processes
+    process_capable = False
+    events_per_second = 0
+
+    def __init__(self, source: Source, channels: List[str], workers: int = 1,
+                 max_records: int = 10000, poll_timeout: float = 0.1, follow: bool = True):
+        """
+        Args:
+            source: Topic to consume, from the group's committed positions
+            channels: Engine channel names, in index order
+            workers: Consumer processes (at most one per partition)
+            max_records: Messages per partition per poll
+            poll_timeout: Seconds a worker waits when its partitions are idle
+            follow: Keep polling once caught up (False: stop at the end)
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.source = source
+        self.channel_to_idx = {c: i for i, c in enumerate(channels)}
+        self.workers = min(workers, source.n_partitions)
+        self.max_records = max_records
+        self.poll_timeout = poll_timeout
+        self.follow = follow
+        self.skipped = 0
+        self._pools: List[ProcessPoolExecutor] = []
+        self._polls = []
+
+    def setup(self):
+        committed = self.source.committed()
+        for w in range(self.workers):
+            owned = {p: committed.get(p) for p in range(self.source.n_partitions) if p % self.workers == w}
+            self._pools.append(ProcessPoolExecutor(max_workers=1, initializer=_init_consumer,
+                                                   initargs=(self.source, owned, self.channel_to_idx)))
+        self._polls = [pool.submit(_consume, self.max_records, self.poll_timeout) for pool in self._pools]
+
+    def work(self, batch: Optional[Dict] = None) -> Optional[Dict]:
+        parts = []
+        for w, pool in enumerate(self._pools):
+            parts.extend(self._polls[w].result())
+            # Poll ahead while this batch is attributed
+            self._polls[w] = pool.submit(_consume, self.max_records, self.poll_timeout)
+        if not parts and not self.follow:
+            return None
+        parts.sort(key=lambda item: item[0])
+        n_events = sum(part['lines'] for _, part in parts)
+        self.skipped += sum(part['skipped'] for _, part in parts)
+        commits = {partition: part['position'] for partition, part in parts}
+        parts = [part for _, part in parts if len(part['values'])]
+        if not parts:
+            return {'n_events': n_events, 'offsets': None, 'commits': commits}
+        # Concatenate the partitions' paths, rebasing their offsets
+        bases = np.cumsum([0] + [int(part['offsets'][-1]) for part in parts[:-1]])
+        offsets = np.concatenate([parts[0]['offsets'][:1]] +
+                                 [part['offsets'][1:] + base for part, base in zip(parts, bases)])
+        return {
+            'n_events': n_events,
+            'channel_idx': np.concatenate([part['channel_idx'] for part in parts]).astype(np.int64),
+            'offsets': offsets,
+            'values': np.concatenate([part['values'] for part in parts]),
+            'labels': {dim: np.concatenate([part['labels'][dim] for part in parts])
+                       for dim in parts[0]['labels']},
+            'emitted_at': None,
+            'commits': commits,
+        }
+
+    def close(self):
+        for pool in self._pools:
+            pool.shutdown(cancel_futures=True)
+        self._pools = []
+        self._polls = []
+
+
+class SessionizeStage(Stage):
+    """
+    Closed sessions of a simulator batch to process_conversions_batch
+    arguments.
+    """
+
+    name = 'sessionize'
+
+    def __init__(self, engine_channels: List[str], source_channels: List[str],
+                 campaigns: List[str]):
+        """
+        Args:
+            engine_channels: Engine channel names, in index order
+            source_channels: Simulator channel names, in index order
+            campaigns: Simulator campaign names, in index order
+        """
+        self.channel_map = np.array([engine_channels.index(c) for c in source_channels], dtype=np.int64)
+        # Trailing None: index -1 (no campaign/device) maps to an unknown label
+        self.campaigns = np.array(list(campaigns) + [None], dtype=object)
+        self.devices = np.array(list(DEVICE_TYPES) + [None], dtype=object)
+
+    def work(self, batch: Dict) -> Optional[Dict]:
+        conversions = batch['event_type'] == CONVERSION
+        if not conversions.any():
+            return {'n_events': batch['n_events'], 'offsets': None}
+        return {
+            'n_events': batch['n_events'],
+            'channel_idx': self.channel_map[batch['path_channels']],
+            'offsets': batch['path_offsets'].astype(np.int64),
+            'values': batch['value'][conversions],
+            'labels': {
+                'campaign': self.campaigns[batch['campaign'][conversions]],
+                'device': self.devices[batch['device'][conversions]],
+            },
+            'emitted_at': batch.get('emitted_at'),
+        }
+
+
+class AttributeStage(Stage):
+    """
+    Applies sessionized batches to a StreamingAttributionEngine and, with a
+    registry, each stream's share of the batch to that stream's engine.
+    """
+
+    name = 'attribute'
+    process_capable = False
+
+    def __init__(self, engine, registry=None, stream_by: Optional[str] = None):
+        """
+        Args:
+            engine: Engine receiving every conversion
+            registry: EngineRegistry of per-stream engines
+            stream_by: Label naming a conversion's stream ('campaign' or
+                'device'); conversions without one only reach engine
+        """
+        if (registry is None) != (stream_by is None):
+            raise ValueError("registry and stream_by go together")
+        self.engine = engine
+        self.registry = registry
+        self.stream_by = stream_by
+
+    def work(self, batch: Dict) -> Dict:
+        conversions = 0
+        if batch['offsets'] is not None:
+            self.engine.process_conversions_batch(batch['channel_idx'], batch['offsets'], batch['values'],
+                                                  emitted_at=batch['emitted_at'], labels=batch['labels'])
+            conversions = len(batch['offsets']) - 1
+            if self.registry is not None:
+                self._route(batch)
+        return {'n_events': batch['n_events'], 'conversions': conversions, 'commits': batch.get('commits')}
+
+    def _route(self, batch: Dict):
+        labels = batch['labels'][self.stream_by]
+        known = np.not_equal(labels, None)
+        if not known.any():
+            return
+        streams, inverse = np.unique(labels[known].astype(str), return_inverse=True)
+        owner = np.full(len(labels), -1, dtype=np.int64)
+        owner[known] = inverse
+        for i, stream in enumerate(streams.tolist()):
+            selected = owner == i
+            channel_idx, offsets = select_paths(batch['channel_idx'], batch['offsets'], selected)
+            with self.registry.use(stream) as engine:
+                engine.process_conversions_batch(channel_idx, offsets, batch['values'][selected],
+                                                 emitted_at=batch['emitted_at'])
+
+
+class CommitStage(Stage):
+    """
+    Commits the source positions of each attributed batch, so a restart
+    resumes after the last applied batch; the commit for a batch happens
+    after the engine applied it (at-least-once delivery).
+    """
+
+    name = 'commit'
+    process_capable = False
+
+    def __init__(self, source: Source):
+        self.source = source
+        self.commits = 0
+
+    def work(self, batch: Dict) -> Dict:
+        if batch.get('commits'):
+            self.source.commit(batch['commits'])
+            self.commits += 1
+        return batch
+
+
+class PublishStage(Stage):
+    """
+    Counts attributed conversions and calls publish whenever the scheduler
+    says scores are due, checking every scheduler.min_interval seconds.
+    """
+
+    name = 'publish'
+    process_capable = False
+
+    def __init__(self, publish: Callable[[], None], scheduler: PublishScheduler):
+        """
+        Args:
+            publish: Scores the engine and publishes metrics (runs in a
+                thread); expected to pass the scores to
+                scheduler.should_publish
+            scheduler: Decides when scores are due
+        """
+        self.publish = publish
+        self.scheduler = scheduler
+        self.interval = scheduler.min_interval
+        self.conversions = 0
+
+    def work(self, batch: Dict) -> None:
+        self.conversions += batch['conversions']
+        self.scheduler.observe(batch['conversions'])
+        return None
+
+    def tick(self):
+        if self.scheduler.should_score():
+            self.publish()
+
+    def finish(self):
+        # Publish the final state if anything arrived since the last scoring
+        if self.scheduler.pending:
+            self.publish()
+
+
+_worker_stage: Optional[Stage] = None
+
+
+def _init_worker(stage: Stage):
+    global _worker_stage
+    _worker_stage = stage
+    stage.setup()
+
+
+def _work_in_worker(batch: Optional[Dict]) -> Optional[Dict]:
+    return _worker_stage.work(batch)
+
+
+class Pipeline:
+    """
+    Runs a chain of stages (the first one a source) on an asyncio loop.
+    """
+
+    def __init__(self, stages: List[Stage], modes: Optional[Dict[str, str]] = None,
+                 queue_size: int = 8):
+        """
+        Args:
+            stages: Source first, then each consumer in order
+            modes: 'task' (default) or 'process' by stage name
+            queue_size: Batches each inter-stage queue holds before the
+                upstream stage blocks
+        """
+        modes = modes or {}
+        for name, mode in modes.items():
+            if mode not in STAGE_MODES:
+                raise ValueError(f"Unknown stage mode: {mode}")
+            if name not in [s.name for s in stages]:
+                raise ValueError(f"Unknown stage: {name}")
+        for stage in stages:
+            if modes.get(stage.name) == 'process' and not stage.process_capable:
+                raise ValueError(f"Stage {stage.name} cannot run in a worker process")
+        self.stages = stages
+        self.modes = {s.name: modes.get(s.name, 'task') for s in stages}
+        self.queue_size = queue_size
+        self.queues: List[Optional[asyncio.Queue]] = []
+        self.stats = {s.name: StageStats(s.name, self.modes[s.name]) for s in stages}
+        self._stop: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def summary(self) -> Dict[str, Dict]:
+        """Per-stage stats; queue_depth is the stage's inbound queue."""
+        inbound = [None] + self.queues[1:] if self.queues else [None] * len(self.stages)
+        return {s.name: self.stats[s.name].summary(q) for s, q in zip(self.stages, inbound)}
+
+    def stop(self):
+        """Stop the source; later stages drain their queues and exit (thread-safe)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self, duration: Optional[float] = None):
+        """Run until duration elapses, stop() is called or a stage fails."""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self.queues = [None] + [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages[1:]]
+        for stats in self.stats.values():
+            stats.started = time.monotonic()
+        pools = []
+        calls = []
+        for stage in self.stages:
+            if self.modes[stage.name] == 'process':
+                pool = ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(stage,))
+                pools.append(pool)
+                calls.append(lambda batch, pool=pool: self._loop.run_in_executor(pool, _work_in_worker, batch))
+            else:
+                stage.setup()
+                calls.append(lambda batch, stage=stage: asyncio.to_thread(stage.work, batch))
+        tasks = [asyncio.create_task(self._run_source(self.stages[0], calls[0], self.queues[1], duration))]
+        for i, stage in enumerate(self.stages[1:], start=1):
+            outbox = self.queues[i + 1] if i + 1 < len(self.stages) else None
+            tasks.append(asyncio.create_task(self._run_stage(stage, calls[i], self.queues[i], outbox)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for stage in self.stages:
+                stage.close()
+            for pool in pools:
+                pool.shutdown(cancel_futures=True)
+
+    async def _put(self, outbox: Optional[asyncio.Queue], batch, stats: StageStats):
+        if outbox is None:
+            return
+        start = time.perf_counter()
+        await outbox.put(batch)
+        stats.blocked_seconds += time.perf_counter() - start
+
+    async def _run_source(self, stage: SourceStage, call, outbox: asyncio.Queue, duration: Optional[float]):
+        stats = self.stats[stage.name]
+        start = time.monotonic()
+        while not self._stop.is_set() and (duration is None or time.monotonic() - start < duration):
+            t = time.perf_counter()
+            batch = await call(None)
+            if batch is None:
+                # Source exhausted
+                break
+            stats.record(batch['n_events'], time.perf_counter() - t)
+            await self._put(outbox, batch, stats)
+            if stage.events_per_second:
+                # Sleep to maintain rate
+                ahead = stats.events / stage.events_per_second - (time.monotonic() - start)
+                if ahead > 0:
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), ahead)
+                    except asyncio.TimeoutError:
+                        pass
+        await self._put(outbox, _DONE, stats)
+
+    async def _run_stage(self, stage: Stage, call, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+        stats = self.stats[stage.name]
+        next_tick = time.monotonic() + stage.interval if stage.interval else None
+        while True:
+            if next_tick is not None:
+                try:
+                    batch = await asyncio.wait_for(inbox.get(), max(0.0, next_tick - time.monotonic()))
+                except asyncio.TimeoutError:
+                    batch = None
+                if time.monotonic() >= next_tick:
+                    # Fixed cadence: the interval includes the tick itself
+                    await asyncio.to_thread(stage.tick)
+                    next_tick = max(next_tick + stage.interval, time.monotonic())
+                if batch is None:
+                    continue
+            else:
+                batch = await inbox.get()
+            if batch is _DONE:
+                break
+            t = time.perf_counter()
+            result = await call(batch)
+            stats.record(batch['n_events'], time.perf_counter() - t)
+            if result is not None:
+                await self._put(outbox, result, stats)
+        if stage.interval:
+            await asyncio.to_thread(stage.finish)
+        await self._put(outbox, _DONE, stats)
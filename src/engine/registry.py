@@ -0,0 +1,221 @@
+"""
+Engine Registry
+===============
+
+Many independent attribution streams (advertisers, tenants, live events)
+in one process, each with its own StreamingAttributionEngine, keyed by
+stream id.
+
+- Engines are created on first use by a factory.
+- Streams idle for idle_timeout seconds are evicted, as is the least
+  recently used one when max_streams is reached. With a directory, an
+  evicted engine is checkpointed to <directory>/<stream>.ckpt and
+  restored (memory-mapped) on its next use, so an idle stream costs a
+  file on disk and no memory.
+- Every engine keeps its own lock. The registry lock only guards the
+  dictionary, and loading, checkpointing and ingest all happen outside
+  it, so a busy stream never waits on another.
+
+Usage:
+    registry = EngineRegistry(lambda stream: StreamingAttributionEngine(channels),
+                              idle_timeout=300, directory="streams/")
+    with registry.use("advertiser_42") as engine:
+        engine.process_conversions_batch(...)
+    registry.evict_idle()       # e.g. from a periodic task
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.checkpoint import read_checkpoint, write_checkpoint
+
+# Stream ids double as file names and URL path segments
+STREAM_ID = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+def validate_stream_id(stream: str) -> str:
+    """Return stream if it is a valid id, else raise ValueError."""
+    if not isinstance(stream, str) or not STREAM_ID.match(stream):
+        raise ValueError(f"Invalid stream id {stream!r} (letters, digits, '_', '.', '-'; at most 64)")
+    return stream
+
+
+class _Entry:
+    """One stream's slot: engine (None until loaded), its lock and users."""
+
+    __slots__ = ('engine', 'lock', 'users', 'last_used')
+
+    def __init__(self, now: float):
+        self.engine = None
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = now
+
+
+class EngineRegistry:
+    """
+    Lazily created, idle-evicted engines keyed by stream id.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], idle_timeout: Optional[float] = 300.0,
+                 max_streams: Optional[int] = None, directory: Optional[str] = None,
+                 fsync: bool = False):
+        """
+        Args:
+            factory: Builds a fresh engine for a stream id
+            idle_timeout: Seconds without use before evict_idle drops a
+                stream (None: never)
+            max_streams: Loaded engines kept at most; creating one more
+                evicts the least recently used idle stream
+            directory: Checkpoint evicted engines here and restore them on
+                next use (default: evicted state is discarded)
+            fsync: fsync eviction checkpoints
+        """
+        if max_streams is not None and max_streams < 1:
+            raise ValueError("max_streams must be at least 1")
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_streams = max_streams
+        self.directory = directory
+        self.fsync = fsync
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.restored = 0
+        self.evicted = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, stream: str) -> str:
+        return os.path.join(self.directory, f"{stream}.ckpt")
+
+    @contextmanager
+    def use(self, stream: str) -> Iterator[Any]:
+        """
+        The stream's engine, created or restored if needed; it is not
+        evicted while the block runs.
+        """
+        validate_stream_id(stream)
+        with self._lock:
+            entry = self._entries.get(stream)
+            if entry is None:
+                entry = self._entries[stream] = _Entry(time.monotonic())
+            entry.users += 1
+        try:
+            # Waits out an eviction of this stream in progress
+            with entry.lock:
+                loaded = entry.engine is None
+                if loaded:
+                    entry.engine = self._load(stream)
+            if loaded:
+                self._enforce_limit()
+            yield entry.engine
+        finally:
+            with self._lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+
+    def peek(self, stream: str) -> Optional[Any]:
+        """The stream's engine if loaded, without creating or pinning it."""
+        entry = self._entries.get(stream)
+        return entry.engine if entry is not None else None
+
+    def _load(self, stream: str):
+        engine = self.factory(stream)
+        if self.directory and os.path.exists(self._path(stream)):
+            header, arrays = read_checkpoint(self._path(stream))
+            engine.restore_checkpoint_state(header['meta'], arrays)
+            self.restored += 1
+        else:
+            self.created += 1
+        return engine
+
+    def evict(self, stream: str) -> bool:
+        """
+        Drop a loaded stream that nobody is using, checkpointing it first
+        when the registry has a directory.
+
+        Returns:
+            Whether the stream was evicted
+        """
+        with self._lock:
+            entry = self._entries.get(stream)
+            if entry is None or entry.users or entry.engine is None:
+                return False
+        with entry.lock:
+            with self._lock:
+                if entry.users or entry.engine is None:
+                    return False
+            if self.directory:
+                meta, arrays = entry.engine.checkpoint_state()
+                write_checkpoint(self._path(stream), meta, arrays, fsync=self.fsync)
+            # A use() pinning the stream meanwhile waits on entry.lock, then
+            # reloads from the checkpoint just written
+            entry.engine = None
+        with self._lock:
+            if entry.users == 0 and entry.engine is None and self._entries.get(stream) is entry:
+                del self._entries[stream]
+            self.evicted += 1
+        return True
+
+    def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """
+        Evict every stream unused for idle_timeout seconds.
+
+        Returns:
+            The evicted stream ids
+        """
+        if self.idle_timeout is None:
+            return []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [stream for stream, entry in self._entries.items()
+                    if not entry.users and now - entry.last_used >= self.idle_timeout]
+        return [stream for stream in idle if self.evict(stream)]
+
+    def _enforce_limit(self):
+        if self.max_streams is None:
+            return
+        with self._lock:
+            loaded = [(entry.last_used, stream) for stream, entry in self._entries.items()
+                      if entry.engine is not None and not entry.users]
+            excess = sum(entry.engine is not None for entry in self._entries.values()) - self.max_streams
+        for _, stream in sorted(loaded)[:max(0, excess)]:
+            self.evict(stream)
+
+    def streams(self) -> List[str]:
+        """Ids of the loaded streams."""
+        with self._lock:
+            return [stream for stream, entry in self._entries.items() if entry.engine is not None]
+
+    def __contains__(self, stream: str) -> bool:
+        return self.peek(stream) is not None
+
+    def __len__(self) -> int:
+        return len(self.streams())
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            loaded = {stream: {'idle_seconds': now - entry.last_used, 'in_use': entry.users}
+                      for stream, entry in self._entries.items() if entry.engine is not None}
+        return {
+            'streams': len(loaded),
+            'created': self.created,
+            'restored': self.restored,
+            'evicted': self.evicted,
+            'loaded': loaded,
+        }
+
+    def close(self):
+        """Evict every stream (checkpointing them when there is a directory)."""
+        for stream in self.streams():
+            self.evict(stream)
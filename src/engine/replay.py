@@ -0,0 +1,346 @@
+"""
+Event Replay
+============
+
+Feed recorded traffic through StreamingAttributionEngine faster than real
+time, for backtests and load tests.
+
+Binary event files (see simulator/binary_format.py) are memory-mapped:
+each batch of records is a view of the file, and conversion paths are
+passed to process_conversions_batch as offsets into the mapped path
+sidecar, so nothing is parsed or copied on the way in.
+
+JSONL files (event_generator.py --output) are split into newline-aligned
+chunks and parsed in a process pool. Workers skip lines that cannot be
+conversions before decoding them, decode the rest with orjson when it is
+installed, and return integer-encoded paths; chunks come back in file order
+and go to process_conversions_batch one chunk at a time.
+
+Usage:
+    python src/simulator/event_generator.py --rate 0 --duration 60 --format binary --output events.bin
+    python src/engine/replay.py events.bin --model markov
+    python src/engine/replay.py events.jsonl --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+import multiprocessing as mp
+from datetime import datetime
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.streaming_attribution import StreamingAttributionEngine, ATTRIBUTION_MODELS, TRANSITION_BACKENDS
+from engine.dimensional import UNKNOWN
+from simulator.binary_format import EventRecordReader, MAGIC
+
+DEFAULT_CHANNELS = ["Search", "Social", "Display", "Email"]
+# Present in every conversion line (its event_type), absent from the others
+CONVERSION_MARKER = b'"conversion"'
+
+
+def replay_records(
+    path: str,
+    engine: StreamingAttributionEngine,
+    batch_size: int = 1000000,
+    speed: Optional[float] = None,
+    on_batch: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    """
+    Replay a binary event file into an engine.
+
+    Args:
+        path: Event file written by EventRecordWriter
+        engine: Target engine; its channels may be ordered differently from
+            the file's (indices are remapped)
+        batch_size: Events per mapped batch
+        speed: Replay at this multiple of recorded time (None: as fast as
+            possible)
+        on_batch: Called with the running stats after each batch
+
+    Returns:
+        Dict with events, conversions, elapsed_seconds, recorded_seconds,
+        events_per_second and speedup (recorded time / wall time)
+    """
+    reader = EventRecordReader(path)
+    remap = None
+    if reader.channels != list(engine.channels):
+        missing = set(reader.channels) - set(engine.channel_to_idx)
+        if missing:
+            raise ValueError(f"Engine lacks recorded channels: {sorted(missing)}")
+        remap = np.array([engine.channel_to_idx[c] for c in reader.channels], dtype=np.int64)
+
+    # Dimension labels by code; code -1 (not recorded) indexes the trailing 'unknown'
+    label_names = {}
+    if engine.cube is not None:
+        recorded = {'campaign': reader.campaigns, 'device': reader.devices}
+        label_names = {dim: np.array(list(recorded[dim]) + [UNKNOWN], dtype=object)
+                       for dim in engine.cube.dimensions if dim in recorded}
+
+    stats = {'events': 0, 'conversions': 0}
+    first_ts = float(reader.events['timestamp'][0]) if len(reader) else 0.0
+    start = time.perf_counter()
+
+    for records in reader.iter_batches(batch_size):
+        paths = reader.conversion_paths(records)
+        n_paths = len(paths['values'])
+        if n_paths:
+            channel_idx, offsets = paths['channel_idx'], paths['offsets']
+            if remap is not None:
+                channel_idx = remap[channel_idx[offsets[0]:offsets[-1]]]
+                offsets = offsets - offsets[0]
+            labels = {dim: names[paths[dim + 's']] for dim, names in label_names.items()}
+            engine.process_conversions_batch(channel_idx, offsets, paths['values'], paths['timestamps'],
+                                             labels=labels or None)
+
+        stats['events'] += len(records)
+        stats['conversions'] += n_paths
+        if speed:
+            # Hold back until wall time catches up with scaled recorded time
+            ahead = (float(records['timestamp'][-1]) - first_ts) / speed - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+        if on_batch is not None:
+            on_batch(stats)
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['recorded_seconds'] = reader.time_span
+    stats['events_per_second'] = stats['events'] / elapsed if elapsed > 0 else 0.0
+    stats['speedup'] = reader.time_span / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def read_chunks(path: str, chunk_bytes: int) -> Iterator[bytes]:
+    """Newline-aligned chunks of about chunk_bytes bytes."""
+    with open(path, 'rb') as f:
+        tail = b''
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = tail + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                tail = block
+                continue
+            tail = block[cut:]
+            yield block[:cut]
+        if tail:
+            yield tail
+
+
+def parse_jsonl_chunk(chunk: bytes, channel_to_idx: Dict[str, int]) -> Dict:
+    """
+    Decode the conversions of one JSONL chunk into engine batch arguments.
+
+    Returns:
+        Dict with channel_idx, offsets, values, timestamps, labels (last
+        touch campaign/device), and the chunk's lines, bytes and skipped
+        (paths with unknown channels) counts
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    channel_idx: List[int] = []
+    offsets = [0]
+    values: List[float] = []
+    timestamps: List[float] = []
+    campaigns: List[Optional[str]] = []
+    devices: List[Optional[str]] = []
+    skipped = 0
+
+    for line in chunk.split(b'\n'):
+        if CONVERSION_MARKER not in line:
+            continue
+        event = loads(line)
+        if event.get('event_type') != 'conversion':
+            continue
+        try:
+            path = [channel_to_idx[tp['channel']] for tp in event['attribution_touchpoints']]
+        except KeyError:
+            skipped += 1
+            continue
+        if not path:
+            continue
+        channel_idx.extend(path)
+        offsets.append(len(channel_idx))
+        values.append(event['conversion_value'])
+        timestamps.append(datetime.fromisoformat(event['timestamp']).timestamp())
+        campaigns.append(event.get('campaign_id', UNKNOWN))
+        devices.append(event.get('device_type', UNKNOWN))
+
+    return {
+        'channel_idx': np.array(channel_idx, dtype=np.int16),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'values': np.array(values),
+        'timestamps': np.array(timestamps),
+        'labels': {'campaign': np.array(campaigns, dtype=object), 'device': np.array(devices, dtype=object)},
+        'lines': chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1),
+        'bytes': len(chunk),
+        'skipped': skipped,
+    }
+
+
+_worker_channels: Dict[str, int] = {}
+
+
+def _init_worker(channel_to_idx: Dict[str, int]):
+    global _worker_channels
+    _worker_channels = channel_to_idx
+
+
+def _parse_in_worker(chunk: bytes) -> Dict:
+    return parse_jsonl_chunk(chunk, _worker_channels)
+
+
+def _ordered_results(pool, chunks: Iterator[bytes], max_in_flight: int) -> Iterator[Dict]:
+    """Parse chunks in the pool, yielding results in file order.
+
+    Unlike Pool.imap, at most max_in_flight chunks are read ahead, so memory
+    stays bounded however large the file is.
+    """
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_parse_in_worker, (chunk,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def replay_jsonl(
+    path: str,
+    engine: StreamingAttributionEngine,
+    workers: Optional[int] = None,
+    chunk_bytes: int = 4 << 20,
+    on_chunk: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    """
+    Replay a JSONL event file into an engine, parsing in a process pool.
+
+    Args:
+        path: JSONL file written by event_generator.py --output
+        engine: Target engine; touchpoint channels map through its names
+        workers: Parser processes (default: CPU count; 1 parses inline)
+        chunk_bytes: Approximate bytes per parse task
+        on_chunk: Called with the running stats after each chunk
+
+    Returns:
+        Dict with lines, bytes, conversions, skipped, elapsed_seconds,
+        lines_per_second and mb_per_second
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = {'lines': 0, 'bytes': 0, 'conversions': 0, 'skipped': 0}
+    start = time.perf_counter()
+
+    pool = None
+    if workers > 1:
+        pool = mp.get_context('spawn').Pool(
+            workers, initializer=_init_worker, initargs=(engine.channel_to_idx,)
+        )
+        parsed = _ordered_results(pool, read_chunks(path, chunk_bytes), 2 * workers)
+    else:
+        parsed = (parse_jsonl_chunk(chunk, engine.channel_to_idx) for chunk in read_chunks(path, chunk_bytes))
+
+    try:
+        for result in parsed:
+            if len(result['values']):
+                engine.process_conversions_batch(
+                    result['channel_idx'], result['offsets'], result['values'], result['timestamps'],
+                    labels=result['labels'] if engine.cube is not None else None
+                )
+            for key in ('lines', 'bytes', 'skipped'):
+                stats[key] += result[key]
+            stats['conversions'] += len(result['values'])
+            if on_chunk is not None:
+                elapsed = time.perf_counter() - start
+                on_chunk(dict(stats, elapsed_seconds=elapsed))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['lines_per_second'] = stats['lines'] / elapsed if elapsed > 0 else 0.0
+    stats['mb_per_second'] = stats['bytes'] / 1e6 / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def is_binary_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay recorded events into the attribution engine')
+    parser.add_argument('path', help='Binary (--format binary) or JSONL event file')
+    parser.add_argument('--model', choices=ATTRIBUTION_MODELS, default='markov',
+                        help='Attribution model (default: markov)')
+    parser.add_argument('--batch-size', type=int, default=1000000,
+                        help='Events per mapped batch (default: 1000000)')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='Replay at this multiple of real time (default: unthrottled)')
+    parser.add_argument('--half-life', type=float, default=None,
+                        help='Optional decay half-life in event-time seconds')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='JSONL parser processes (default: CPU count)')
+    parser.add_argument('--chunk-mb', type=float, default=4.0,
+                        help='JSONL chunk size per parse task in MB (default: 4)')
+    parser.add_argument('--channels', type=str, default=','.join(DEFAULT_CHANNELS),
+                        help='Comma-separated channels for JSONL input')
+    parser.add_argument('--dimensions', type=str, default=None,
+                        help='Also attribute per slice, e.g. campaign,device')
+    parser.add_argument('--transitions', choices=TRANSITION_BACKENDS, default='dense',
+                        help='Transition count storage (default: dense)')
+    parser.add_argument('--order', type=int, default=1,
+                        help='Markov chain order, channels of history per state (default: 1)')
+
+    args = parser.parse_args()
+    binary = is_binary_file(args.path)
+    channels = EventRecordReader(args.path).channels if binary else args.channels.split(',')
+    engine = StreamingAttributionEngine(
+        channels, attribution_model=args.model,
+        decay_half_life=args.half_life, use_event_time=True,
+        dimensions=args.dimensions.split(',') if args.dimensions else None,
+        transitions_backend=args.transitions, markov_order=args.order
+    )
+
+    if binary:
+        stats = replay_records(args.path, engine, batch_size=args.batch_size, speed=args.speed)
+        print(f"Replayed {stats['events']:,} events ({stats['conversions']:,} conversions) "
+              f"in {stats['elapsed_seconds']:.2f}s")
+        print(f"  Rate: {stats['events_per_second']:,.0f} events/sec | "
+              f"{stats['speedup']:,.1f}x real time ({stats['recorded_seconds']:.0f}s recorded)")
+    else:
+        next_report = [1.0]
+
+        def report(progress: Dict):
+            if progress['elapsed_seconds'] >= next_report[0]:
+                elapsed = progress['elapsed_seconds']
+                print(f"[{elapsed:.0f}s] {progress['lines']:,} lines | "
+                      f"{progress['lines'] / elapsed:,.0f} lines/sec | "
+                      f"{progress['bytes'] / 1e6 / elapsed:.1f} MB/sec")
+                next_report[0] += 1.0
+
+        stats = replay_jsonl(args.path, engine, workers=args.workers,
+                             chunk_bytes=int(args.chunk_mb * (1 << 20)), on_chunk=report)
+        print(f"Replayed {stats['lines']:,} lines ({stats['conversions']:,} conversions, "
+              f"{stats['skipped']:,} skipped) in {stats['elapsed_seconds']:.2f}s")
+        print(f"  Rate: {stats['lines_per_second']:,.0f} lines/sec | {stats['mb_per_second']:.1f} MB/sec"
+              f" | parser: {'orjson' if orjson is not None else 'json'}")
+    print(f"  Shares: {engine.get_current_scores()['shares']}")
+    if engine.cube is not None:
+        for dim in engine.cube.dimensions:
+            rollup = engine.get_dimensional_scores(by=dim)
+            print(f"  By {dim}: {len(rollup)} slices, "
+                  f"top by value: {max(rollup, key=lambda k: rollup[k]['total_value'])}")
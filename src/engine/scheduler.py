@@ -0,0 +1,110 @@
+"""
+Publish Scheduler
+=================
+
+Decides when to recompute attribution scores and when a result is worth
+broadcasting, instead of doing both on a fixed tick:
+
+- scores are recomputed once min_conversions new conversions have been
+  attributed, at most every min_interval seconds, so bursts are published
+  within min_interval
+- a recomputed result is broadcast only if some channel share moved more
+  than epsilon since the last broadcast
+- every max_interval seconds the scores are recomputed and broadcast
+  regardless (heartbeat), which also picks up trickles below
+  min_conversions
+
+With max_interval equal to min_interval every check publishes, i.e. a
+fixed cadence.
+"""
+
+import time
+from typing import Dict, Optional
+
+
+def share_distance(shares: Dict[str, float], previous: Dict[str, float]) -> float:
+    """Largest absolute share change over the channels in either dict."""
+    return max((abs(shares.get(c, 0.0) - previous.get(c, 0.0)) for c in shares.keys() | previous.keys()),
+               default=0.0)
+
+
+class PublishScheduler:
+    """
+    Conversion-count and share-change gates between scoring and publishing.
+
+    Not thread-safe: call observe/should_score/should_publish from one
+    thread at a time.
+    """
+
+    def __init__(self, min_interval: float = 0.1, max_interval: float = 5.0,
+                 min_conversions: int = 100, epsilon: float = 0.002):
+        """
+        Args:
+            min_interval: Minimum seconds between score recomputations
+            max_interval: Heartbeat: maximum seconds between broadcasts
+            min_conversions: New conversions that make a recomputation due
+            epsilon: Share change (absolute, any channel) that makes a
+                recomputed result worth broadcasting
+        """
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Expected 0 < min_interval <= max_interval")
+        if min_conversions < 1:
+            raise ValueError("min_conversions must be at least 1")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_conversions = min_conversions
+        self.epsilon = epsilon
+        self.pending = 0
+        self.last_score = float('-inf')
+        self.last_publish = float('-inf')
+        self.published_shares: Optional[Dict[str, float]] = None
+        self.scored = 0
+        self.published = 0
+        self.skipped = 0
+
+    def observe(self, conversions: int):
+        """Count newly attributed conversions."""
+        self.pending += conversions
+
+    def heartbeat_due(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return now - self.last_publish >= self.max_interval
+
+    def should_score(self, now: Optional[float] = None) -> bool:
+        """Whether scores should be recomputed now."""
+        now = time.monotonic() if now is None else now
+        if now - self.last_score < self.min_interval:
+            return False
+        return self.pending >= self.min_conversions or self.heartbeat_due(now)
+
+    def should_publish(self, shares: Dict[str, float], now: Optional[float] = None) -> bool:
+        """
+        Record a recomputation and decide whether to broadcast it.
+
+        Args:
+            shares: The recomputed channel shares
+
+        Returns:
+            True (and the shares become the new reference) if they moved
+            past epsilon, nothing was published yet, or a heartbeat is due
+        """
+        now = time.monotonic() if now is None else now
+        self.scored += 1
+        self.pending = 0
+        self.last_score = now
+        if (self.published_shares is None or self.heartbeat_due(now)
+                or share_distance(shares, self.published_shares) > self.epsilon):
+            self.published_shares = dict(shares)
+            self.last_publish = now
+            self.published += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            'scored': self.scored,
+            'published': self.published,
+            'skipped': self.skipped,
+            'pending_conversions': self.pending,
+        }
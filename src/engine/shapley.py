@@ -0,0 +1,246 @@
+"""
+Streaming Shapley Attribution
+=============================
+
+Coalition-level conversion value keyed by channel-set bitmasks, with
+Shapley values computed from the accumulated counts.
+
+The characteristic function is the usual one for path data: v(S) is the
+conversion value of all paths whose channel set is a subset of S. Exact
+values enumerate all 2^n coalitions and are used for small channel sets;
+larger sets fall back to permutation sampling with a 95% error bound.
+"""
+
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+class CoalitionShapley:
+    """
+    Incremental coalition counts with memoized Shapley values.
+    """
+
+    def __init__(
+        self,
+        n_channels: int,
+        exact_max_channels: int = 12,
+        n_permutations: int = 256,
+        seed: int = 0
+    ):
+        """
+        Initialize coalition state.
+
+        Args:
+            n_channels: Number of channels (bit i of a mask is channel i)
+            exact_max_channels: Largest channel count solved exactly
+            n_permutations: Permutations drawn per estimate in sampled mode
+            seed: Seed for permutation sampling
+        """
+        self.n_channels = n_channels
+        self.exact = n_channels <= exact_max_channels
+        self.n_permutations = n_permutations
+        self._rng = np.random.default_rng(seed)
+
+        # Coalition storage: mask -> row, with members kept as a ragged array
+        self.coalition_index: Dict[int, int] = {}
+        self._values = np.zeros(64)
+        self._members: List[np.ndarray] = []
+        self._member_flat = np.zeros(0, dtype=np.int64)
+        self._member_starts = np.zeros(0, dtype=np.int64)
+        self._members_synced = 0
+
+        # Exact mode: memoized v(S) for every S, patched per changed coalition
+        self._pending: Dict[int, float] = {}
+        if self.exact:
+            size = 1 << n_channels
+            self._coalition_values = np.zeros(size)
+            masks = np.arange(size)
+            self._popcount = np.zeros(size, dtype=np.int64)
+            for bit in range(n_channels):
+                self._popcount += (masks >> bit) & 1
+            n = n_channels
+            self._perm_weight = np.array([
+                math.factorial(k) * math.factorial(n - k - 1) / math.factorial(n) if k < n else 0.0
+                for k in range(n + 1)
+            ])
+
+        self._version = 0
+        self._cached: Optional[Dict] = None
+
+    @property
+    def n_coalitions(self) -> int:
+        return len(self.coalition_index)
+
+    def add(self, mask: int, value: float):
+        """Add one conversion for the coalition with the given channel bitmask."""
+        row = self.coalition_index.get(mask)
+        if row is None:
+            row = self._new_coalition(mask)
+        self._values[row] += value
+        if self.exact:
+            self._pending[mask] = self._pending.get(mask, 0.0) + value
+        self._version += 1
+        self._cached = None
+
+    def scale(self, factor: float):
+        """Multiply all coalition values by factor (decay rebase)."""
+        self._values *= factor
+        if self.exact:
+            self._coalition_values *= factor
+            self._pending = {mask: value * factor for mask, value in self._pending.items()}
+        self._version += 1
+        self._cached = None
+
+    def _new_coalition(self, mask: int) -> int:
+        row = len(self.coalition_index)
+        self.coalition_index[mask] = row
+        if row >= len(self._values):
+            self._values = np.concatenate((self._values, np.zeros(len(self._values))))
+        self._members.append(np.array(
+            [i for i in range(mask.bit_length()) if (mask >> i) & 1], dtype=np.int64
+        ))
+        return row
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Copy of the coalition values as (meta, arrays) for a checkpoint."""
+        arrays = {'coalition_values': self._values[:self.n_coalitions].copy()}
+        meta = {'coalition_masks': encode_masks(list(self.coalition_index), arrays)}
+        return meta, arrays
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        """Add a checkpoint() result to empty coalition state."""
+        if self.coalition_index:
+            raise ValueError("restore needs empty coalition state")
+        masks = decode_masks(meta['coalition_masks'], arrays)
+        for mask, value in zip(masks, arrays['coalition_values'].tolist()):
+            self.add(mask, value)
+
+    def snapshot(self) -> Dict:
+        """
+        Capture the state compute() needs. Cheap enough to call under the
+        engine lock: exact values are brought up to date here, sampled mode
+        only copies the coalition values.
+        """
+        if self._cached is None and self.exact:
+            self._cached = self._compute_exact()
+        if self._cached is not None:
+            return {'version': self._version, 'result': self._cached}
+        self._sync_members()
+        return {
+            'version': self._version,
+            'values': self._values[:self.n_coalitions].copy(),
+            'member_flat': self._member_flat,
+            'member_starts': self._member_starts,
+        }
+
+    def compute(self, snapshot: Optional[Dict] = None) -> Dict:
+        """
+        Return Shapley values, recomputing only if coalition counts changed.
+
+        Args:
+            snapshot: Result of snapshot(); taken now if omitted
+
+        Returns:
+            Dict with 'values' (array, sums to total value), 'ci95' (array of
+            95% half-widths, zero when exact) and 'method'
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        if 'result' in snapshot:
+            return snapshot['result']
+        return self._compute_sampled(
+            snapshot['values'], snapshot['member_flat'], snapshot['member_starts']
+        )
+
+    def remember(self, snapshot: Dict, result: Dict):
+        """Memoize a computed result if no counts changed since the snapshot."""
+        if snapshot['version'] == self._version:
+            self._cached = result
+
+    def _compute_exact(self) -> Dict:
+        v = self._coalition_values
+        masks = np.arange(len(v))
+        if len(self._pending) > self.n_channels:
+            # Cheaper to rebuild: zeta transform (sum over subsets) of the counts
+            v[:] = 0.0
+            rows = np.fromiter(self.coalition_index.values(), dtype=np.int64)
+            v[np.fromiter(self.coalition_index.keys(), dtype=np.int64)] = self._values[rows]
+            for bit in range(self.n_channels):
+                pairs = v.reshape(-1, 2, 1 << bit)
+                pairs[:, 1, :] += pairs[:, 0, :]
+        else:
+            for coalition, delta in self._pending.items():
+                # Every superset of the coalition gains its value
+                v[(masks & coalition) == coalition] += delta
+        self._pending = {}
+
+        phi = np.zeros(self.n_channels)
+        for i in range(self.n_channels):
+            bit = 1 << i
+            without = masks[(masks & bit) == 0]
+            marginal = v[without | bit] - v[without]
+            phi[i] = np.dot(self._perm_weight[self._popcount[without]], marginal)
+
+        return {'values': phi, 'ci95': np.zeros(self.n_channels), 'method': 'exact'}
+
+    def _sync_members(self):
+        if self._members_synced == len(self._members):
+            return
+        new = self._members[self._members_synced:]
+        lengths = np.array([len(m) for m in new], dtype=np.int64)
+        base = len(self._member_flat)
+        starts = base + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self._member_flat = np.concatenate([self._member_flat] + new)
+        self._member_starts = np.concatenate((self._member_starts, starts))
+        self._members_synced = len(self._members)
+
+    def _compute_sampled(self, values: np.ndarray, member_flat: np.ndarray,
+                         member_starts: np.ndarray) -> Dict:
+        if len(values) == 0:
+            zeros = np.zeros(self.n_channels)
+            return {'values': zeros, 'ci95': zeros, 'method': 'sampled'}
+
+        # In a permutation, a coalition's value is credited to whichever of
+        # its members comes last, so each sample is one reduceat + bincount.
+        samples = np.empty((self.n_permutations, self.n_channels))
+        for p in range(self.n_permutations):
+            order = self._rng.permutation(self.n_channels)
+            position = np.empty_like(order)
+            position[order] = np.arange(self.n_channels)
+            last = np.maximum.reduceat(position[member_flat], member_starts)
+            samples[p] = np.bincount(order[last], weights=values, minlength=self.n_channels)
+
+        phi = samples.mean(axis=0)
+        stderr = samples.std(axis=0, ddof=1) / np.sqrt(self.n_permutations)
+        return {'values': phi, 'ci95': 1.96 * stderr, 'method': 'sampled'}
+
+
+def path_masks(channel_idx: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Channel-set bitmask of each path in a ragged batch.
+
+    Args:
+        channel_idx: Flat channel indices (all < 63)
+        starts: Start offset of each path; paths must be non-empty
+    """
+    bits = np.left_shift(np.int64(1), channel_idx.astype(np.int64))
+    return np.bitwise_or.reduceat(bits, starts)
+
+
+def encode_masks(masks: List[int], arrays: Dict[str, np.ndarray]):
+    """
+    Store coalition bitmasks for a checkpoint: as an int64 array under
+    arrays['coalition_masks'] when they fit (returns None), else as hex
+    strings returned for the JSON meta.
+    """
+    if all(mask < 1 << 63 for mask in masks):
+        arrays['coalition_masks'] = np.array(masks, dtype=np.int64)
+        return None
+    return [format(mask, 'x') for mask in masks]
+
+
+def decode_masks(encoded: Optional[List[str]], arrays: Dict[str, np.ndarray]) -> List[int]:
+    if encoded is None:
+        return arrays['coalition_masks'].tolist()
+    return [int(mask, 16) for mask in encoded]
@@ -0,0 +1,339 @@
+"""
+Sharded Attribution Engine
+==========================
+
+Multi-core ingestion for StreamingAttributionEngine.
+
+Conversions are hash-partitioned by user id across N worker processes.
+Each worker owns a private engine (its own transition matrix and value
+counters, no shared lock) and periodically publishes its state into a
+multiprocessing.shared_memory block. Global scores are produced on demand
+by summing the shard blocks into a merge engine and running the usual
+Markov solver on the result.
+
+Each block is single-writer; readers use a sequence counter (odd while a
+write is in progress) to get a consistent copy without locking the shard.
+"""
+
+import os
+import sys
+import time
+import zlib
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.streaming_attribution import StreamingAttributionEngine, select_paths
+
+# Header: [sequence, flush acknowledgement, batches processed]
+HEADER_FIELDS = 3
+
+
+def shard_of(user_ids, n_shards: int) -> np.ndarray:
+    """
+    Shard index for each user id.
+
+    Integer ids are mixed with a multiplicative hash; other ids (e.g. the
+    simulator's "user_1234567" strings) use CRC32 of their text.
+    """
+    ids = np.asarray(user_ids)
+    if ids.dtype.kind in 'iu':
+        mixed = ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        return ((mixed >> np.uint64(32)) % np.uint64(n_shards)).astype(np.int64)
+    return np.fromiter(
+        (zlib.crc32(str(u).encode()) % n_shards for u in ids.tolist()),
+        dtype=np.int64, count=len(ids)
+    )
+
+
+class _ShardBlock:
+    """
+    Shared-memory layout of one shard's published state.
+    """
+
+    def __init__(self, n_states: int, n_channels: int, name: Optional[str] = None):
+        self.n_states = n_states
+        self.n_channels = n_channels
+        size = 8 * (HEADER_FIELDS + n_states * n_states + 2 * n_channels + 2)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        buf = self.shm.buf
+
+        offset = 0
+
+        def view(dtype, count):
+            nonlocal offset
+            arr = np.ndarray((count,), dtype=dtype, buffer=buf, offset=offset)
+            offset += 8 * count
+            return arr
+
+        self.header = view(np.int64, HEADER_FIELDS)
+        self.transitions = view(np.float64, n_states * n_states).reshape(n_states, n_states)
+        self.channel_values = view(np.float64, n_channels)
+        self.channel_conversions = view(np.float64, n_channels)
+        self.totals = view(np.float64, 2)
+        if name is None:
+            self.header[:] = 0
+
+    def publish(self, state: Dict):
+        self.header[0] += 1  # odd: write in progress
+        self.transitions[:] = state['transitions']
+        self.channel_values[:] = state['channel_values']
+        self.channel_conversions[:] = state['channel_conversions']
+        self.totals[0] = state['total_conversions']
+        self.totals[1] = state['total_value']
+        self.header[0] += 1
+
+    def read_into(self, out: Dict, spin: float = 1e-4):
+        """Add a consistent copy of this shard's state to the out sums."""
+        while True:
+            seq = int(self.header[0])
+            if seq % 2:
+                time.sleep(spin)
+                continue
+            transitions = self.transitions.copy()
+            channel_values = self.channel_values.copy()
+            channel_conversions = self.channel_conversions.copy()
+            totals = self.totals.copy()
+            if int(self.header[0]) == seq:
+                break
+        out['transitions'] += transitions
+        out['channel_values'] += channel_values
+        out['channel_conversions'] += channel_conversions
+        out['total_conversions'] += totals[0]
+        out['total_value'] += totals[1]
+
+    def close(self):
+        # Drop numpy views before closing the mapping
+        self.header = self.transitions = None
+        self.channel_values = self.channel_conversions = self.totals = None
+        self.shm.close()
+
+
+def _shard_worker(channels: List[str], engine_kwargs: Dict, shm_name: str,
+                  inbox, publish_interval: float):
+    """Worker process: apply batches to a private engine, publish periodically."""
+    # Workers only count; the Markov solve happens once on the merged state
+    engine = StreamingAttributionEngine(channels, attribution_model='last_touch', **engine_kwargs)
+    block = _ShardBlock(engine.n_states, engine.n_channels, name=shm_name)
+    last_publish = 0.0
+    dirty = False
+    try:
+        while True:
+            try:
+                item = inbox.get(timeout=publish_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item and isinstance(item[0], str):
+                block.publish(engine.export_state())
+                block.header[1] = item[1]
+                dirty = False
+                continue
+            if item:
+                engine.process_conversions_batch(*item)
+                block.header[2] += 1
+                dirty = True
+            now = time.monotonic()
+            if dirty and now - last_publish >= publish_interval:
+                block.publish(engine.export_state())
+                last_publish = now
+                dirty = False
+        block.publish(engine.export_state())
+    finally:
+        block.close()
+
+
+class ShardedAttributionEngine:
+    """
+    Hash-partitioned, multi-process front end for StreamingAttributionEngine.
+
+    Usage:
+        with ShardedAttributionEngine(channels, n_shards=4) as engine:
+            engine.process_conversions_batch(user_ids, idx, offsets, values)
+            scores = engine.get_current_scores()
+    """
+
+    def __init__(
+        self,
+        channels: List[str],
+        n_shards: Optional[int] = None,
+        attribution_model: str = 'markov',
+        publish_interval: float = 0.05,
+        buffer_size: int = 4096,
+        start_method: str = 'spawn',
+        **engine_kwargs
+    ):
+        """
+        Initialize sharded engine (workers start on start() or __enter__).
+
+        Args:
+            channels: Channel names, in index order
+            n_shards: Worker processes (default: CPU count)
+            attribution_model: 'markov' or 'last_touch' for merged scores
+            publish_interval: Seconds between shard state publications
+            buffer_size: Per-shard path buffer for process_conversion
+            start_method: multiprocessing start method
+            **engine_kwargs: Passed to each shard's engine (decay/window options)
+        """
+        if attribution_model == 'shapley' or engine_kwargs.get('track_shapley'):
+            raise ValueError("Shapley coalitions are not merged across shards")
+        if engine_kwargs.get('grow_channels'):
+            raise ValueError("Shards need a fixed channel list")
+        if engine_kwargs.get('markov_order', 1) > 1:
+            raise ValueError("Higher-order chains are not merged across shards")
+        if engine_kwargs.get('bootstrap_replicates'):
+            raise ValueError("Bootstrap replicates are not merged across shards")
+        self.channels = channels
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.publish_interval = publish_interval
+        self.buffer_size = buffer_size
+        self.engine_kwargs = engine_kwargs
+
+        # Merged view: plain engine, state is loaded from the shard sums
+        self._merged = StreamingAttributionEngine(channels, attribution_model=attribution_model)
+        self.channel_to_idx = self._merged.channel_to_idx
+
+        self._ctx = mp.get_context(start_method)
+        self._blocks: List[_ShardBlock] = []
+        self._inboxes = []
+        self._workers = []
+        self._buffers: List[List[Tuple[List[str], float, float]]] = [[] for _ in range(self.n_shards)]
+        self._flush_token = 0
+
+    def start(self):
+        for _ in range(self.n_shards):
+            block = _ShardBlock(self._merged.n_states, self._merged.n_channels)
+            inbox = self._ctx.Queue()
+            worker = self._ctx.Process(
+                target=_shard_worker,
+                args=(self.channels, self.engine_kwargs, block.shm.name, inbox, self.publish_interval),
+                daemon=True
+            )
+            worker.start()
+            self._blocks.append(block)
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        # Wait until every worker is up before accepting work
+        self.flush()
+        return self
+
+    def stop(self):
+        self._flush_buffers()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        for block in self._blocks:
+            block.close()
+            block.shm.unlink()
+        self._blocks, self._inboxes, self._workers = [], [], []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def process_conversion(self, user_id, touchpoints: List[str], value: float,
+                           timestamp: Optional[float] = None):
+        """Buffer one conversion for its user's shard; sent as a batch when full."""
+        if not touchpoints:
+            return
+        shard = int(shard_of([user_id], self.n_shards)[0])
+        buffer = self._buffers[shard]
+        buffer.append((touchpoints, value, time.time() if timestamp is None else timestamp))
+        if len(buffer) >= self.buffer_size:
+            self._send_buffer(shard)
+
+    def _send_buffer(self, shard: int):
+        buffer = self._buffers[shard]
+        if not buffer:
+            return
+        idx, offsets = self._merged.encode_paths([b[0] for b in buffer])
+        values = np.array([b[1] for b in buffer])
+        timestamps = np.array([b[2] for b in buffer])
+        self._inboxes[shard].put((idx, offsets, values, timestamps))
+        self._buffers[shard] = []
+
+    def _flush_buffers(self):
+        for shard in range(self.n_shards):
+            self._send_buffer(shard)
+
+    def process_conversions_batch(self, user_ids: Sequence, channel_idx: np.ndarray,
+                                  offsets: np.ndarray, values: np.ndarray,
+                                  timestamps: Optional[np.ndarray] = None):
+        """
+        Partition a ragged path batch by user id and hand each shard its part.
+
+        Args:
+            user_ids: Owner of each path, length n_paths
+            channel_idx, offsets, values, timestamps: As for
+                StreamingAttributionEngine.process_conversions_batch
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        channel_idx = np.asarray(channel_idx)[offsets[0]:offsets[-1]]
+        offsets = offsets - offsets[0]
+        values = np.asarray(values, dtype=np.float64)
+        if timestamps is None:
+            timestamps = np.full(len(values), time.time())
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+
+        shards = shard_of(user_ids, self.n_shards)
+        for shard in range(self.n_shards):
+            selected = shards == shard
+            if not selected.any():
+                continue
+            sub_idx, sub_offsets = select_paths(channel_idx, offsets, selected)
+            self._inboxes[shard].put((sub_idx, sub_offsets, values[selected], timestamps[selected]))
+
+    def flush(self, timeout: float = 30.0):
+        """Block until every shard has applied and published all queued work."""
+        self._flush_buffers()
+        self._flush_token += 1
+        for inbox in self._inboxes:
+            inbox.put(('flush', self._flush_token))
+        deadline = time.monotonic() + timeout
+        for block in self._blocks:
+            while int(block.header[1]) < self._flush_token:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Shards did not acknowledge flush")
+                time.sleep(1e-3)
+
+    def merged_state(self) -> Dict:
+        """Sum of the latest published state of every shard."""
+        n_states, n_channels = self._merged.n_states, self._merged.n_channels
+        state = {
+            'transitions': np.zeros((n_states, n_states)),
+            'channel_values': np.zeros(n_channels),
+            'channel_conversions': np.zeros(n_channels),
+            'total_conversions': 0.0,
+            'total_value': 0.0,
+        }
+        for block in self._blocks:
+            block.read_into(state)
+        return state
+
+    def get_current_scores(self) -> Dict:
+        """Merge shard state and compute global attribution scores."""
+        self._merged.load_state(self.merged_state())
+        scores = self._merged.get_current_scores()
+        scores['shards'] = self.n_shards
+        return scores
+
+
+if __name__ == "__main__":
+    channels = ["Search", "Social", "Display", "Email"]
+    with ShardedAttributionEngine(channels, n_shards=2) as engine:
+        engine.process_conversion("user_1", ["Search", "Display"], 100.0)
+        engine.process_conversion("user_2", ["Social", "Search", "Display"], 150.0)
+        engine.flush()
+        print(engine.get_current_scores())
@@ -0,0 +1,409 @@
+"""
+Event Sources
+=============
+
+Partitioned, replayable event sources in front of the engine, Kafka style:
+a topic of JSON event messages (the event_generator.py JSONL format, one
+event per message, keyed by user so a user's events stay in one partition)
+consumed in batches, with each partition's position committed only after
+the engine has applied everything before it.
+
+- FileSource: local stand-in for a broker. A topic is a directory with one
+  append-only log per partition (partition-0000.jsonl, ...) and a file of
+  committed positions per consumer group; produce() appends keyed
+  messages. Needs no cluster, so the consumer path runs anywhere.
+- KafkaSource: the same over a Kafka topic (confluent-kafka), with
+  partitions assigned to workers manually and offsets committed for the
+  consumer group.
+
+Sources are configuration only and picklable: open() builds a
+PartitionReader inside a consumer worker process, while committed() and
+commit() run in the main process. The pipeline's ConsumerStage and
+CommitStage (engine/pipeline.py) do the consuming.
+
+Usage:
+    python src/engine/sources.py produce topic/ --partitions 8 --events 2000000
+    python src/engine/sources.py consume topic/ --workers 4
+    python src/engine/orchestrator.py --source file --topic topic/ --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import asyncio
+import argparse
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from confluent_kafka import Consumer, Producer, TopicPartition, KafkaError, KafkaException, OFFSET_STORED
+except ImportError:
+    Consumer = None
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from simulator.event_generator import EventStreamSimulator
+
+SOURCES = ('simulator', 'file', 'kafka')
+
+# Messages of one partition in log order, and the position after the last
+Polled = Tuple[List[bytes], Any]
+
+
+class PartitionReader:
+    """
+    Consumes a fixed set of partitions, each from a starting position.
+    """
+
+    def poll(self, max_records: int, timeout: float) -> Dict[int, Polled]:
+        """
+        Next messages of each partition.
+
+        Args:
+            max_records: Messages per partition at most
+            timeout: Seconds to wait when no partition has anything new
+
+        Returns:
+            (messages, position after them) by partition; partitions with
+            nothing new are left out
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Source:
+    """
+    A partitioned topic and one consumer group's positions in it.
+    """
+
+    n_partitions: int
+
+    def open(self, positions: Dict[int, Any]) -> PartitionReader:
+        """Reader for the given partitions, starting at the given positions (None: start of log)."""
+        raise NotImplementedError
+
+    def committed(self) -> Dict[int, Any]:
+        """Committed position by partition (None: nothing committed)."""
+        raise NotImplementedError
+
+    def commit(self, positions: Dict[int, Any]):
+        """Commit positions returned by PartitionReader.poll."""
+        raise NotImplementedError
+
+    def produce(self, messages: Iterable[bytes], keys: Iterable[bytes]):
+        """Append messages, each to the partition its key hashes to."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _FileReader(PartitionReader):
+
+    def __init__(self, source: 'FileSource', positions: Dict[int, Any]):
+        self.files = {p: open(source.log_path(p), 'rb') for p in positions}
+        # Mean message size of the last read, to size reads to max_records
+        self.message_bytes = 512.0
+        # (message offset, byte offset) of the next message
+        self.positions = {p: tuple(pos) if pos else (0, 0) for p, pos in positions.items()}
+
+    def poll(self, max_records: int, timeout: float) -> Dict[int, Polled]:
+        deadline = time.monotonic() + timeout
+        while True:
+            polled = {}
+            for p, f in self.files.items():
+                offset, pos = self.positions[p]
+                messages = self._read(f, pos, max_records)
+                if messages:
+                    pos += sum(map(len, messages)) + len(messages)
+                    self.positions[p] = (offset + len(messages), pos)
+                    polled[p] = (messages, self.positions[p])
+            if polled or time.monotonic() >= deadline:
+                return polled
+            time.sleep(min(0.01, max(0.0, deadline - time.monotonic())))
+
+    def _read(self, f, pos: int, max_records: int) -> List[bytes]:
+        """Up to max_records complete messages from byte pos, read in blocks."""
+        block = min(1 << 20, max(4096, int(max_records * self.message_bytes * 1.25)))
+        while True:
+            f.seek(pos)
+            data = f.read(block)
+            # Anything after the last newline is a message still being appended
+            end = data.rfind(b'\n')
+            if end < 0:
+                if len(data) < block:
+                    return []
+                block *= 2
+                continue
+            messages = data[:end].split(b'\n', max_records)[:max_records]
+            self.message_bytes = (sum(map(len, messages)) + len(messages)) / len(messages)
+            return messages
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class FileSource(Source):
+    """
+    Directory-backed topic: one JSONL log per partition, committed
+    positions in <group>.offsets.json.
+    """
+
+    def __init__(self, directory: str, partitions: Optional[int] = None,
+                 group: str = 'attribution', fsync: bool = False):
+        """
+        Args:
+            directory: Topic directory
+            partitions: Partition count; creates missing logs (default:
+                use the existing ones)
+            group: Consumer group whose positions are committed
+            fsync: fsync commits and produced messages
+        """
+        self.directory = directory
+        self.group = group
+        self.fsync = fsync
+        existing = sorted(f for f in os.listdir(directory) if f.startswith('partition-')) \
+            if os.path.isdir(directory) else []
+        if partitions is None:
+            if not existing:
+                raise ValueError(f"{directory} has no partition logs")
+            partitions = len(existing)
+        elif existing and len(existing) != partitions:
+            raise ValueError(f"{directory} has {len(existing)} partitions, not {partitions}")
+        if partitions < 1:
+            raise ValueError("partitions must be at least 1")
+        self.n_partitions = partitions
+        os.makedirs(directory, exist_ok=True)
+        for p in range(partitions):
+            open(self.log_path(p), 'ab').close()
+
+    def log_path(self, partition: int) -> str:
+        return os.path.join(self.directory, f"partition-{partition:04d}.jsonl")
+
+    @property
+    def offsets_path(self) -> str:
+        return os.path.join(self.directory, f"{self.group}.offsets.json")
+
+    def open(self, positions: Dict[int, Any]) -> PartitionReader:
+        return _FileReader(self, positions)
+
+    def committed(self) -> Dict[int, Any]:
+        committed = {p: None for p in range(self.n_partitions)}
+        if os.path.exists(self.offsets_path):
+            with open(self.offsets_path) as f:
+                committed.update({int(p): tuple(pos) for p, pos in json.load(f).items()})
+        return committed
+
+    def commit(self, positions: Dict[int, Any]):
+        committed = {p: pos for p, pos in self.committed().items() if pos is not None}
+        committed.update(positions)
+        tmp = self.offsets_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({str(p): list(pos) for p, pos in committed.items()}, f)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.offsets_path)
+
+    def produce(self, messages: Iterable[bytes], keys: Iterable[bytes]):
+        by_partition: Dict[int, List[bytes]] = {}
+        for message, key in zip(messages, keys):
+            by_partition.setdefault(zlib.crc32(key) % self.n_partitions, []).append(message)
+        for p, batch in by_partition.items():
+            # One write per partition, so readers never see a torn message
+            # except at the very end of a log
+            with open(self.log_path(p), 'ab') as f:
+                f.write(b'\n'.join(batch) + b'\n')
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+
+class _KafkaReader(PartitionReader):
+
+    def __init__(self, source: 'KafkaSource', positions: Dict[int, Any]):
+        self.consumer = Consumer(source.config)
+        self.consumer.assign([TopicPartition(source.topic, p, OFFSET_STORED if pos is None else pos)
+                              for p, pos in positions.items()])
+        self.n_assigned = len(positions)
+
+    def poll(self, max_records: int, timeout: float) -> Dict[int, Polled]:
+        polled: Dict[int, Polled] = {}
+        for message in self.consumer.consume(max_records * self.n_assigned, timeout):
+            if message.error():
+                if message.error().code() == KafkaError._PARTITION_EOF:
+                    continue
+                raise KafkaException(message.error())
+            messages, _ = polled.get(message.partition(), ([], None))
+            messages.append(message.value())
+            polled[message.partition()] = (messages, message.offset() + 1)
+        return polled
+
+    def close(self):
+        self.consumer.close()
+
+
+class KafkaSource(Source):
+    """
+    Kafka topic consumed with manually assigned partitions; offsets are
+    committed synchronously for the consumer group.
+    """
+
+    def __init__(self, topic: str, brokers: str = 'localhost:9092', group: str = 'attribution',
+                 config: Optional[Dict] = None):
+        """
+        Args:
+            topic: Topic name
+            brokers: bootstrap.servers
+            group: Consumer group whose offsets are committed
+            config: Extra librdkafka settings
+        """
+        if Consumer is None:
+            raise RuntimeError("KafkaSource needs the confluent-kafka package")
+        self.topic = topic
+        self.config = {
+            'bootstrap.servers': brokers,
+            'group.id': group,
+            'enable.auto.commit': False,
+            'auto.offset.reset': 'earliest',
+            **(config or {}),
+        }
+        self._client = None
+        metadata = self.client().list_topics(topic, timeout=10).topics.get(topic)
+        if metadata is None or metadata.error is not None or not metadata.partitions:
+            raise ValueError(f"Unknown Kafka topic: {topic}")
+        self.n_partitions = len(metadata.partitions)
+
+    def __getstate__(self):
+        # Workers build their own consumers
+        state = dict(self.__dict__)
+        state['_client'] = None
+        return state
+
+    def client(self):
+        """Main-process consumer used for metadata and commits (assigned nothing)."""
+        if self._client is None:
+            self._client = Consumer(self.config)
+        return self._client
+
+    def open(self, positions: Dict[int, Any]) -> PartitionReader:
+        return _KafkaReader(self, positions)
+
+    def committed(self) -> Dict[int, Any]:
+        partitions = [TopicPartition(self.topic, p) for p in range(self.n_partitions)]
+        return {tp.partition: tp.offset if tp.offset >= 0 else None
+                for tp in self.client().committed(partitions, timeout=10)}
+
+    def commit(self, positions: Dict[int, Any]):
+        self.client().commit(offsets=[TopicPartition(self.topic, p, offset) for p, offset in positions.items()],
+                             asynchronous=False)
+
+    def produce(self, messages: Iterable[bytes], keys: Iterable[bytes]):
+        producer = Producer({'bootstrap.servers': self.config['bootstrap.servers']})
+        for message, key in zip(messages, keys):
+            while True:
+                try:
+                    producer.produce(self.topic, message, key)
+                    break
+                except BufferError:
+                    producer.poll(0.1)
+            producer.poll(0)
+        producer.flush()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+def make_source(kind: str, topic: str, brokers: str = 'localhost:9092', group: str = 'attribution',
+                partitions: Optional[int] = None) -> Source:
+    """Build a 'file' (topic is a directory) or 'kafka' source."""
+    if kind == 'file':
+        return FileSource(topic, partitions, group=group)
+    if kind == 'kafka':
+        return KafkaSource(topic, brokers, group=group)
+    raise ValueError(f"Unknown source: {kind} (expected one of {SOURCES[1:]})")
+
+
+def produce_simulated(source: Source, n_events: int, batch_size: int = 100000,
+                      events_per_second: int = 0, seed: Optional[int] = None) -> int:
+    """
+    Write simulated events to a source, keyed by user.
+
+    Returns:
+        Events written
+    """
+    simulator = EventStreamSimulator(events_per_second=events_per_second, seed=seed)
+    start = time.time()
+    written = 0
+    while written < n_events:
+        batch = simulator.generate_batch(min(batch_size, n_events - written))
+        events = list(simulator.iter_events(batch))
+        source.produce((json.dumps(e).encode() for e in events), (e['user_id'].encode() for e in events))
+        written += len(events)
+        if events_per_second:
+            ahead = written / events_per_second - (time.time() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+    return written
+
+
+if __name__ == "__main__":
+    from engine.streaming_attribution import StreamingAttributionEngine
+    from engine.pipeline import Pipeline, ConsumerStage, AttributeStage, CommitStage
+    from engine.replay import DEFAULT_CHANNELS
+
+    parser = argparse.ArgumentParser(description='Produce to or consume from a partitioned event source')
+    parser.add_argument('command', choices=['produce', 'consume'])
+    parser.add_argument('topic', help='Topic directory (file) or topic name (kafka)')
+    parser.add_argument('--source', choices=SOURCES[1:], default='file',
+                        help='Source kind (default: file)')
+    parser.add_argument('--brokers', type=str, default='localhost:9092',
+                        help='Kafka bootstrap servers (default: localhost:9092)')
+    parser.add_argument('--group', type=str, default='attribution',
+                        help='Consumer group (default: attribution)')
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='produce: partitions of a new file topic')
+    parser.add_argument('--events', type=int, default=1000000,
+                        help='produce: simulated events to write (default: 1000000)')
+    parser.add_argument('--rate', type=int, default=0,
+                        help='produce: events per second, 0 for unthrottled (default: 0)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='produce: simulator seed')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='consume: consumer worker processes (default: 1)')
+    parser.add_argument('--max-records', type=int, default=10000,
+                        help='consume: messages per partition per poll (default: 10000)')
+    parser.add_argument('--follow', action='store_true',
+                        help='consume: keep waiting for new messages instead of stopping when caught up')
+
+    args = parser.parse_args()
+    source = make_source(args.source, args.topic, args.brokers, args.group, args.partitions)
+    if args.command == 'produce':
+        start = time.perf_counter()
+        written = produce_simulated(source, args.events, events_per_second=args.rate, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        print(f"Produced {written:,} events to {source.n_partitions} partitions in {elapsed:.2f}s")
+    else:
+        engine = StreamingAttributionEngine(DEFAULT_CHANNELS)
+        consumer = ConsumerStage(source, DEFAULT_CHANNELS, workers=args.workers,
+                                 max_records=args.max_records, follow=args.follow)
+        pipeline = Pipeline([consumer, AttributeStage(engine), CommitStage(source)])
+        start = time.perf_counter()
+        try:
+            asyncio.run(pipeline.run())
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.perf_counter() - start
+        summary = pipeline.summary()
+        print(f"Consumed {summary['source']['events']:,} messages ({engine.total_conversions:,} conversions) "
+              f"from {source.n_partitions} partitions with {consumer.workers} workers in {elapsed:.2f}s")
+        print(f"  Rate: {summary['source']['events'] / elapsed:,.0f} messages/sec | "
+              f"Skipped: {consumer.skipped:,} paths with unknown channels")
+    source.close()
@@ -0,0 +1,148 @@
+"""
+Sparse Transition Counts
+========================
+
+Transition count storage for large channel taxonomies (sub-channels,
+placements), where a dense (n_states x n_states) matrix is mostly zeros.
+
+Counts live in CSR arrays (indptr, indices, data). Increments are appended
+to a COO buffer of flat keys (row * n_states + col) and merged into the CSR
+arrays when the buffer fills or a reader needs them, so ingestion never
+re-sorts the matrix per conversion.
+
+Compaction, scaling and growth replace the CSR arrays instead of writing
+into them: a snapshot() taken under the engine lock stays valid after the
+lock is released, without a copy.
+"""
+
+import numpy as np
+from typing import Dict, Sequence, Tuple, Union
+
+
+class SparseTransitionCounts:
+    """
+    CSR transition counts with a COO append buffer.
+    """
+
+    def __init__(self, n_states: int, buffer_size: int = 65536):
+        """
+        Initialize counts.
+
+        Args:
+            n_states: Number of states (rows and columns)
+            buffer_size: Buffered increments before they are compacted
+                into the CSR arrays
+        """
+        self.n_states = n_states
+        self.buffer_size = buffer_size
+        self.indptr = np.zeros(n_states + 1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.data = np.zeros(0)
+        self._keys = np.empty(buffer_size, dtype=np.int64)
+        self._values = np.empty(buffer_size)
+        self._fill = 0
+
+    @property
+    def nnz(self) -> int:
+        """Stored (compacted) non-zero counts."""
+        return len(self.data)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.n_states, self.n_states
+
+    def add(self, keys: Union[Sequence[int], np.ndarray], values: Union[float, np.ndarray]):
+        """
+        Queue count increments.
+
+        Args:
+            keys: Flat cell keys, row * n_states + col (repeats allowed)
+            values: Increment per key, or one increment for all of them
+        """
+        k = len(keys)
+        if self._fill + k > self.buffer_size:
+            self.compact()
+            if k > self.buffer_size:
+                self._merge(np.asarray(keys, dtype=np.int64),
+                            np.broadcast_to(np.asarray(values, dtype=np.float64), (k,)))
+                return
+        self._keys[self._fill:self._fill + k] = keys
+        self._values[self._fill:self._fill + k] = values
+        self._fill += k
+
+    def compact(self):
+        """Merge buffered increments into the CSR arrays."""
+        if self._fill:
+            self._merge(self._keys[:self._fill], self._values[:self._fill])
+            self._fill = 0
+
+    def _merge(self, keys: np.ndarray, values: np.ndarray):
+        n = self.n_states
+        rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        unique, inverse = np.unique(np.concatenate((rows * n + self.indices, keys)), return_inverse=True)
+        summed = np.bincount(inverse, weights=np.concatenate((self.data, values)), minlength=len(unique))
+        keep = summed != 0
+        self._set_keys(unique[keep], summed[keep])
+
+    def _set_keys(self, keys: np.ndarray, data: np.ndarray):
+        """Replace the CSR arrays with sorted unique flat keys and their counts."""
+        n = self.n_states
+        rows = keys // n
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        self.indptr, self.indices, self.data = indptr, keys - rows * n, data
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compacted (indptr, indices, data); never modified in place afterwards."""
+        self.compact()
+        return self.indptr, self.indices, self.data
+
+    def __imul__(self, factor: float):
+        # Rebinds data (see snapshot)
+        self.data = self.data * factor
+        self._values[:self._fill] *= factor
+        return self
+
+    def insert_states(self, position: int, count: int):
+        """
+        Insert count empty states before state index position, shifting the
+        later states up (e.g. new channels ahead of Start and Conversion).
+        """
+        self.compact()
+        n = self.n_states
+        rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        rows = np.where(rows >= position, rows + count, rows)
+        cols = np.where(self.indices >= position, self.indices + count, self.indices)
+        self.n_states = n + count
+        # The shift preserves (row, col) order, so keys stay sorted
+        self._set_keys(rows * self.n_states + cols, self.data)
+
+    def toarray(self) -> np.ndarray:
+        self.compact()
+        dense = np.zeros(self.shape)
+        rows = np.repeat(np.arange(self.n_states), np.diff(self.indptr))
+        dense[rows, self.indices] = self.data
+        return dense
+
+    def load(self, dense: np.ndarray):
+        """Replace all counts with a dense matrix's non-zeros."""
+        self._fill = 0
+        rows, cols = np.nonzero(dense)
+        self._set_keys(rows * self.n_states + cols, dense[rows, cols].astype(np.float64))
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """(meta, arrays) for a checkpoint; the arrays are a snapshot()."""
+        indptr, indices, data = self.snapshot()
+        return {'n_states': self.n_states}, {'indptr': indptr, 'indices': indices, 'data': data}
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        if meta['n_states'] != self.n_states:
+            raise ValueError(f"Checkpoint has {meta['n_states']} states, expected {self.n_states}")
+        self._fill = 0
+        self.indptr = np.asarray(arrays['indptr'], dtype=np.int64)
+        self.indices = np.asarray(arrays['indices'], dtype=np.int64)
+        self.data = np.asarray(arrays['data'], dtype=np.float64)
+
+    def memory_usage(self) -> int:
+        """Bytes held by the CSR arrays and the buffer."""
+        return sum(a.nbytes for a in (self.indptr, self.indices, self.data, self._keys, self._values))
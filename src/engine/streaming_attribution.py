@@ -6,11 +6,32 @@ Implements incremental attribution scoring (Markov/Shapley) for high-velocity ev
 Designed for 100ms latency at 200K events/second.
 """
 
+import os
+import sys
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import threading
+import time
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.bootstrap import PoissonBootstrap
+from engine.dimensional import DimensionalCube
+from engine.higher_order import HigherOrderChain
+from engine.markov_solver import AbsorbingChainSolver, SparseChainSolver
+from engine.shapley import CoalitionShapley, path_masks
+from engine.sparse_transitions import SparseTransitionCounts
+from engine.windowing import BucketRing, ExponentialDecay
+from telemetry.histogram import histogram_if
+
+ATTRIBUTION_MODELS = ('markov', 'shapley', 'last_touch')
+WINDOW_MODES = ('sliding', 'tumbling')
+TRANSITION_BACKENDS = ('dense', 'sparse')
+# Batch bitmasks are int64; wider channel sets fall back to Python ints
+MAX_VECTORIZED_MASK_CHANNELS = 62
 
 class StreamingAttributionEngine:
     """
@@ -18,15 +39,122 @@ class StreamingAttributionEngine:
     
     Maintains running state of channel transitions and conversion values
     to provide sub-100ms attribution score updates.
+    
+    By default state accumulates from process start. With decay_half_life
+    every conversion's weight halves each half-life; with window_mode only
+    conversions inside the last window_seconds count ('sliding' expires one
+    bucket at a time, 'tumbling' resets at each window boundary).
+    
+    Transition counts are a dense matrix by default; the 'sparse' backend
+    keeps them in CSR form with iterative solvers, for taxonomies with
+    thousands of channels.
     """
     
-    def __init__(self, channels: List[str]):
-        self.channels = channels
+    def __init__(
+        self,
+        channels: List[str],
+        attribution_model: str = 'markov',
+        track_shapley: Optional[bool] = None,
+        shapley_exact_max_channels: int = 12,
+        shapley_permutations: int = 256,
+        decay_half_life: Optional[float] = None,
+        window_mode: Optional[str] = None,
+        window_seconds: float = 1800.0,
+        window_buckets: int = 30,
+        use_event_time: bool = False,
+        instrument: bool = False,
+        latency_sample_every: int = 64,
+        dimensions: Optional[List[str]] = None,
+        transitions_backend: str = 'dense',
+        sparse_buffer_size: int = 65536,
+        grow_channels: bool = False,
+        markov_order: int = 1,
+        max_markov_states: int = 100000,
+        bootstrap_replicates: int = 0,
+        bootstrap_seed: Optional[int] = None
+    ):
+        """
+        Initialize engine.
+        
+        Args:
+            channels: Channel names, in index order
+            attribution_model: Model reported as 'attribution'/'shares' by
+                get_current_scores ('markov' removal effect, 'shapley' or
+                'last_touch')
+            track_shapley: Keep coalition counts and report a 'shapley'
+                block (default: only when attribution_model is 'shapley')
+            shapley_exact_max_channels: Largest channel count for exact
+                Shapley values; above it values are permutation-sampled
+            shapley_permutations: Permutations per sampled estimate
+            decay_half_life: Exponential decay half-life in seconds
+            window_mode: 'sliding' or 'tumbling' window (exclusive with decay)
+            window_seconds: Window length for window_mode
+            window_buckets: Buckets per sliding window (expiry granularity)
+            use_event_time: Measure "now" by the latest event timestamp
+                instead of the wall clock (for replaying recorded traffic)
+            instrument: Record ingest/scoring latency histograms in
+                telemetry.histogram.REGISTRY
+            latency_sample_every: Time one in this many process_conversion
+                calls when instrumented (batches are always timed)
+            dimensions: Also keep per-slice state in a DimensionalCube over
+                these dimensions (e.g. ['campaign', 'device']); conversions
+                then carry labels, and get_dimensional_scores answers
+                per-slice queries
+            transitions_backend: 'dense' (n_states x n_states array) or
+                'sparse' (CSR counts, Jacobi solvers; no windows)
+            sparse_buffer_size: Transition increments buffered before the
+                sparse backend compacts them
+            grow_channels: Register unseen channel names on first sight
+                instead of raising KeyError (no Shapley, windows or
+                dimensions)
+            markov_order: Channels of history per Markov state; above 1 the
+                'markov' model scores a HigherOrderChain (no windows)
+            max_markov_states: Cap on higher-order states before rare ones
+                are pruned into their suffixes
+            bootstrap_replicates: Keep this many Poisson bootstrap replicates
+                of the transition counts and report share intervals and a
+                confidence score under 'bootstrap' (0: off; 'markov' model,
+                dense first-order chain, no windows). Batch updates then
+                cost roughly 1.3x the plain update at 4 channels, 4x at
+                B=32 and 4.6x at B=64 with 16 channels and 4-touch paths
+            bootstrap_seed: Random seed for the replicate weights
+        """
+        if attribution_model not in ATTRIBUTION_MODELS:
+            raise ValueError(f"Unknown attribution model: {attribution_model}")
+        if window_mode is not None and window_mode not in WINDOW_MODES:
+            raise ValueError(f"Unknown window mode: {window_mode}")
+        if window_mode is not None and decay_half_life is not None:
+            raise ValueError("decay_half_life and window_mode are mutually exclusive")
+        if dimensions and (window_mode is not None or decay_half_life is not None):
+            raise ValueError("dimensions are not supported with decay or windows")
+        if transitions_backend not in TRANSITION_BACKENDS:
+            raise ValueError(f"Unknown transitions backend: {transitions_backend}")
+        if transitions_backend == 'sparse' and window_mode is not None:
+            raise ValueError("The sparse transitions backend does not support windows")
+        if grow_channels and (window_mode is not None or dimensions
+                              or track_shapley or attribution_model == 'shapley'):
+            raise ValueError("grow_channels is not supported with Shapley, windows or dimensions")
+        if markov_order > 1 and (window_mode is not None or grow_channels):
+            raise ValueError("markov_order > 1 is not supported with windows or grow_channels")
+        if bootstrap_replicates and (attribution_model != 'markov' or markov_order > 1
+                                     or transitions_backend != 'dense' or window_mode is not None
+                                     or grow_channels):
+            raise ValueError("The bootstrap needs the markov model on a dense first-order chain "
+                             "without windows or grow_channels")
+        self.attribution_model = attribution_model
+        # Own copy: grow_channels replaces it rather than appending
+        self.channels = list(channels)
         self.n_channels = len(channels)
         self.channel_to_idx = {c: i for i, c in enumerate(channels)}
+        self.grow_channels = grow_channels
         
         # State: Transition matrix (n x n)
-        self.transitions = np.zeros((self.n_channels + 2, self.n_channels + 2))
+        self.n_states = self.n_channels + 2
+        self._sparse = transitions_backend == 'sparse'
+        if self._sparse:
+            self.transitions = SparseTransitionCounts(self.n_states, sparse_buffer_size)
+        else:
+            self.transitions = np.zeros((self.n_states, self.n_states))
         # Index n: Start state, Index n+1: Conversion state
         self.START_IDX = self.n_channels
         self.CONV_IDX = self.n_channels + 1
@@ -34,74 +162,859 @@ class StreamingAttributionEngine:
         # Running metrics
         self.total_conversions = 0
         self.total_value = 0.0
-        self.channel_values = {c: 0.0 for c in channels}
-        self.channel_conversions = {c: 0.0 for c in channels}
+        # Last-touch totals, indexed like self.channels
+        self._channel_values = np.zeros(self.n_channels)
+        self._channel_conversions = np.zeros(self.n_channels)
+        
+        # Markov solver state: rows whose counts changed since the last solve
+        self._dirty_rows = np.zeros(self.n_states, dtype=bool)
+        self._solver = self._new_solver()
+        
+        # Shapley state: conversion value per channel-set bitmask
+        if track_shapley is None:
+            track_shapley = attribution_model == 'shapley'
+        self._shapley = None
+        if track_shapley:
+            self._shapley = CoalitionShapley(
+                self.n_channels,
+                exact_max_channels=shapley_exact_max_channels,
+                n_permutations=shapley_permutations
+            )
+            
+        # Higher-order chain: k-tuple states, scored instead of the
+        # first-order matrix by the 'markov' model
+        self.markov_order = markov_order
+        self._higher = None
+        if markov_order > 1:
+            self._higher = HigherOrderChain(self.n_channels, markov_order, max_markov_states)
+            
+        # Uncertainty: replicate transition counts with Poisson path weights
+        self._bootstrap = None
+        if bootstrap_replicates:
+            self._bootstrap = PoissonBootstrap(self.n_channels, bootstrap_replicates, bootstrap_seed)
+        self._bootstrap_result: Optional[Tuple[int, Dict]] = None
+            
+        # Forgetting: stored state is scaled by the decay weight, or split
+        # into window buckets whose deltas are subtracted on expiry
+        self._decay = ExponentialDecay(decay_half_life) if decay_half_life else None
+        self._window = None
+        if window_mode is not None:
+            n_buckets = 1 if window_mode == 'tumbling' else window_buckets
+            self._window = BucketRing(window_seconds, n_buckets, self.n_states, self.n_channels)
+        self.window_mode = window_mode
+        self.use_event_time = use_event_time
+        
+        # Dimensional slices (campaign, device, ...), pre-aggregated roll-ups
+        self.cube = DimensionalCube(channels, dimensions) if dimensions else None
+        self._latest_ts: Optional[float] = None
+        
+        # Settings a checkpoint must match to be restored into this engine
+        self._checkpoint_config = {
+            'attribution_model': attribution_model,
+            'transitions_backend': transitions_backend,
+            'markov_order': markov_order,
+            'decay_half_life': decay_half_life,
+            'window_mode': window_mode,
+            'window_seconds': window_seconds if window_mode is not None else None,
+            'window_buckets': self._window.n_buckets if self._window is not None else None,
+            'dimensions': list(dimensions) if dimensions else None,
+            'track_shapley': bool(track_shapley),
+            'bootstrap_replicates': bootstrap_replicates,
+        }
+        # Write-ahead log (engine.checkpoint.WriteAheadLog), appended under the lock
+        self._wal = None
         
         self.lock = threading.Lock()
+        # Serializes solver refreshes without blocking ingestion
+        self._score_lock = threading.Lock()
         
-    def process_conversion(self, touchpoints: List[str], value: float):
+        # Latency instrumentation: per-call ingestion is sampled; batch and
+        # scoring calls go through timed wrappers that shadow the methods
+        self._ingest_hist = histogram_if(instrument, 'engine_ingest_seconds',
+                                         'Duration of one engine ingestion call')
+        if self._ingest_hist is not None:
+            self._event_age_hist = histogram_if(True, 'engine_event_to_ingest_seconds',
+                                                'Event generation to engine ingestion')
+            self._scoring_hist = histogram_if(True, 'engine_scoring_seconds',
+                                              'Duration of get_current_scores')
+            self._event_to_score_hist = histogram_if(True, 'engine_event_to_score_seconds',
+                                                     'Oldest unscored event generation to scoring')
+            self._sample_every = max(1, latency_sample_every)
+            self._sample_countdown = 1
+            self._oldest_unscored: Optional[float] = None
+            self.process_conversions_batch = self._timed_process_conversions_batch
+            self.get_current_scores = self._timed_get_current_scores
+        
+    @property
+    def channel_values(self) -> Dict[str, float]:
+        """Last-touch conversion value per channel."""
+        return dict(zip(self.channels, (self._channel_values / self._scale()).tolist()))
+        
+    @property
+    def channel_conversions(self) -> Dict[str, float]:
+        """Last-touch conversion count per channel."""
+        return dict(zip(self.channels, (self._channel_conversions / self._scale()).tolist()))
+        
+    def _new_solver(self):
+        if self._sparse:
+            return SparseChainSolver(self.n_channels)
+        return AbsorbingChainSolver(self.n_channels)
+        
+    def add_channels(self, names: List[str]) -> List[int]:
+        """
+        Register channels after construction (requires grow_channels).
+        
+        New channels take the next indices; Start and Conversion move up
+        behind them, and every row is re-solved on the next scoring.
+        
+        Returns:
+            Index of each name (existing names keep theirs)
+        """
+        if not self.grow_channels:
+            raise ValueError("Engine was created without grow_channels")
+        with self.lock:
+            self._add_channels(names)
+            return [self.channel_to_idx[c] for c in names]
+            
+    def _add_channels(self, names: List[str]):
+        """Register unseen channel names (call under self.lock)."""
+        added = [c for c in dict.fromkeys(names) if c not in self.channel_to_idx]
+        if not added:
+            return
+        k = len(added)
+        old = self.n_channels
+        if self._sparse:
+            self.transitions.insert_states(old, k)
+        else:
+            keep = np.r_[0:old, old + k:old + k + 2]
+            grown = np.zeros((self.n_states + k, self.n_states + k))
+            grown[np.ix_(keep, keep)] = self.transitions
+            self.transitions = grown
+        self._channel_values = np.r_[self._channel_values, np.zeros(k)]
+        self._channel_conversions = np.r_[self._channel_conversions, np.zeros(k)]
+        for c in added:
+            self.channel_to_idx[c] = len(self.channel_to_idx)
+        self.channels = self.channels + added
+        self.n_states += k
+        self.START_IDX += k
+        self.CONV_IDX += k
+        self._dirty_rows = np.ones(self.n_states, dtype=bool)
+        # Last: process_conversions_batch compares it to detect growth
+        self.n_channels += k
+        self._solver = self._new_solver()
+        if self._wal is not None:
+            self._wal.append_channels(added)
+        
+    def _now(self) -> float:
+        if self.use_event_time and self._latest_ts is not None:
+            return self._latest_ts
+        return time.time()
+        
+    def _scale(self) -> float:
+        """Decay weight of 'now': stored state divided by this is current state."""
+        if self._decay is None or self._decay.origin is None:
+            return 1.0
+        return float(self._decay.weight(self._now()))
+        
+    def _admit(self, timestamp: float) -> Optional[Tuple[float, Optional[int]]]:
+        """
+        Bring decay/window state up to timestamp (call under self.lock).
+        
+        Returns:
+            (weight, window slot) for a conversion at timestamp, or None if
+            it falls before the current window
+        """
+        if self._latest_ts is None or timestamp > self._latest_ts:
+            self._latest_ts = timestamp
+        weight = 1
+        if self._decay is not None:
+            if self._decay.needs_rebase(timestamp):
+                self._rebase(timestamp)
+            weight = float(self._decay.weight(timestamp))
+        slot = None
+        if self._window is not None:
+            bucket = int(self._window.bucket_ids(timestamp))
+            self._expire(bucket)
+            if not self._window.is_live(bucket):
+                return None
+            slot = self._window.slot(bucket)
+        return weight, slot
+        
+    def _rebase(self, timestamp: float):
+        factor = self._decay.rebase(timestamp)
+        self.transitions *= factor
+        self._channel_values *= factor
+        self._channel_conversions *= factor
+        self.total_conversions *= factor
+        self.total_value *= factor
+        if self._shapley is not None:
+            self._shapley.scale(factor)
+        if self._higher is not None:
+            self._higher.scale(factor)
+        if self._bootstrap is not None:
+            self._bootstrap.scale(factor)
+            
+    def _expire(self, bucket: int):
+        ring = self._window
+        for slot in ring.advance(bucket):
+            if ring.conversions[slot]:
+                self.transitions -= ring.transitions[slot]
+                self._dirty_rows |= ring.transitions[slot].any(axis=1)
+                self._channel_values -= ring.channel_values[slot]
+                self._channel_conversions -= ring.channel_conversions[slot]
+                np.maximum(self._channel_values, 0.0, out=self._channel_values)
+                self.total_conversions -= int(ring.conversions[slot])
+                self.total_value = max(self.total_value - ring.values[slot], 0.0)
+                for mask, value in ring.coalitions[slot].items():
+                    self._shapley.add(mask, -value)
+            ring.clear(slot)
+        
+    def process_conversion(self, touchpoints: List[str], value: float,
+                           timestamp: Optional[float] = None,
+                           emitted_at: Optional[float] = None,
+                           labels: Optional[Dict] = None):
         """
         Process a new conversion path and update incremental scores.
         
         Args:
             touchpoints: Ordered list of channel names in the path
             value: Monitary value of the conversion
+            timestamp: Conversion time (epoch seconds, default: now)
+            emitted_at: Wall-clock time the event was generated; only
+                used for latency histograms when instrumented
+            labels: Dimension labels (e.g. {'campaign': ..., 'device': ...})
+                when the engine has dimensions
         """
         if not touchpoints:
             return
+        if self._ingest_hist is not None:
+            # Instrumented: time one call in latency_sample_every
+            self._sample_countdown -= 1
+            if self._sample_countdown <= 0:
+                return self._timed_process_conversion(touchpoints, value, timestamp, emitted_at, labels)
             
         with self.lock:
-            self.total_conversions += 1
-            self.total_value += value
+            if self._decay is None and self._window is None:
+                weight, slot = 1, None
+                if timestamp is not None and (self._latest_ts is None or timestamp > self._latest_ts):
+                    self._latest_ts = timestamp
+            else:
+                # Logged resolved, so a replay weighs it as it was weighed now
+                timestamp = self._now() if timestamp is None else timestamp
+                admitted = self._admit(timestamp)
+                if admitted is None:
+                    return
+                weight, slot = admitted
+            
+            self.total_conversions += weight
+            self.total_value += value * weight
             
             # 1. Update Transition Matrix (for Markov Model)
             # Path: Start -> T1 -> T2 -> ... -> Tn -> Conversion
+            try:
+                path = [self.channel_to_idx[c] for c in touchpoints]
+            except KeyError:
+                if not self.grow_channels:
+                    raise
+                self._add_channels(touchpoints)
+                path = [self.channel_to_idx[c] for c in touchpoints]
+            states = [self.START_IDX] + path + [self.CONV_IDX]
+            if self._sparse:
+                n = self.n_states
+                self.transitions.add([f * n + t for f, t in zip(states, states[1:])], weight)
+                self._dirty_rows[states[:-1]] = True
+            else:
+                for from_idx, to_idx in zip(states, states[1:]):
+                    self.transitions[from_idx, to_idx] += weight
+                    self._dirty_rows[from_idx] = True
+            if self._higher is not None:
+                self._higher.add_path(path, weight)
+            if self._bootstrap is not None:
+                self._bootstrap.add_path(path, weight)
+                
+            # 2. Heuristic Attribution (Last-Click for real-time baseline)
+            last_idx = path[-1]
+            self._channel_values[last_idx] += value * weight
+            self._channel_conversions[last_idx] += weight
             
-            # Start -> First touchpoint
-            first_idx = self.channel_to_idx[touchpoints[0]]
-            self.transitions[self.START_IDX, first_idx] += 1
+            # 3. Coalition counts (for Shapley)
+            mask = 0
+            if self._shapley is not None:
+                for idx in path:
+                    mask |= 1 << idx
+                self._shapley.add(mask, value * weight)
+                
+            if slot is not None:
+                ring = self._window
+                for from_idx, to_idx in zip(states, states[1:]):
+                    ring.transitions[slot, from_idx, to_idx] += 1
+                ring.channel_values[slot, last_idx] += value
+                ring.channel_conversions[slot, last_idx] += 1
+                ring.conversions[slot] += 1
+                ring.values[slot] += value
+                if self._shapley is not None:
+                    coalitions = ring.coalitions[slot]
+                    coalitions[mask] = coalitions.get(mask, 0.0) + value
+                    
+            if self.cube is not None:
+                self.cube.add(path, value, labels or {})
+            if self._wal is not None:
+                self._wal.append_conversion(touchpoints, value, timestamp, labels)
+            
+    def encode_paths(self, paths: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encode channel-name paths into the ragged arrays taken by
+        process_conversions_batch (registering unseen channels with
+        grow_channels).
+        
+        Returns:
+            (channel_idx, offsets) where path i is channel_idx[offsets[i]:offsets[i+1]]
+        """
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in paths], out=offsets[1:])
+        lookup = self.channel_to_idx
+        if self.grow_channels:
+            unseen = {c for p in paths for c in p if c not in lookup}
+            if unseen:
+                self.add_channels(sorted(unseen))
+        channel_idx = np.fromiter(
+            (lookup[c] for p in paths for c in p), dtype=np.int64, count=int(offsets[-1])
+        )
+        return channel_idx, offsets
+        
+    def process_conversions_batch(self, channel_idx: np.ndarray, offsets: np.ndarray,
+                                  values: np.ndarray, timestamps: Optional[np.ndarray] = None,
+                                  emitted_at: Optional[float] = None,
+                                  labels: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Process many conversion paths with one vectorized state update.
+        
+        Paths are integer-encoded as a ragged array: path i is
+        channel_idx[offsets[i]:offsets[i+1]] (see encode_paths). Transition
+        counts and last-touch totals are accumulated with bincount outside
+        the lock and applied with a single lock acquisition.
+        
+        Args:
+            channel_idx: Flat array of channel indices for all paths
+            offsets: Path boundaries into channel_idx, length n_paths + 1
+            values: Monitary value of each conversion, length n_paths
+            timestamps: Conversion time of each path (default: now)
+            emitted_at: Wall-clock time the oldest event of the batch was
+                generated; only used for latency histograms when instrumented
+            labels: Per-path label arrays by dimension when the engine has
+                dimensions
+        """
+        channel_idx = np.asarray(channel_idx)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        
+        n_paths = len(offsets) - 1
+        if n_paths < 1:
+            return
+        if len(values) != n_paths:
+            raise ValueError(f"Expected {n_paths} values, got {len(values)}")
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            if len(timestamps) != n_paths:
+                raise ValueError(f"Expected {n_paths} timestamps, got {len(timestamps)}")
             
-            # T_i -> T_{i+1}
-            for i in range(len(touchpoints) - 1):
-                from_idx = self.channel_to_idx[touchpoints[i]]
-                to_idx = self.channel_to_idx[touchpoints[i+1]]
-                self.transitions[from_idx, to_idx] += 1
+        # Allow offsets into a larger buffer (e.g. a slice of a replay file)
+        channel_idx = channel_idx[offsets[0]:offsets[-1]].astype(np.int64, copy=False)
+        offsets = offsets - offsets[0]
+        
+        if self._window is not None and timestamps is not None:
+            # Each window bucket gets its own update
+            buckets = self._window.bucket_ids(timestamps)
+            if buckets.min() != buckets.max():
+                for bucket in np.unique(buckets):
+                    selected = buckets == bucket
+                    sub_idx, sub_offsets = select_paths(channel_idx, offsets, selected)
+                    StreamingAttributionEngine.process_conversions_batch(
+                        self, sub_idx, sub_offsets, values[selected], timestamps[selected]
+                    )
+                return
                 
-            # Last -> Conversion
-            last_idx = self.channel_to_idx[touchpoints[-1]]
-            self.transitions[last_idx, self.CONV_IDX] += 1
+        n_channels = self.n_channels
+        delta = self._prepare_batch(channel_idx, offsets, values, timestamps)
+        if delta is None:
+            return
+        with self.lock:
+            if self.n_channels != n_channels:
+                # Channels were added meanwhile, moving Start and Conversion
+                delta = self._prepare_batch(channel_idx, offsets, values, timestamps)
+            self._apply_batch(delta)
+            if self._wal is not None:
+                self._wal.append_batch(channel_idx, offsets, values, timestamps, delta['timestamp'], labels)
+                if self.cube is not None:
+                    # Under the lock, so no checkpoint sees the batch in one
+                    # place but not the other
+                    self.cube.add_batch(channel_idx, offsets, values, labels or {})
+                    return
+        if self.cube is not None:
+            self.cube.add_batch(channel_idx, offsets, values, labels or {})
             
-            # 2. Heuristic Attribution (Last-Click for real-time baseline)
-            last_channel = touchpoints[-1]
-            self.channel_values[last_channel] += value
-            self.channel_conversions[last_channel] += 1
+    def _prepare_batch(self, channel_idx: np.ndarray, offsets: np.ndarray,
+                       values: np.ndarray, timestamps: Optional[np.ndarray]) -> Optional[Dict]:
+        """Aggregate a batch into state deltas without touching engine state."""
+        lengths = np.diff(offsets)
+        if (lengths < 0).any():
+            raise ValueError("offsets must be non-decreasing")
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return None
+        if channel_idx.min() < 0 or channel_idx.max() >= self.n_channels:
+            raise ValueError("channel index out of range")
+            
+        first = channel_idx[offsets[:-1][nonempty]]
+        last_pos = offsets[1:][nonempty] - 1
+        last = channel_idx[last_pos]
+        path_values = values[nonempty]
+        
+        # Every position except the last of its path transitions to pos + 1
+        interior = np.ones(channel_idx.size, dtype=bool)
+        interior[last_pos] = False
+        interior_pos = np.flatnonzero(interior)
+        
+        n = self.n_states
+        flat = np.concatenate((
+            self.START_IDX * n + first,
+            channel_idx[interior_pos] * n + channel_idx[interior_pos + 1],
+            last * n + self.CONV_IDX,
+        ))
+        
+        # Decay weights relative to the newest path; scaled to the global
+        # origin under the lock
+        timestamp = None
+        path_weights = None
+        if timestamps is not None:
+            timestamps = timestamps[nonempty]
+            timestamp = float(timestamps.max())
+            if self._decay is not None:
+                path_weights = np.exp(self._decay.rate * (timestamps - timestamp))
+        flat_weights = None
+        if path_weights is not None:
+            path_of_pos = np.repeat(np.arange(len(path_weights)), lengths[nonempty])
+            flat_weights = np.concatenate((
+                path_weights, path_weights[path_of_pos[interior_pos]], path_weights
+            ))
+            weighted_values = path_values * path_weights
+            conversions = float(path_weights.sum())
+        else:
+            weighted_values = path_values
+            conversions = len(path_values)
+            
+        if flat.size * 4 >= n * n and not self._sparse:
+            keys = None
+            counts = np.bincount(flat, weights=flat_weights, minlength=n * n).reshape(n, n)
+        else:
+            # Sparse update for large matrices: only touch the cells we hit
+            keys, inverse = np.unique(flat, return_inverse=True)
+            counts = np.bincount(inverse, weights=flat_weights, minlength=len(keys))
             
+        delta = {
+            'timestamp': timestamp,
+            'keys': keys,
+            'counts': counts,
+            'dirty_rows': np.unique(flat // n),
+            'last_values': np.bincount(last, weights=weighted_values, minlength=self.n_channels),
+            'last_conversions': np.bincount(last, weights=path_weights, minlength=self.n_channels),
+            'conversions': conversions,
+            'value': float(weighted_values.sum()),
+            'coalitions': None,
+            'higher': None,
+            'bootstrap': None,
+        }
+        
+        if self._higher is not None or self._bootstrap is not None:
+            path_offsets = np.zeros(len(path_values) + 1, dtype=np.int64)
+            np.cumsum(lengths[nonempty], out=path_offsets[1:])
+            if self._higher is not None:
+                delta['higher'] = self._higher.prepare_batch(channel_idx, path_offsets, path_weights)
+            if self._bootstrap is not None:
+                delta['bootstrap'] = self._bootstrap.prepare_batch(channel_idx, path_offsets, path_weights)
+        
+        if self._shapley is not None:
+            starts = offsets[:-1][nonempty]
+            if self.n_channels <= MAX_VECTORIZED_MASK_CHANNELS:
+                masks, inverse = np.unique(path_masks(channel_idx, starts), return_inverse=True)
+                totals = np.bincount(inverse, weights=weighted_values, minlength=len(masks))
+                delta['coalitions'] = list(zip(masks.tolist(), totals.tolist()))
+            else:
+                coalitions = {}
+                for a, b, value in zip(starts.tolist(), (last_pos + 1).tolist(),
+                                       weighted_values.tolist()):
+                    mask = sum(1 << c for c in set(channel_idx[a:b].tolist()))
+                    coalitions[mask] = coalitions.get(mask, 0.0) + value
+                delta['coalitions'] = list(coalitions.items())
+        return delta
+        
+    def _apply_batch(self, delta: Dict):
+        """Apply a prepared batch (call under self.lock)."""
+        timestamp = delta['timestamp']
+        if timestamp is None and (self._decay is not None or self._window is not None):
+            # Resolved here so the write-ahead log records the time used
+            timestamp = delta['timestamp'] = self._now()
+        admitted = self._admit(self._now() if timestamp is None else timestamp)
+        if admitted is None:
+            return
+        weight, slot = admitted
+        
+        counts = delta['counts'] * weight if weight != 1 else delta['counts']
+        if self._sparse:
+            self.transitions.add(delta['keys'], counts)
+        elif delta['keys'] is None:
+            self.transitions += counts
+        else:
+            self.transitions.reshape(-1)[delta['keys']] += counts
+        self._dirty_rows[delta['dirty_rows']] = True
+        self._channel_values += delta['last_values'] * weight
+        self._channel_conversions += delta['last_conversions'] * weight
+        self.total_conversions += delta['conversions'] * weight
+        self.total_value += delta['value'] * weight
+        if delta['coalitions'] is not None:
+            for mask, value in delta['coalitions']:
+                self._shapley.add(mask, value * weight)
+        if delta['higher'] is not None:
+            self._higher.apply_batch(delta['higher'], weight)
+        if delta['bootstrap'] is not None:
+            self._bootstrap.apply_batch(delta['bootstrap'], weight)
+                
+        if slot is not None:
+            # Window mode has no decay, so the delta is in stored units
+            ring = self._window
+            if delta['keys'] is None:
+                ring.transitions[slot] += delta['counts']
+            else:
+                ring.transitions[slot].reshape(-1)[delta['keys']] += delta['counts']
+            ring.channel_values[slot] += delta['last_values']
+            ring.channel_conversions[slot] += delta['last_conversions']
+            ring.conversions[slot] += delta['conversions']
+            ring.values[slot] += delta['value']
+            if delta['coalitions'] is not None:
+                coalitions = ring.coalitions[slot]
+                for mask, value in delta['coalitions']:
+                    coalitions[mask] = coalitions.get(mask, 0.0) + value
+            
+    def export_state(self) -> Dict:
+        """
+        Snapshot the transition counts and totals in present-time units
+        (decay applied), e.g. for merging shards. Transitions are a dense
+        array for either backend.
+        """
+        with self.lock:
+            if self._window is not None:
+                self._expire(int(self._window.bucket_ids(self._now())))
+            scale = self._scale()
+            transitions = self.transitions.toarray() if self._sparse else self.transitions
+            return {
+                'transitions': transitions / scale,
+                'channel_values': self._channel_values / scale,
+                'channel_conversions': self._channel_conversions / scale,
+                'total_conversions': self.total_conversions if self._decay is None
+                                     else self.total_conversions / scale,
+                'total_value': self.total_value / scale,
+            }
+            
+    def load_state(self, state: Dict):
+        """
+        Replace the transition counts and totals with an export_state()
+        snapshot (or a sum of several). Only rows that differ are marked
+        for the Markov solver.
+        """
+        if (self._decay is not None or self._window is not None or self._shapley is not None
+                or self._higher is not None or self._bootstrap is not None):
+            raise ValueError("load_state requires an engine without decay, windows, Shapley, "
+                             "higher-order or bootstrap state")
+        transitions = np.asarray(state['transitions'], dtype=np.float64)
+        if transitions.shape != self.transitions.shape:
+            raise ValueError(f"Expected transitions of shape {self.transitions.shape}")
+        with self.lock:
+            if self._sparse:
+                self._dirty_rows[:] = True
+                self.transitions.load(transitions)
+            else:
+                self._dirty_rows |= (transitions != self.transitions).any(axis=1)
+                self.transitions[:] = transitions
+            self._channel_values[:] = state['channel_values']
+            self._channel_conversions[:] = state['channel_conversions']
+            self.total_conversions = float(state['total_conversions'])
+            self.total_value = float(state['total_value'])
+            
+    def attach_wal(self, wal):
+        """Log every ingestion call to wal (a WriteAheadLog), or stop logging with None."""
+        with self.lock:
+            self._wal = wal
+            
+    def checkpoint_state(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """
+        Copy the full engine state for engine.checkpoint.write_checkpoint.
+        
+        Only the copy holds the lock; with a write-ahead log attached the
+        log is rotated in the same critical section, and meta['wal_segment']
+        is the first segment the checkpoint does not cover.
+        
+        Returns:
+            (meta, arrays): JSON-able settings and totals, and named arrays
+            (components prefixed, e.g. 'cube.counts')
+        """
+        with self.lock:
+            meta = {
+                'config': self._checkpoint_config,
+                'channels': list(self.channels),
+                'total_conversions': float(self.total_conversions),
+                'total_value': float(self.total_value),
+                'latest_ts': self._latest_ts,
+                'decay_origin': self._decay.origin if self._decay is not None else None,
+                'wal_segment': None,
+            }
+            arrays = {
+                'channel_values': self._channel_values.copy(),
+                'channel_conversions': self._channel_conversions.copy(),
+            }
+            components = {'shapley': self._shapley, 'higher': self._higher,
+                          'window': self._window, 'cube': self.cube, 'bootstrap': self._bootstrap}
+            if self._sparse:
+                components['transitions'] = self.transitions
+            else:
+                arrays['transitions'] = self.transitions.copy()
+            for name, component in components.items():
+                if component is None:
+                    continue
+                meta[name], component_arrays = component.checkpoint()
+                arrays.update({f'{name}.{key}': a for key, a in component_arrays.items()})
+            if self._wal is not None:
+                meta['wal_segment'] = self._wal.rotate()
+            return meta, arrays
+            
+    def restore_checkpoint_state(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        """
+        Load a checkpoint_state() result into this freshly created engine.
+        
+        The engine must have been created with the same settings (model,
+        backend, decay, window, dimensions, Shapley). With grow_channels the
+        checkpoint may extend the channel list. Arrays are used as given, so
+        read_checkpoint's copy-on-write views are only copied when written.
+        """
+        if meta['config'] != self._checkpoint_config:
+            raise ValueError(f"Checkpoint settings {meta['config']} do not match the engine's "
+                             f"{self._checkpoint_config}")
+        channels = meta['channels']
+        if channels[:self.n_channels] != self.channels or (len(channels) > self.n_channels
+                                                           and not self.grow_channels):
+            raise ValueError(f"Checkpoint channels {channels} do not match the engine's {self.channels}")
+        
+        def component(name):
+            prefix = name + '.'
+            return meta[name], {key[len(prefix):]: a for key, a in arrays.items() if key.startswith(prefix)}
+            
+        with self.lock:
+            if self.total_conversions or self._latest_ts is not None:
+                raise ValueError("restore_checkpoint_state needs an engine without state")
+            self._add_channels(channels[self.n_channels:])
+            if self._sparse:
+                self.transitions.restore(*component('transitions'))
+            else:
+                self.transitions = arrays['transitions']
+            self._channel_values = arrays['channel_values']
+            self._channel_conversions = arrays['channel_conversions']
+            self.total_conversions = meta['total_conversions']
+            if self._decay is None and self._window is None:
+                self.total_conversions = int(self.total_conversions)
+            self.total_value = meta['total_value']
+            self._latest_ts = meta['latest_ts']
+            if self._decay is not None:
+                self._decay.origin = meta['decay_origin']
+            components = {'shapley': self._shapley, 'higher': self._higher,
+                          'window': self._window, 'cube': self.cube, 'bootstrap': self._bootstrap}
+            for name, state in components.items():
+                if state is not None:
+                    state.restore(*component(name))
+            self._dirty_rows = np.ones(self.n_states, dtype=bool)
+            self._solver = self._new_solver()
+            
+    def _note_emitted(self, emitted_at: Optional[float], now: float):
+        if emitted_at is None:
+            return
+        self._event_age_hist.record(now - emitted_at)
+        if self._oldest_unscored is None or emitted_at < self._oldest_unscored:
+            self._oldest_unscored = emitted_at
+            
+    def _timed_process_conversion(self, touchpoints: List[str], value: float,
+                                  timestamp: Optional[float], emitted_at: Optional[float],
+                                  labels: Optional[Dict]):
+        # The untimed call below consumes one tick of the new countdown
+        self._sample_countdown = self._sample_every + 1
+        start = time.perf_counter()
+        self.process_conversion(touchpoints, value, timestamp, labels=labels)
+        self._ingest_hist.record(time.perf_counter() - start)
+        self._note_emitted(emitted_at, time.time())
+        
+    def _timed_process_conversions_batch(self, channel_idx: np.ndarray, offsets: np.ndarray,
+                                         values: np.ndarray, timestamps: Optional[np.ndarray] = None,
+                                         emitted_at: Optional[float] = None,
+                                         labels: Optional[Dict[str, np.ndarray]] = None):
+        start = time.perf_counter()
+        StreamingAttributionEngine.process_conversions_batch(self, channel_idx, offsets, values, timestamps,
+                                                             labels=labels)
+        self._ingest_hist.record(time.perf_counter() - start)
+        self._note_emitted(emitted_at, time.time())
+        
+    def _timed_get_current_scores(self) -> Dict:
+        start = time.perf_counter()
+        scores = StreamingAttributionEngine.get_current_scores(self)
+        self._scoring_hist.record(time.perf_counter() - start)
+        now = time.time()
+        oldest, self._oldest_unscored = self._oldest_unscored, None
+        if oldest is not None:
+            self._event_to_score_hist.record(now - oldest)
+        # Carried to the dashboard server for event-to-publish latency
+        scores['latency_marks'] = {'oldest_event_at': oldest, 'scored_at': now}
+        return scores
+        
     def get_current_scores(self) -> Dict:
         """
         Calculate and return current attribution scores.
         Uses removal effect for Markov-based channel importance.
+        
+        Only transition rows that changed since the previous call are
+        re-normalized; the solver folds them into its cached fundamental
+        matrix with a low-rank update. The sparse backend re-solves from a
+        CSR snapshot, warm-started from the previous solution. With
+        bootstrap replicates, all of them are solved in one batched inverse,
+        only after new conversions arrived.
         """
-        with self.lock:
-            if self.total_conversions == 0:
-                return {c: 0.0 for c in self.channels}
-                
-            # Compute Transition Probabilities
-            row_sums = self.transitions.sum(axis=1, keepdims=True)
-            # Avoid division by zero
-            safe_sums = np.where(row_sums == 0, 1, row_sums)
-            prob_matrix = self.transitions / safe_sums
-            
-            # Calculate Base Conversion Probability
-            # (Simplification: probability of reaching CONV from START)
-            # For real-time, we use the ratio of paths for now
-            return {
-                'total_conversions': self.total_conversions,
-                'total_value': self.total_value,
-                'attribution': self.channel_values,
-                'shares': {c: self.channel_values[c] / self.total_value if self.total_value > 0 else 0 
-                           for c in self.channels},
-                'timestamp': datetime.now().isoformat()
+        with self._score_lock:
+            with self.lock:
+                now = self._now()
+                if self._window is not None:
+                    self._expire(int(self._window.bucket_ids(now)))
+                scale = self._scale()
+                    
+                total_conversions = self.total_conversions
+                if self._decay is not None:
+                    total_conversions /= scale
+                total_value = self.total_value / scale
+                last_touch_values = self._channel_values / scale
+                channels = self.channels
+                if self.attribution_model == 'markov':
+                    solver = self._solver
+                    # Start and channel rows are the transient states
+                    dirty = np.flatnonzero(self._dirty_rows[:self.CONV_IDX])
+                    if self._higher is not None:
+                        higher_snapshot = self._higher.snapshot()
+                    elif self._sparse:
+                        snapshot = self.transitions.snapshot() if dirty.size else None
+                    else:
+                        dirty_counts = self.transitions[dirty]
+                    self._dirty_rows[:] = False
+                if self._shapley is not None:
+                    shapley_snapshot = self._shapley.snapshot()
+                bootstrap_version = None
+                if self._bootstrap is not None:
+                    bootstrap_version = self._bootstrap.version
+                    cached = self._bootstrap_result
+                    if cached is None or cached[0] != bootstrap_version:
+                        bootstrap_snapshot = self._bootstrap.snapshot()
+                    
+            last_touch = {
+                'attribution': dict(zip(channels, last_touch_values.tolist())),
+                'shares': self._shares(last_touch_values),
+            }
+            scores = {
+                'total_conversions': total_conversions,
+                'total_value': total_value,
+                'model': self.attribution_model,
+                'attribution': last_touch['attribution'],
+                'shares': last_touch['shares'],
+                'last_touch': last_touch,
             }
+            
+            if self.attribution_model == 'markov':
+                if self._higher is not None:
+                    conversion_probability, effects = self._higher.solve(higher_snapshot)
+                    scores['markov_order'] = self.markov_order
+                    scores['markov_states'] = len(higher_snapshot['keys'])
+                else:
+                    if self._sparse:
+                        if snapshot is not None:
+                            solver.update(*snapshot)
+                    else:
+                        solver.update(dirty, dirty_counts)
+                    conversion_probability = solver.conversion_probability
+                    effects = solver.removal_effects(conversion_probability)
+                weights = effects / effects.sum() if effects.sum() > 0 else effects
+                scores.update({
+                    'attribution': dict(zip(channels, (weights * total_value).tolist())),
+                    'shares': dict(zip(channels, weights.tolist())),
+                    'conversion_probability': conversion_probability,
+                    'removal_effects': dict(zip(channels, effects.tolist())),
+                })
+                
+            if self._shapley is not None:
+                # Permutation sampling runs outside the ingest lock
+                result = self._shapley.compute(shapley_snapshot)
+                with self.lock:
+                    self._shapley.remember(shapley_snapshot, result)
+                values = result['values'] / scale
+                shapley = {
+                    'attribution': dict(zip(self.channels, values.tolist())),
+                    'shares': self._shares(values),
+                    'method': result['method'],
+                    'ci95': dict(zip(self.channels, (result['ci95'] / scale).tolist())),
+                }
+                scores['shapley'] = shapley
+                if self.attribution_model == 'shapley':
+                    scores['attribution'] = shapley['attribution']
+                    scores['shares'] = shapley['shares']
+                    
+            if bootstrap_version is not None:
+                # Replicates are only re-solved after they changed
+                if cached is None or cached[0] != bootstrap_version:
+                    cached = (bootstrap_version, self._bootstrap.intervals(bootstrap_snapshot))
+                    self._bootstrap_result = cached
+                bounds = cached[1]
+                scores['bootstrap'] = {
+                    'replicates': self._bootstrap.n_replicates,
+                    'level': 0.95,
+                    'intervals': {c: (lo, hi) for c, lo, hi in
+                                  zip(channels, bounds['lower'].tolist(), bounds['upper'].tolist())},
+                    'conversion_probability': bounds['conversion_probability'],
+                    'confidence': bounds['confidence'],
+                }
+                
+            if self._decay is not None:
+                scores['decay_half_life'] = self._decay.half_life_seconds
+            if self._window is not None:
+                scores['window'] = {'mode': self.window_mode, 'seconds': self._window.window_seconds}
+                
+            scores['timestamp'] = datetime.now().isoformat()
+            return scores
+            
+    def get_dimensional_scores(self, by: Optional[object] = None, **filters) -> Dict:
+        """
+        Scores for a slice of the dimensional cube, or for every slice along
+        the dimension(s) in by, e.g. get_dimensional_scores(by='campaign')
+        or get_dimensional_scores(campaign='campaign_1', device='mobile').
+        """
+        if self.cube is None:
+            raise ValueError("Engine was created without dimensions")
+        if by is None:
+            return self.cube.scores(**filters)
+        return self.cube.rollup(by, **filters)
+        
+    def _shares(self, values: np.ndarray) -> Dict[str, float]:
+        total = values.sum()
+        shares = values / total if total > 0 else np.zeros_like(values)
+        return dict(zip(self.channels, shares.tolist()))
+
+
+def select_paths(channel_idx: np.ndarray, offsets: np.ndarray,
+                 selected: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Subset a ragged path batch (offsets starting at 0) by a boolean path mask."""
+    lengths = np.diff(offsets)
+    new_offsets = np.zeros(int(selected.sum()) + 1, dtype=np.int64)
+    np.cumsum(lengths[selected], out=new_offsets[1:])
+    return channel_idx[np.repeat(selected, lengths)], new_offsets
 
 if __name__ == "__main__":
     # Internal test
@@ -109,3 +1022,32 @@ if __name__ == "__main__":
     engine.process_conversion(["Search", "Display"], 100.0)
     engine.process_conversion(["Social", "Search", "Display"], 150.0)
     print(engine.get_current_scores())
+    
+    idx, offsets = engine.encode_paths([["Email", "Search"], ["Display"]])
+    engine.process_conversions_batch(idx, offsets, np.array([80.0, 20.0]))
+    print(engine.get_current_scores())
+    
+    shapley_engine = StreamingAttributionEngine(["Search", "Social", "Display", "Email"],
+                                                attribution_model='shapley')
+    shapley_engine.process_conversion(["Search", "Display"], 100.0)
+    shapley_engine.process_conversion(["Social", "Search", "Display"], 150.0)
+    print(shapley_engine.get_current_scores()['shapley'])
+    
+    now = time.time()
+    windowed = StreamingAttributionEngine(["Search", "Social", "Display", "Email"],
+                                          window_mode='sliding', window_seconds=60,
+                                          window_buckets=6, use_event_time=True)
+    windowed.process_conversion(["Search", "Display"], 100.0, timestamp=now - 120)
+    windowed.process_conversion(["Social", "Email"], 50.0, timestamp=now)
+    print(windowed.get_current_scores()['shares'])
+    
+    sparse = StreamingAttributionEngine(["Search", "Social"], transitions_backend='sparse',
+                                        grow_channels=True)
+    sparse.process_conversion(["Search", "Display"], 100.0)
+    sparse.process_conversion(["Social", "Search", "Display"], 150.0)
+    print(sparse.get_current_scores()['shares'])
+    
+    second_order = StreamingAttributionEngine(["Search", "Social", "Display", "Email"], markov_order=2)
+    second_order.process_conversion(["Display", "Search", "Email"], 100.0)
+    second_order.process_conversion(["Email", "Search", "Display"], 150.0)
+    print(second_order.get_current_scores()['shares'])
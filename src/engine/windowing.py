@@ -0,0 +1,157 @@
+"""
+Time Decay and Windowing
+========================
+
+Helpers that let StreamingAttributionEngine forget old conversions.
+
+- ExponentialDecay: lazy half-life decay. Each conversion is stored with
+  weight 2^((t - origin) / half_life), so newer events weigh more; scores
+  divide by the weight of "now". Nothing is rescaled per event, only when
+  weights grow large enough to threaten precision (rebase).
+- BucketRing: per-bucket deltas of the engine state for sliding and
+  tumbling windows. Expiring a bucket subtracts one bucket's arrays, so the
+  cost depends on the number of buckets, not on the number of paths.
+"""
+
+import os
+import sys
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from engine.shapley import decode_masks, encode_masks
+
+
+class ExponentialDecay:
+    """
+    Global-scale-factor exponential decay.
+    """
+
+    def __init__(self, half_life_seconds: float, rebase_threshold: float = 1e12):
+        """
+        Initialize decay.
+
+        Args:
+            half_life_seconds: Time for a conversion's weight to halve
+            rebase_threshold: Weight above which stored state is rescaled
+        """
+        if half_life_seconds <= 0:
+            raise ValueError("half_life_seconds must be positive")
+        self.half_life_seconds = half_life_seconds
+        self.rate = math.log(2) / half_life_seconds
+        self.rebase_threshold = rebase_threshold
+        self.origin: Optional[float] = None
+
+    def weight(self, timestamps: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Storage weight of events at the given time(s) relative to origin."""
+        if self.origin is None:
+            self.origin = float(np.max(timestamps))
+        return np.exp(self.rate * (np.asarray(timestamps, dtype=np.float64) - self.origin))
+
+    def needs_rebase(self, timestamp: float) -> bool:
+        return self.origin is not None and float(self.weight(timestamp)) > self.rebase_threshold
+
+    def rebase(self, timestamp: float) -> float:
+        """
+        Move the origin to timestamp.
+
+        Returns:
+            Factor the caller must multiply all stored state by
+        """
+        factor = 1.0 / float(self.weight(timestamp))
+        self.origin = timestamp
+        return factor
+
+
+class BucketRing:
+    """
+    Ring buffer of per-bucket engine state for windowed attribution.
+
+    A sliding window of W seconds uses n_buckets buckets of W / n_buckets
+    seconds each; a tumbling window is a single bucket of W seconds.
+    """
+
+    def __init__(self, window_seconds: float, n_buckets: int, n_states: int, n_channels: int):
+        if window_seconds <= 0 or n_buckets < 1:
+            raise ValueError("window_seconds must be positive and n_buckets >= 1")
+        self.window_seconds = window_seconds
+        self.n_buckets = n_buckets
+        self.bucket_seconds = window_seconds / n_buckets
+
+        self.transitions = np.zeros((n_buckets, n_states, n_states))
+        self.channel_values = np.zeros((n_buckets, n_channels))
+        self.channel_conversions = np.zeros((n_buckets, n_channels))
+        self.conversions = np.zeros(n_buckets)
+        self.values = np.zeros(n_buckets)
+        self.coalitions: List[Dict[int, float]] = [{} for _ in range(n_buckets)]
+
+        # Latest bucket id seen; buckets head - n_buckets + 1 .. head are live
+        self.head: Optional[int] = None
+
+    def bucket_ids(self, timestamps: Union[float, np.ndarray]) -> np.ndarray:
+        return np.floor_divide(np.asarray(timestamps, dtype=np.float64), self.bucket_seconds).astype(np.int64)
+
+    def slot(self, bucket_id: int) -> int:
+        return bucket_id % self.n_buckets
+
+    def is_live(self, bucket_id: int) -> bool:
+        return self.head is None or bucket_id > self.head - self.n_buckets
+
+    def advance(self, bucket_id: int) -> List[int]:
+        """
+        Move the head forward to bucket_id.
+
+        Returns:
+            Slots whose contents fell out of the window; the caller
+            subtracts them from its totals and then calls clear(slot)
+        """
+        if self.head is None:
+            self.head = bucket_id
+            return []
+        if bucket_id <= self.head:
+            return []
+        first = max(self.head + 1, bucket_id - self.n_buckets + 1)
+        self.head = bucket_id
+        return [self.slot(b) for b in range(first, bucket_id + 1)]
+
+    def checkpoint(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Copy of the ring as (meta, arrays); coalition masks via encode_masks."""
+        slots = [slot for slot, coalitions in enumerate(self.coalitions) for _ in coalitions]
+        masks = [mask for coalitions in self.coalitions for mask in coalitions]
+        arrays = {
+            'transitions': self.transitions.copy(),
+            'channel_values': self.channel_values.copy(),
+            'channel_conversions': self.channel_conversions.copy(),
+            'conversions': self.conversions.copy(),
+            'values': self.values.copy(),
+            'coalition_slots': np.array(slots, dtype=np.int64),
+            'coalition_values': np.array([v for c in self.coalitions for v in c.values()], dtype=np.float64),
+        }
+        meta = {'head': self.head, 'n_buckets': self.n_buckets, 'window_seconds': self.window_seconds}
+        meta['coalition_masks'] = encode_masks(masks, arrays)
+        return meta, arrays
+
+    def restore(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        if meta['n_buckets'] != self.n_buckets or meta['window_seconds'] != self.window_seconds:
+            raise ValueError("Checkpoint has a different window layout")
+        if arrays['transitions'].shape != self.transitions.shape:
+            raise ValueError("Checkpoint has a different channel count")
+        for name in ('transitions', 'channel_values', 'channel_conversions', 'conversions', 'values'):
+            getattr(self, name)[:] = arrays[name]
+        self.coalitions = [{} for _ in range(self.n_buckets)]
+        masks = decode_masks(meta['coalition_masks'], arrays)
+        for slot, mask, value in zip(arrays['coalition_slots'].tolist(), masks,
+                                     arrays['coalition_values'].tolist()):
+            self.coalitions[slot][mask] = value
+        self.head = meta['head']
+
+    def clear(self, slot: int):
+        self.transitions[slot] = 0.0
+        self.channel_values[slot] = 0.0
+        self.channel_conversions[slot] = 0.0
+        self.conversions[slot] = 0.0
+        self.values[slot] = 0.0
+        self.coalitions[slot] = {}
@@ -0,0 +1,196 @@
+"""
+Binary Event Records
+====================
+
+Fixed-width, columnar-friendly event files for recorded traffic.
+
+An event file is a 4096-byte header followed by packed EVENT_DTYPE records,
+one per event, in stream order. The header holds a magic line and a JSON
+description (channel/campaign/device names, record dtype). Conversion paths
+go to a sidecar file (<name>.paths) of PATH_DTYPE touchpoints; each
+conversion record points at its path with path_start/path_len, and paths are
+stored back to back in conversion order.
+
+Readers memory-map both files, so batches are NumPy views of the page cache
+with no parsing and no per-event objects.
+"""
+
+import os
+import json
+import numpy as np
+from typing import Dict, Iterator, List
+
+MAGIC = b'EVTREC1\n'
+HEADER_SIZE = 4096
+
+EVENT_DTYPE = np.dtype([
+    ('event_id', '<i8'),
+    ('timestamp', '<f8'),
+    ('user_id', '<i8'),
+    ('value', '<f8'),
+    ('path_start', '<i8'),
+    ('path_len', '<i4'),
+    ('click_delay_ms', '<i4'),
+    ('content_id', '<i4'),
+    ('campaign', '<i2'),
+    ('channel', '<i2'),
+    ('event_type', 'i1'),
+    ('device', 'i1'),
+])
+
+PATH_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('channel', '<i2'),
+])
+
+
+def paths_file(path: str) -> str:
+    return path + '.paths'
+
+
+class EventRecordWriter:
+    """
+    Append generate_batch() output to an event file and its path sidecar.
+
+    Usage:
+        with EventRecordWriter("events.bin", channels, campaigns, DEVICE_TYPES, EVENT_TYPES) as writer:
+            writer.write_batch(simulator.generate_batch(100000))
+    """
+
+    def __init__(self, path: str, channels: List[str], campaigns: List[str],
+                 devices: List[str], event_types: List[str]):
+        """
+        Create (truncate) an event file and its path sidecar.
+
+        Args:
+            path: Event file path; paths go to path + '.paths'
+            channels, campaigns, devices, event_types: Names for the
+                integer codes in the records, stored in the header
+        """
+        self.path = path
+        self.header = {
+            'version': 1,
+            'channels': list(channels),
+            'campaigns': list(campaigns),
+            'devices': list(devices),
+            'event_types': list(event_types),
+            'event_dtype': EVENT_DTYPE.descr,
+            'path_dtype': PATH_DTYPE.descr,
+        }
+        text = MAGIC + json.dumps(self.header).encode()
+        if len(text) > HEADER_SIZE:
+            raise ValueError("Header does not fit in HEADER_SIZE bytes")
+
+        self._events = open(path, 'wb')
+        self._events.write(text.ljust(HEADER_SIZE, b'\0'))
+        self._paths = open(paths_file(path), 'wb')
+        self.n_events = 0
+        self.n_touchpoints = 0
+
+    def write_batch(self, batch: Dict[str, np.ndarray]):
+        """Append one generate_batch result."""
+        n = len(batch['event_id'])
+        records = np.zeros(n, dtype=EVENT_DTYPE)
+        for field in ('event_id', 'timestamp', 'user_id', 'value', 'click_delay_ms',
+                      'content_id', 'campaign', 'channel', 'event_type', 'device'):
+            records[field] = batch[field]
+
+        # Conversions appear in the same order as their paths
+        offsets = batch['path_offsets']
+        conversions = np.flatnonzero(records['event_type'] == 2)
+        records['path_start'][conversions] = self.n_touchpoints + offsets[:-1]
+        records['path_len'][conversions] = np.diff(offsets)
+
+        touchpoints = np.empty(int(offsets[-1]), dtype=PATH_DTYPE)
+        touchpoints['channel'] = batch['path_channels']
+        touchpoints['timestamp'] = batch['path_timestamps']
+
+        self._events.write(records.tobytes())
+        self._paths.write(touchpoints.tobytes())
+        self.n_events += n
+        self.n_touchpoints += len(touchpoints)
+
+    def close(self):
+        self._events.close()
+        self._paths.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path: str) -> Dict:
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+    if not head.startswith(MAGIC):
+        raise ValueError(f"{path} is not an event record file")
+    return json.loads(head[len(MAGIC):].rstrip(b'\0'))
+
+
+class EventRecordReader:
+    """
+    Memory-mapped view of an event file and its path sidecar.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = read_header(path)
+        if np.dtype([tuple(f) for f in self.header['event_dtype']]) != EVENT_DTYPE:
+            raise ValueError(f"{path} uses an unsupported record layout")
+        self.channels: List[str] = self.header['channels']
+        self.campaigns: List[str] = self.header['campaigns']
+        self.devices: List[str] = self.header['devices']
+        self.event_types: List[str] = self.header['event_types']
+
+        # A file still being written may end in a partial record
+        n_events = (os.path.getsize(path) - HEADER_SIZE) // EVENT_DTYPE.itemsize
+        n_touchpoints = os.path.getsize(paths_file(path)) // PATH_DTYPE.itemsize
+        self.events = self._map(path, EVENT_DTYPE, HEADER_SIZE, n_events)
+        self.touchpoints = self._map(paths_file(path), PATH_DTYPE, 0, n_touchpoints)
+
+    @staticmethod
+    def _map(path: str, dtype: np.dtype, offset: int, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    @property
+    def time_span(self) -> float:
+        """Seconds between the first and last recorded event."""
+        if len(self.events) == 0:
+            return 0.0
+        return float(self.events['timestamp'][-1] - self.events['timestamp'][0])
+
+    def iter_batches(self, batch_size: int = 1000000) -> Iterator[np.ndarray]:
+        """Consecutive record views of up to batch_size events."""
+        for start in range(0, len(self.events), batch_size):
+            yield self.events[start:start + batch_size]
+
+    def conversion_paths(self, records: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Conversions of a record batch as engine batch arguments.
+
+        Returns:
+            Dict with channel_idx (the sidecar's channel column, a view) and
+            offsets into it, plus values, timestamps, user_ids and
+            campaign/device codes (last touch, -1 if unknown) per path
+        """
+        conversions = records[records['event_type'] == 2]
+        starts = conversions['path_start']
+        offsets = np.empty(len(conversions) + 1, dtype=np.int64)
+        offsets[:-1] = starts
+        offsets[-1] = starts[-1] + conversions['path_len'][-1] if len(conversions) else 0
+        return {
+            'channel_idx': self.touchpoints['channel'],
+            'offsets': offsets,
+            'values': conversions['value'],
+            'timestamps': conversions['timestamp'],
+            'user_ids': conversions['user_id'],
+            'campaigns': conversions['campaign'],
+            'devices': conversions['device'],
+        }
@@ -9,18 +9,35 @@ Features:
 - Multiple campaigns running in parallel
 - Session-based user journeys
 - Conversion events with attribution touchpoints
+- Vectorized batch mode (generate_batch) for 200K+ events/sec on one core
 
 Author: Michael Robins
 Date: January 31, 2026
 """
 
+import os
+import sys
 import time
 import json
 import random
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 import argparse
 
+import numpy as np
+
+# Add parent dir to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from simulator.session_store import SessionStore
+from simulator.binary_format import EventRecordWriter
+
+EVENT_TYPES = ['impression', 'click', 'conversion']
+EVENT_WEIGHTS = [0.90, 0.08, 0.02]
+DEVICE_TYPES = ['TV', 'Mobile', 'Desktop', 'Tablet']
+# generate_batch applies events in causal steps of this many events
+SUBSTEP_EVENTS = 4096
+
 
 class EventStreamSimulator:
     """
@@ -33,7 +50,11 @@ class EventStreamSimulator:
         self,
         events_per_second: int = 1000,
         n_campaigns: int = 5,
-        n_channels: int = 4
+        n_channels: int = 4,
+        seed: Optional[int] = None,
+        session_ttl: Optional[float] = 1800.0,
+        max_sessions: Optional[int] = 1000000,
+        instrument: bool = False
     ):
         """
         Initialize event simulator.
@@ -42,6 +63,11 @@ class EventStreamSimulator:
             events_per_second: Target event rate
             n_campaigns: Number of active campaigns
             n_channels: Number of attribution channels
+            seed: Random seed for reproducible streams
+            session_ttl: Seconds of inactivity before a session expires
+            max_sessions: Cap on open sessions (least recently used evicted)
+            instrument: Stamp events with their wall-clock generation time
+                ('emitted_at') for end-to-end latency measurement
         """
         self.events_per_second = events_per_second
         self.n_campaigns = n_campaigns
@@ -50,34 +76,46 @@ class EventStreamSimulator:
         self.campaigns = [f"campaign_{i:03d}" for i in range(n_campaigns)]
         self.channels = ["Search", "Social", "Display", "Email"][:n_channels]
 
-        # Active sessions (user_id -> session_data)
-        self.active_sessions = {}
+        self._random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.instrument = instrument
+
+        # Active sessions, keyed by integer user id ("user_1234567" -> 1234567)
+        self.sessions = SessionStore(ttl_seconds=session_ttl, max_sessions=max_sessions)
 
         # Event counter
         self.total_events = 0
+        # Event time after the last generated batch
+        self._next_timestamp = 0.0
 
     def generate_user_session(self) -> str:
         """Generate unique user session ID."""
-        return f"user_{random.randint(1000000, 9999999)}"
+        return f"user_{self._random.randint(1000000, 9999999)}"
+
+    def _session_slot(self, user_id: str) -> int:
+        """Slot of the user's active session, -1 if none."""
+        return self.sessions.index.get(int(user_id[5:]))
+
+    def random_active_user(self) -> Optional[str]:
+        """Pick a random user with an active session in O(1)."""
+        slot = self.sessions.random_slot(self._random)
+        if slot < 0:
+            return None
+        return f"user_{self.sessions.user_ids[slot]}"
 
     def generate_impression_event(self) -> Dict:
         """Generate impression event."""
         user_id = self.generate_user_session()
-        campaign = random.choice(self.campaigns)
-        channel = random.choice(self.channels)
+        campaign_idx = self._random.randrange(len(self.campaigns))
+        campaign = self.campaigns[campaign_idx]
+        channel_idx = self._random.randrange(len(self.channels))
+        channel = self.channels[channel_idx]
+        device_idx = self._random.randrange(len(DEVICE_TYPES))
+        ts = time.time()
+        now = datetime.fromtimestamp(ts)
 
         # Start new session or continue existing
-        if user_id not in self.active_sessions:
-            self.active_sessions[user_id] = {
-                'touchpoints': [],
-                'start_time': time.time()
-            }
-
-        # Add touchpoint
-        self.active_sessions[user_id]['touchpoints'].append({
-            'channel': channel,
-            'timestamp': time.time()
-        })
+        self.sessions.touch(int(user_id[5:]), channel_idx, ts, campaign_idx, device_idx)
 
         event = {
             'event_id': f"evt_{self.total_events:012d}",
@@ -85,78 +123,264 @@ class EventStreamSimulator:
             'user_id': user_id,
             'campaign_id': campaign,
             'channel': channel,
-            'timestamp': datetime.now().isoformat(),
-            'session_id': f"session_{user_id}_{int(time.time())}",
-            'device_type': random.choice(['TV', 'Mobile', 'Desktop', 'Tablet']),
-            'content_id': f"content_{random.randint(1, 1000)}",
+            'timestamp': now.isoformat(),
+            'session_id': f"session_{user_id}_{int(ts)}",
+            'device_type': DEVICE_TYPES[device_idx],
+            'content_id': f"content_{self._random.randint(1, 1000)}",
             'metadata': {
-                'hour_of_day': datetime.now().hour,
-                'day_of_week': datetime.now().weekday()
+                'hour_of_day': now.hour,
+                'day_of_week': now.weekday()
             }
         }
+        if self.instrument:
+            event['emitted_at'] = time.time()
 
         self.total_events += 1
         return event
 
     def generate_click_event(self, user_id: str) -> Optional[Dict]:
         """Generate click event (follows impression)."""
-        if user_id not in self.active_sessions:
-            return None
-
-        session = self.active_sessions[user_id]
-        if not session['touchpoints']:
+        slot = self._session_slot(user_id)
+        if slot < 0:
             return None
 
         # Click on most recent touchpoint
-        last_touchpoint = session['touchpoints'][-1]
+        last_channel, last_ts = self.sessions.last_touchpoints(np.array([slot]))
+        ts = time.time()
 
         event = {
             'event_id': f"evt_{self.total_events:012d}",
             'event_type': 'click',
             'user_id': user_id,
-            'channel': last_touchpoint['channel'],
-            'timestamp': datetime.now().isoformat(),
-            'click_delay_ms': int((time.time() - last_touchpoint['timestamp']) * 1000)
+            'channel': self.channels[last_channel[0]],
+            'timestamp': datetime.fromtimestamp(ts).isoformat(),
+            'click_delay_ms': int((ts - last_ts[0]) * 1000)
         }
+        if self.instrument:
+            event['emitted_at'] = time.time()
 
         self.total_events += 1
         return event
 
     def generate_conversion_event(self, user_id: str) -> Optional[Dict]:
         """Generate conversion event."""
-        if user_id not in self.active_sessions:
-            return None
-
-        session = self.active_sessions[user_id]
-        if not session['touchpoints']:
+        slot = self._session_slot(user_id)
+        if slot < 0:
             return None
 
         # Conversion value
-        conversion_value = random.uniform(10, 500)
+        conversion_value = self._random.uniform(10, 500)
+        ts = time.time()
+
+        # Close session
+        session = self.sessions.pop_batch(np.array([slot]))
 
         event = {
             'event_id': f"evt_{self.total_events:012d}",
             'event_type': 'conversion',
             'user_id': user_id,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.fromtimestamp(ts).isoformat(),
             'conversion_value': conversion_value,
             'attribution_touchpoints': [
-                {'channel': tp['channel'], 'timestamp': tp['timestamp']}
-                for tp in session['touchpoints']
+                {'channel': self.channels[c], 'timestamp': t}
+                for c, t in zip(session['path_channels'].tolist(), session['path_timestamps'].tolist())
             ],
-            'session_duration_sec': time.time() - session['start_time']
+            'session_duration_sec': ts - float(session['start_time'][0])
         }
-
-        # Clear session
-        del self.active_sessions[user_id]
+        # Campaign and device of the last touch
+        if session['campaign'][0] >= 0:
+            event['campaign_id'] = self.campaigns[session['campaign'][0]]
+        if session['device'][0] >= 0:
+            event['device_type'] = DEVICE_TYPES[session['device'][0]]
+        if self.instrument:
+            event['emitted_at'] = time.time()
 
         self.total_events += 1
         return event
 
+    def generate_batch(self, n_events: int, start_time: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Generate a batch of events as columns, drawing everything with NumPy.
+
+        Event types follow the same 90/8/2 impression/click/conversion mix.
+        Events are applied in steps of SUBSTEP_EVENTS: a step's clicks and
+        conversions pick uniformly among the sessions active when the step
+        starts (conversions without replacement), then its impressions open
+        or extend sessions. Every touchpoint a click or conversion sees is
+        therefore earlier than the event itself; sessions opened within a
+        step become eligible from the next one. Event time continues from
+        the previous batch when that ran ahead of the wall clock.
+
+        Args:
+            n_events: Number of events to draw
+            start_time: Timestamp of the first event (default: now, or the
+                end of the previous batch if later); events are spaced at
+                the target rate
+
+        Returns:
+            Dict of equal-length columns (event_id, event_type as an index
+            into EVENT_TYPES, user_id, campaign, channel, device, content_id,
+            timestamp, value, click_delay_ms; -1/0 where not applicable;
+            conversions carry their session's last-touch campaign and
+            device) plus the conversions' paths as path_channels/path_timestamps/
+            path_offsets, in conversion order (and emitted_at, the batch's
+            wall-clock generation time, when instrumented)
+        """
+        rng = self.rng
+        if start_time is None:
+            start_time = max(time.time(), self._next_timestamp)
+        rate = self.events_per_second or n_events or 1
+
+        event_type = rng.choice(3, size=n_events, p=EVENT_WEIGHTS).astype(np.int8)
+        timestamp = start_time + np.arange(n_events) / rate
+        self._next_timestamp = start_time + n_events / rate
+        user_id = np.zeros(n_events, dtype=np.int64)
+        campaign = np.full(n_events, -1, dtype=np.int16)
+        channel = np.full(n_events, -1, dtype=np.int16)
+        device = np.full(n_events, -1, dtype=np.int8)
+        content_id = np.zeros(n_events, dtype=np.int32)
+        value = np.zeros(n_events)
+        click_delay_ms = np.zeros(n_events, dtype=np.int64)
+
+        imp = np.flatnonzero(event_type == 0)
+        user_id[imp] = rng.integers(1000000, 10000000, size=len(imp))
+        campaign[imp] = rng.integers(0, self.n_campaigns, size=len(imp))
+        channel[imp] = rng.integers(0, self.n_channels, size=len(imp))
+        device[imp] = rng.integers(0, len(DEVICE_TYPES), size=len(imp))
+        content_id[imp] = rng.integers(1, 1001, size=len(imp))
+        clk_all = np.flatnonzero(event_type == 1)
+        conv_all = np.flatnonzero(event_type == 2)
+
+        bounds = np.append(np.arange(0, max(n_events, 1), SUBSTEP_EVENTS), n_events)
+        imp_at = np.searchsorted(imp, bounds)
+        clk_at = np.searchsorted(clk_all, bounds)
+        conv_at = np.searchsorted(conv_all, bounds)
+        kept_clk, kept_conv, closed_parts = [], [], []
+        for i in range(len(bounds) - 1):
+            # Clicks: on the latest touchpoint of a random active session
+            clk = clk_all[clk_at[i]:clk_at[i + 1]]
+            slots = self.sessions.random_slots(len(clk), rng)
+            clk = clk[:len(slots)]
+            user_id[clk] = self.sessions.user_ids[slots]
+            last_channel, last_ts = self.sessions.last_touchpoints(slots)
+            channel[clk] = last_channel
+            click_delay_ms[clk] = ((timestamp[clk] - last_ts) * 1000).astype(np.int64)
+            kept_clk.append(clk)
+
+            # Conversions: close distinct random sessions
+            conv = conv_all[conv_at[i]:conv_at[i + 1]]
+            slots = self.sessions.random_slots(len(conv), rng, distinct=True)
+            conv = conv[:len(slots)]
+            closed_parts.append(self.sessions.pop_batch(slots))
+            kept_conv.append(conv)
+
+            # Impressions: open or extend sessions
+            step = imp[imp_at[i]:imp_at[i + 1]]
+            self.sessions.touch_batch(user_id[step], channel[step], timestamp[step],
+                                      campaign[step], device[step])
+
+        clk = np.concatenate(kept_clk)
+        conv = np.concatenate(kept_conv)
+        closed = {key: np.concatenate([part[key] for part in closed_parts])
+                  for key in ('path_channels', 'path_timestamps', 'user_id', 'start_time', 'campaign', 'device')}
+        closed['path_offsets'] = np.zeros(len(conv) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate([np.diff(part['path_offsets']) for part in closed_parts]),
+                  out=closed['path_offsets'][1:])
+        user_id[conv] = closed['user_id']
+        campaign[conv] = closed['campaign']
+        device[conv] = closed['device']
+        value[conv] = rng.uniform(10, 500, size=len(conv))
+
+        # Drop clicks/conversions that found no session
+        keep = np.zeros(n_events, dtype=bool)
+        keep[imp] = True
+        keep[clk] = True
+        keep[conv] = True
+        n_kept = int(keep.sum())
+        event_id = self.total_events + np.arange(n_kept, dtype=np.int64)
+        self.total_events += n_kept
+
+        batch = {
+            'event_id': event_id,
+            'event_type': event_type[keep],
+            'user_id': user_id[keep],
+            'campaign': campaign[keep],
+            'channel': channel[keep],
+            'device': device[keep],
+            'content_id': content_id[keep],
+            'timestamp': timestamp[keep],
+            'value': value[keep],
+            'click_delay_ms': click_delay_ms[keep],
+            'path_channels': closed['path_channels'],
+            'path_timestamps': closed['path_timestamps'],
+            'path_offsets': closed['path_offsets'],
+            'session_start': closed['start_time'],
+        }
+        if self.instrument:
+            batch['emitted_at'] = time.time()
+        return batch
+
+    def iter_events(self, batch: Dict[str, np.ndarray]) -> Iterator[Dict]:
+        """Expand a generate_batch result into the per-event dict format."""
+        columns = {k: batch[k].tolist() for k in (
+            'event_id', 'event_type', 'user_id', 'campaign', 'channel', 'device',
+            'content_id', 'timestamp', 'value', 'click_delay_ms'
+        )}
+        offsets = batch['path_offsets'].tolist()
+        path_channels = batch['path_channels'].tolist()
+        path_timestamps = batch['path_timestamps'].tolist()
+        session_start = batch['session_start'].tolist()
+        n_conversion = 0
+
+        for i in range(len(columns['event_id'])):
+            kind = EVENT_TYPES[columns['event_type'][i]]
+            ts = columns['timestamp'][i]
+            event = {
+                'event_id': f"evt_{columns['event_id'][i]:012d}",
+                'event_type': kind,
+                'user_id': f"user_{columns['user_id'][i]}",
+            }
+            if kind == 'impression':
+                now = datetime.fromtimestamp(ts)
+                event.update({
+                    'campaign_id': self.campaigns[columns['campaign'][i]],
+                    'channel': self.channels[columns['channel'][i]],
+                    'timestamp': now.isoformat(),
+                    'session_id': f"session_{event['user_id']}_{int(ts)}",
+                    'device_type': DEVICE_TYPES[columns['device'][i]],
+                    'content_id': f"content_{columns['content_id'][i]}",
+                    'metadata': {'hour_of_day': now.hour, 'day_of_week': now.weekday()}
+                })
+            elif kind == 'click':
+                event.update({
+                    'channel': self.channels[columns['channel'][i]],
+                    'timestamp': datetime.fromtimestamp(ts).isoformat(),
+                    'click_delay_ms': columns['click_delay_ms'][i]
+                })
+            else:
+                a, b = offsets[n_conversion], offsets[n_conversion + 1]
+                event.update({
+                    'timestamp': datetime.fromtimestamp(ts).isoformat(),
+                    'conversion_value': columns['value'][i],
+                    'attribution_touchpoints': [
+                        {'channel': self.channels[c], 'timestamp': t}
+                        for c, t in zip(path_channels[a:b], path_timestamps[a:b])
+                    ],
+                    'session_duration_sec': ts - session_start[n_conversion]
+                })
+                if columns['campaign'][i] >= 0:
+                    event['campaign_id'] = self.campaigns[columns['campaign'][i]]
+                if columns['device'][i] >= 0:
+                    event['device_type'] = DEVICE_TYPES[columns['device'][i]]
+                n_conversion += 1
+            yield event
+
     def simulate_events(
         self,
         duration_seconds: int = 60,
-        output_file: Optional[str] = None
+        output_file: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        output_format: str = 'jsonl'
     ):
         """
         Simulate event stream for specified duration.
@@ -164,7 +388,20 @@ class EventStreamSimulator:
         Args:
             duration_seconds: How long to simulate
             output_file: Optional file to write events to
+            batch_size: Use vectorized batch generation with this many
+                events per batch
+            output_format: 'jsonl' or 'binary' (fixed-width records, see
+                simulator/binary_format.py; implies batch mode)
         """
+        if output_format not in ('jsonl', 'binary'):
+            raise ValueError(f"Unknown output format: {output_format}")
+        if output_format == 'binary':
+            if not output_file:
+                raise ValueError("Binary output needs an output file")
+            batch_size = batch_size or 100000
+        if batch_size:
+            return self._simulate_batches(duration_seconds, output_file, batch_size, output_format)
+
         print(f"Starting event stream simulation...")
         print(f"  Target rate: {self.events_per_second} events/sec")
         print(f"  Duration: {duration_seconds} seconds")
@@ -186,30 +423,25 @@ class EventStreamSimulator:
 
                 for _ in range(self.events_per_second):
                     # Most events are impressions
-                    event_type = random.choices(
-                        ['impression', 'click', 'conversion'],
-                        weights=[0.90, 0.08, 0.02]
-                    )[0]
+                    event_type = self._random.choices(EVENT_TYPES, weights=EVENT_WEIGHTS)[0]
 
                     if event_type == 'impression':
                         event = self.generate_impression_event()
                     elif event_type == 'click':
                         # Click on random active session
-                        if self.active_sessions:
-                            user_id = random.choice(list(self.active_sessions.keys()))
-                            event = self.generate_click_event(user_id)
-                            if event is None:
-                                continue
-                        else:
+                        user_id = self.random_active_user()
+                        if user_id is None:
+                            continue
+                        event = self.generate_click_event(user_id)
+                        if event is None:
                             continue
                     else:  # conversion
                         # Convert random active session
-                        if self.active_sessions:
-                            user_id = random.choice(list(self.active_sessions.keys()))
-                            event = self.generate_conversion_event(user_id)
-                            if event is None:
-                                continue
-                        else:
+                        user_id = self.random_active_user()
+                        if user_id is None:
+                            continue
+                        event = self.generate_conversion_event(user_id)
+                        if event is None:
                             continue
 
                     # Output event
@@ -232,7 +464,7 @@ class EventStreamSimulator:
                     actual_rate = events_generated / elapsed
                     print(f"[{int(elapsed)}s] Generated: {events_generated:,} events "
                           f"| Rate: {actual_rate:.0f}/sec | "
-                          f"Active sessions: {len(self.active_sessions)}")
+                          f"Active sessions: {len(self.sessions)}")
 
         finally:
             if file_handle:
@@ -246,7 +478,68 @@ class EventStreamSimulator:
         print(f"  Total events: {events_generated:,}")
         print(f"  Duration: {elapsed:.1f} seconds")
         print(f"  Average rate: {actual_rate:.0f} events/sec")
-        print(f"  Final active sessions: {len(self.active_sessions)}")
+        print(f"  Final active sessions: {len(self.sessions)}")
+        self._print_session_usage()
+
+    def _print_session_usage(self):
+        usage = self.sessions.memory_usage()
+        print(f"  Session store: {usage['total_bytes'] / 1e6:.1f} MB "
+              f"({usage['capacity']:,} slots) | Expired: {self.sessions.expired_total:,} "
+              f"| Evicted: {self.sessions.evicted_total:,}")
+
+    def _simulate_batches(self, duration_seconds: int, output_file: Optional[str],
+                          batch_size: int, output_format: str = 'jsonl'):
+        """Batch-mode simulate_events: rate-limited generate_batch calls."""
+        print(f"Starting batch event stream simulation...")
+        print(f"  Target rate: {self.events_per_second or 'unthrottled'} events/sec")
+        print(f"  Batch size: {batch_size:,}")
+        print(f"  Duration: {duration_seconds} seconds")
+        print()
+
+        file_handle = writer = None
+        if output_file and output_format == 'binary':
+            writer = EventRecordWriter(output_file, self.channels, self.campaigns,
+                                       DEVICE_TYPES, EVENT_TYPES)
+        elif output_file:
+            file_handle = open(output_file, 'w')
+        start_time = time.time()
+        events_generated = 0
+        next_report = 10
+
+        try:
+            while (time.time() - start_time) < duration_seconds:
+                batch = self.generate_batch(batch_size)
+                events_generated += len(batch['event_id'])
+                if writer:
+                    writer.write_batch(batch)
+                elif file_handle:
+                    file_handle.writelines(json.dumps(e) + '\n' for e in self.iter_events(batch))
+
+                elapsed = time.time() - start_time
+                if self.events_per_second:
+                    # Sleep to maintain rate
+                    ahead = events_generated / self.events_per_second - elapsed
+                    if ahead > 0:
+                        time.sleep(ahead)
+                if elapsed >= next_report:
+                    print(f"[{int(elapsed)}s] Generated: {events_generated:,} events "
+                          f"| Rate: {events_generated / elapsed:.0f}/sec | "
+                          f"Active sessions: {len(self.sessions)}")
+                    next_report += 10
+        finally:
+            if writer:
+                writer.close()
+            if file_handle:
+                file_handle.close()
+
+        elapsed = time.time() - start_time
+        print()
+        print("Simulation complete:")
+        print(f"  Total events: {events_generated:,}")
+        print(f"  Duration: {elapsed:.1f} seconds")
+        print(f"  Average rate: {events_generated / elapsed:.0f} events/sec")
+        print(f"  Final active sessions: {len(self.sessions)}")
+        self._print_session_usage()
 
 
 if __name__ == "__main__":
@@ -261,16 +554,31 @@ if __name__ == "__main__":
                        help='Number of campaigns (default: 5)')
     parser.add_argument('--channels', type=int, default=4,
                        help='Number of channels (default: 4)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                       help='Vectorized batch mode with this many events per batch')
+    parser.add_argument('--seed', type=int, default=None,
+                       help='Random seed for a reproducible stream')
+    parser.add_argument('--format', choices=['jsonl', 'binary'], default='jsonl',
+                       help='Output format; binary writes fixed-width records (default: jsonl)')
+    parser.add_argument('--session-ttl', type=float, default=1800.0,
+                       help='Session inactivity timeout in seconds (default: 1800)')
+    parser.add_argument('--max-sessions', type=int, default=1000000,
+                       help='Cap on open sessions, LRU evicted (default: 1000000)')
 
     args = parser.parse_args()
 
     simulator = EventStreamSimulator(
         events_per_second=args.rate,
         n_campaigns=args.campaigns,
-        n_channels=args.channels
+        n_channels=args.channels,
+        seed=args.seed,
+        session_ttl=args.session_ttl,
+        max_sessions=args.max_sessions
     )
 
     simulator.simulate_events(
         duration_seconds=args.duration,
-        output_file=args.output
+        output_file=args.output,
+        batch_size=args.batch_size,
+        output_format=args.format
     )
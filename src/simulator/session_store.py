@@ -0,0 +1,573 @@
+"""
+Session Store
+=============
+
+Compact, bounded store of active user sessions.
+
+- Sessions live in fixed slots of preallocated arrays. Touchpoints are kept
+  per slot as a ring of the last max_touchpoints channel indices (int16)
+  and offsets from the session start (float32); there are no per-touchpoint
+  Python objects.
+- User ids map to slots through an open-addressing int64 hash table, so a
+  whole batch is looked up or inserted with a few vectorized probes.
+- A dense array of active slots with a position index gives O(1) uniform
+  random pick and O(1) swap-remove delete, also in bulk.
+- Sessions expire after ttl_seconds without a touchpoint (the 30-minute
+  session window). Expiry is driven by a timer wheel of tick buckets; the
+  same wheel yields least-recently-used sessions when max_sessions is
+  reached.
+"""
+
+import array
+import collections
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+EMPTY = -1
+DELETED = -2
+
+
+class IntHashIndex:
+    """
+    Open-addressing int64 -> int64 map (linear probing) with vectorized
+    lookup, insert and delete. Keys must be non-negative.
+    """
+
+    def __init__(self, capacity: int = 1024, max_load: float = 0.5):
+        self.max_load = max_load
+        self._init_table(capacity)
+
+    def _init_table(self, capacity: int):
+        size = 1 << max(4, int(np.ceil(np.log2(max(capacity, 1) / self.max_load))))
+        self.keys = np.full(size, EMPTY, dtype=np.int64)
+        self.values = np.zeros(size, dtype=np.int64)
+        self.mask = size - 1
+        self.shift = np.uint64(64 - int(np.log2(size)))
+        self.used = 0
+        self.deleted = 0
+
+    def __len__(self) -> int:
+        return self.used
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.values.nbytes
+
+    def _hash(self, keys: np.ndarray) -> np.ndarray:
+        mixed = keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        return (mixed >> self.shift).astype(np.int64)
+
+    def _find(self, keys: np.ndarray) -> np.ndarray:
+        """Table position of each key, -1 if absent."""
+        pos = self._hash(keys)
+        found = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.arange(len(keys))
+        while pending.size:
+            p = pos[pending]
+            k = self.keys[p]
+            hit = k == keys[pending]
+            found[pending[hit]] = p[hit]
+            pending = pending[~(hit | (k == EMPTY))]
+            pos[pending] = (pos[pending] + 1) & self.mask
+        return found
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Value of each key, -1 if absent."""
+        found = self._find(keys)
+        result = np.full(len(keys), -1, dtype=np.int64)
+        hit = found >= 0
+        result[hit] = self.values[found[hit]]
+        return result
+
+    def get(self, key: int) -> int:
+        """Scalar lookup, -1 if absent."""
+        pos = self._position(key)
+        return int(self.values[pos]) if pos >= 0 else -1
+
+    def _position(self, key: int) -> int:
+        keys = self.keys
+        pos = ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> int(self.shift)
+        while True:
+            k = int(keys[pos])
+            if k == key:
+                return pos
+            if k == EMPTY:
+                return -1
+            pos = (pos + 1) & self.mask
+
+    def put(self, key: int, value: int):
+        """Scalar insert of a key that is not already present."""
+        if self.used + self.deleted + 1 > self.max_load * len(self.keys):
+            self._rehash(self.used + 1)
+        keys = self.keys
+        pos = ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> int(self.shift)
+        while keys[pos] >= 0:
+            pos = (pos + 1) & self.mask
+        if keys[pos] == DELETED:
+            self.deleted -= 1
+        keys[pos] = key
+        self.values[pos] = value
+        self.used += 1
+
+    def insert(self, keys: np.ndarray, values: np.ndarray):
+        """Insert distinct keys that are not already present."""
+        if (self.used + self.deleted + len(keys)) > self.max_load * len(self.keys):
+            self._rehash(self.used + len(keys))
+        pos = self._hash(keys)
+        pending = np.arange(len(keys))
+        while pending.size:
+            p = pos[pending]
+            free = self.keys[p] < 0
+            candidates = pending[free]
+            # One winner per free position; the rest probe on
+            _, first = np.unique(pos[candidates], return_index=True)
+            winners = candidates[first]
+            target = pos[winners]
+            self.deleted -= int((self.keys[target] == DELETED).sum())
+            self.keys[target] = keys[winners]
+            self.values[target] = values[winners]
+            placed = np.zeros(len(keys), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            pos[pending] = (pos[pending] + 1) & self.mask
+        self.used += len(keys)
+
+    def delete(self, keys: np.ndarray):
+        found = self._find(keys)
+        found = found[found >= 0]
+        self.keys[found] = DELETED
+        self.used -= len(found)
+        self.deleted += len(found)
+
+    def _rehash(self, capacity: int):
+        live = self.keys >= 0
+        keys, values = self.keys[live], self.values[live]
+        self._init_table(max(capacity, 2 * len(keys)))
+        if len(keys):
+            self.insert(keys, values)
+
+
+class SessionStore:
+    """
+    Active sessions keyed by integer user id.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = 1800.0,
+        max_sessions: Optional[int] = None,
+        max_touchpoints: int = 16,
+        tick_seconds: float = 1.0,
+        capacity: int = 1024
+    ):
+        """
+        Initialize session store.
+
+        Args:
+            ttl_seconds: Inactivity timeout; None keeps sessions until popped
+            max_sessions: Hard cap; least recently used sessions are evicted
+            max_touchpoints: Touchpoints kept per session (the most recent)
+            tick_seconds: Timer wheel granularity for expiry and eviction
+            capacity: Initial slot capacity (grows up to max_sessions)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_touchpoints = max_touchpoints
+        self.tick_seconds = tick_seconds
+
+        self._capacity = 0
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.start_time = np.zeros(0)
+        self.last_seen = np.zeros(0)
+        self.n_touch = np.zeros(0, dtype=np.int32)
+        self.tp_channel = np.zeros((0, max_touchpoints), dtype=np.int16)
+        self.tp_offset = np.zeros((0, max_touchpoints), dtype=np.float32)
+        # Campaign and device codes of each session's latest touch (-1: none)
+        self.last_campaign = np.zeros(0, dtype=np.int16)
+        self.last_device = np.zeros(0, dtype=np.int8)
+        self._generation = np.zeros(0, dtype=np.uint32)
+        self._tick_of = np.zeros(0, dtype=np.int64)
+        self._alive = np.zeros(0, dtype=bool)
+        # Dense list of active slots and each slot's position in it
+        self._active = np.zeros(0, dtype=np.int64)
+        self._pos = np.zeros(0, dtype=np.int64)
+        self._n_active = 0
+        # Stack of free slots below _next_slot
+        self._free = np.zeros(0, dtype=np.int64)
+        self._n_free = 0
+        self._next_slot = 0
+        self.index = IntHashIndex(capacity)
+
+        # Timer wheel, oldest first: [tick, [slot arrays], [generation arrays],
+        # scalar slots, scalar generations] (scalars come from touch())
+        self._wheel = collections.deque()
+        self._now = None
+
+        self.expired_total = 0
+        self.evicted_total = 0
+
+        self._grow(min(capacity, max_sessions) if max_sessions else capacity)
+
+    def __len__(self) -> int:
+        return self._n_active
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.index.get(int(user_id)) >= 0
+
+    def _grow(self, capacity: int):
+        extra = capacity - self._capacity
+        if extra <= 0:
+            return
+
+        def extend(arr, fill=0):
+            pad = np.full((extra,) + arr.shape[1:], fill, dtype=arr.dtype)
+            return np.concatenate((arr, pad))
+
+        self.user_ids = extend(self.user_ids)
+        self.start_time = extend(self.start_time)
+        self.last_seen = extend(self.last_seen)
+        self.n_touch = extend(self.n_touch)
+        self.tp_channel = extend(self.tp_channel)
+        self.tp_offset = extend(self.tp_offset)
+        self.last_campaign = extend(self.last_campaign, -1)
+        self.last_device = extend(self.last_device, -1)
+        self._generation = extend(self._generation)
+        self._tick_of = extend(self._tick_of)
+        self._alive = extend(self._alive, False)
+        self._active = extend(self._active)
+        self._pos = extend(self._pos)
+        self._free = extend(self._free)
+        self._capacity = capacity
+
+    def _allocate(self, count: int) -> np.ndarray:
+        if self.max_sessions is not None:
+            if count > self.max_sessions:
+                raise ValueError(f"{count} new sessions exceed max_sessions={self.max_sessions}")
+            overflow = self._n_active + count - self.max_sessions
+            if overflow > 0:
+                self._evict(overflow)
+        reused = min(count, self._n_free)
+        slots = self._free[self._n_free - reused:self._n_free].copy()
+        self._n_free -= reused
+        fresh = count - reused
+        if self._next_slot + fresh > self._capacity:
+            target = max(2 * self._capacity, self._next_slot + fresh)
+            if self.max_sessions is not None:
+                target = min(target, self.max_sessions)
+            self._grow(target)
+        slots = np.concatenate((slots, np.arange(self._next_slot, self._next_slot + fresh)))
+        self._next_slot += fresh
+        return slots
+
+    def _tick(self, timestamp: float) -> int:
+        return int(timestamp // self.tick_seconds)
+
+    def _schedule(self, slots: np.ndarray, timestamp: float):
+        """File slots under the wheel tick of their latest touch."""
+        bucket = self._bucket(timestamp)
+        self._tick_of[slots] = bucket[0]
+        bucket[1].append(slots)
+        bucket[2].append(self._generation[slots])
+
+    def _bucket(self, timestamp: float) -> list:
+        tick = self._tick(timestamp)
+        if self._wheel and self._wheel[-1][0] >= tick:
+            return self._wheel[-1]
+        bucket = [tick, [], [], array.array('q'), array.array('q')]
+        self._wheel.append(bucket)
+        return bucket
+
+    def _valid_entries(self, bucket) -> np.ndarray:
+        slots = np.concatenate(bucket[1] + [np.frombuffer(bucket[3], dtype=np.int64)])
+        generations = np.concatenate(bucket[2] + [np.frombuffer(bucket[4], dtype=np.int64)])
+        valid = (
+            self._alive[slots]
+            & (self._generation[slots] == generations)
+            & (self._tick_of[slots] == bucket[0])
+        )
+        return np.unique(slots[valid])
+
+    def advance(self, now: float) -> int:
+        """
+        Expire sessions idle for longer than ttl_seconds as of now.
+
+        Returns:
+            Number of sessions expired
+        """
+        if self._now is None or now > self._now:
+            self._now = now
+        if self.ttl_seconds is None:
+            return 0
+        cutoff = self._tick(now - self.ttl_seconds)
+        expired = 0
+        while self._wheel and self._wheel[0][0] < cutoff:
+            slots = self._valid_entries(self._wheel.popleft())
+            self._remove(slots)
+            expired += len(slots)
+        self.expired_total += expired
+        return expired
+
+    def _evict(self, count: int):
+        """Remove the count least recently used sessions."""
+        evicted = 0
+        while evicted < count and self._wheel:
+            bucket = self._wheel.popleft()
+            slots = self._valid_entries(bucket)
+            needed = count - evicted
+            if len(slots) > needed:
+                order = np.argsort(self.last_seen[slots], kind='stable')
+                keep = slots[order[needed:]]
+                slots = slots[order[:needed]]
+                self._wheel.appendleft([bucket[0], [keep], [self._generation[keep]],
+                                        array.array('q'), array.array('q')])
+            self._remove(slots)
+            evicted += len(slots)
+        self.evicted_total += evicted
+
+    def touch_batch(self, user_ids: np.ndarray, channels: np.ndarray,
+                    timestamps: np.ndarray, campaigns: Optional[np.ndarray] = None,
+                    devices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Record one touchpoint per entry, opening sessions for unseen users.
+
+        Args:
+            campaigns, devices: Optional codes of each touch; a session
+                remembers those of its latest touch
+
+        Returns:
+            Slot of each user's session
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        channels = np.asarray(channels)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(user_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.max_sessions is not None and len(user_ids) > self.max_sessions:
+            # Chunks no larger than the cap never evict their own sessions
+            step = self.max_sessions
+
+            def part(arr, i):
+                return None if arr is None else arr[i:i + step]
+
+            return np.concatenate([
+                self.touch_batch(user_ids[i:i + step], channels[i:i + step], timestamps[i:i + step],
+                                 part(campaigns, i), part(devices, i))
+                for i in range(0, len(user_ids), step)
+            ])
+        now = float(timestamps.max())
+        self.advance(now)
+
+        slots = self.index.lookup(user_ids)
+        existing = slots >= 0
+        if existing.any():
+            # Refresh existing sessions first so eviction cannot pick them
+            touched = np.unique(slots[existing])
+            self._schedule(touched, now)
+
+        new = ~existing
+        if new.any():
+            new_users, first, inverse = np.unique(user_ids[new], return_index=True, return_inverse=True)
+            new_slots = self._allocate(len(new_users))
+            self.index.insert(new_users, new_slots)
+            self.user_ids[new_slots] = new_users
+            self.start_time[new_slots] = timestamps[new][first]
+            self.last_seen[new_slots] = self.start_time[new_slots]
+            self.n_touch[new_slots] = 0
+            self.last_campaign[new_slots] = -1
+            self.last_device[new_slots] = -1
+            self._generation[new_slots] += 1
+            self._alive[new_slots] = True
+            n = self._n_active
+            self._active[n:n + len(new_slots)] = new_slots
+            self._pos[new_slots] = np.arange(n, n + len(new_slots))
+            self._n_active += len(new_slots)
+            self._schedule(new_slots, now)
+            slots[new] = new_slots[inverse]
+
+        self._append_touchpoints(slots, channels, timestamps, campaigns, devices)
+        return slots
+
+    def touch(self, user_id: int, channel: int, timestamp: float,
+              campaign: int = -1, device: int = -1) -> int:
+        """
+        Scalar touch_batch for per-event callers, avoiding array overhead.
+
+        Returns:
+            Slot of the user's session
+        """
+        if self._now is None or timestamp > self._now + self.tick_seconds:
+            self.advance(timestamp)
+        slot = self.index.get(user_id)
+        if slot < 0:
+            slot = int(self._allocate(1)[0])
+            self.index.put(user_id, slot)
+            self.user_ids[slot] = user_id
+            self.start_time[slot] = timestamp
+            self.last_seen[slot] = timestamp
+            self.n_touch[slot] = 0
+            self.last_campaign[slot] = -1
+            self.last_device[slot] = -1
+            self._generation[slot] += 1
+            self._alive[slot] = True
+            self._active[self._n_active] = slot
+            self._pos[slot] = self._n_active
+            self._n_active += 1
+        bucket = self._bucket(max(timestamp, self._now))
+        self._tick_of[slot] = bucket[0]
+        bucket[3].append(slot)
+        bucket[4].append(int(self._generation[slot]))
+
+        count = int(self.n_touch[slot])
+        ring_pos = count % self.max_touchpoints
+        self.tp_channel[slot, ring_pos] = channel
+        self.tp_offset[slot, ring_pos] = timestamp - self.start_time[slot]
+        self.n_touch[slot] = count + 1
+        if campaign >= 0:
+            self.last_campaign[slot] = campaign
+        if device >= 0:
+            self.last_device[slot] = device
+        if timestamp > self.last_seen[slot]:
+            self.last_seen[slot] = timestamp
+        return slot
+
+    def _append_touchpoints(self, slots: np.ndarray, channels: np.ndarray, timestamps: np.ndarray,
+                            campaigns: Optional[np.ndarray] = None, devices: Optional[np.ndarray] = None):
+        k = self.max_touchpoints
+        # Rank of each touch among this batch's touches of the same slot
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        unique, starts, counts = np.unique(sorted_slots, return_index=True, return_counts=True)
+        rank = np.empty(len(slots), dtype=np.int64)
+        rank[order] = np.arange(len(slots)) - np.repeat(starts, counts)
+        per_slot = np.empty(len(slots), dtype=np.int64)
+        per_slot[order] = np.repeat(counts, counts)
+
+        # Only the last k touches of a slot survive in its ring
+        keep = rank >= per_slot - k
+        s = slots[keep]
+        ring_pos = (self.n_touch[s] + rank[keep]) % k
+        self.tp_channel[s, ring_pos] = channels[keep]
+        self.tp_offset[s, ring_pos] = timestamps[keep] - self.start_time[s]
+        self.n_touch[unique] += counts.astype(np.int32)
+        np.maximum.at(self.last_seen, slots, timestamps)
+
+        latest = rank == per_slot - 1
+        if campaigns is not None:
+            self.last_campaign[slots[latest]] = np.asarray(campaigns)[latest]
+        if devices is not None:
+            self.last_device[slots[latest]] = np.asarray(devices)[latest]
+
+    def random_slots(self, count: int, rng: np.random.Generator, distinct: bool = False) -> np.ndarray:
+        """Uniformly pick active session slots (without replacement if distinct)."""
+        n = self._n_active
+        if n == 0 or count <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if distinct:
+            positions = rng.choice(n, size=min(count, n), replace=False)
+        else:
+            positions = rng.integers(0, n, size=count)
+        return self._active[positions]
+
+    def random_slot(self, rand) -> int:
+        """Scalar random_slots using a random.Random; -1 if there are no sessions."""
+        if self._n_active == 0:
+            return -1
+        return int(self._active[rand.randrange(self._n_active)])
+
+    def slots_of(self, user_ids: np.ndarray) -> np.ndarray:
+        """Slot of each user's active session, -1 if none."""
+        return self.index.lookup(np.asarray(user_ids, dtype=np.int64))
+
+    def last_touchpoints(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Channel and timestamp of each session's most recent touchpoint."""
+        ring_pos = (self.n_touch[slots] - 1) % self.max_touchpoints
+        channels = self.tp_channel[slots, ring_pos].astype(np.int64)
+        timestamps = self.start_time[slots] + self.tp_offset[slots, ring_pos]
+        return channels, timestamps
+
+    def paths(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Touchpoint paths of the given sessions as ragged arrays.
+
+        Returns:
+            Dict with path_channels, path_timestamps and path_offsets
+            (path i is path_channels[path_offsets[i]:path_offsets[i+1]])
+        """
+        k = self.max_touchpoints
+        counts = np.minimum(self.n_touch[slots], k).astype(np.int64)
+        offsets = np.zeros(len(slots) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        path_of = np.repeat(np.arange(len(slots)), counts)
+        step = np.arange(offsets[-1]) - offsets[:-1][path_of]
+        first = (self.n_touch[slots] - counts) % k
+        owner = slots[path_of]
+        ring_pos = (first[path_of] + step) % k
+        return {
+            'path_channels': self.tp_channel[owner, ring_pos],
+            'path_timestamps': self.start_time[owner] + self.tp_offset[owner, ring_pos],
+            'path_offsets': offsets,
+        }
+
+    def pop_batch(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Close distinct sessions and return their paths as ragged arrays.
+
+        Returns:
+            Dict with user_id, start_time, the last touch's campaign and
+            device codes, and the paths() arrays
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        result = self.paths(slots)
+        result['user_id'] = self.user_ids[slots].copy()
+        result['start_time'] = self.start_time[slots].copy()
+        result['campaign'] = self.last_campaign[slots].copy()
+        result['device'] = self.last_device[slots].copy()
+        self._remove(slots)
+        return result
+
+    def _remove(self, slots: np.ndarray):
+        k = len(slots)
+        if k == 0:
+            return
+        n = self._n_active
+        positions = self._pos[slots]
+        # Fill holes below the new end with survivors from the tail
+        tail = np.arange(n - k, n)
+        movers = self._active[tail[~np.isin(tail, positions)]]
+        holes = np.sort(positions[positions < n - k])
+        self._active[holes] = movers
+        self._pos[movers] = holes
+        self._n_active = n - k
+
+        self.index.delete(self.user_ids[slots])
+        self._alive[slots] = False
+        self._generation[slots] += 1
+        self._free[self._n_free:self._n_free + k] = slots
+        self._n_free += k
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by the store, for sizing hosts.
+
+        Returns:
+            Dict with sessions, capacity, slot_bytes (per-slot arrays),
+            index_bytes, wheel_bytes and total_bytes
+        """
+        slot_arrays = (
+            self.user_ids, self.start_time, self.last_seen, self.n_touch,
+            self.tp_channel, self.tp_offset, self.last_campaign, self.last_device,
+            self._generation, self._tick_of,
+            self._alive, self._active, self._pos, self._free
+        )
+        slot_bytes = sum(a.nbytes for a in slot_arrays)
+        wheel_bytes = sum(
+            a.nbytes for bucket in self._wheel for arrays in bucket[1:3] for a in arrays
+        ) + sum(bucket[3].itemsize * (len(bucket[3]) + len(bucket[4])) for bucket in self._wheel)
+        return {
+            'sessions': self._n_active,
+            'capacity': self._capacity,
+            'slot_bytes': slot_bytes,
+            'index_bytes': self.index.nbytes,
+            'wheel_bytes': wheel_bytes,
+            'total_bytes': slot_bytes + self.index.nbytes + wheel_bytes,
+        }
@@ -0,0 +1,169 @@
+"""
+Latency Histograms
+==================
+
+Low-overhead, HDR-style latency histograms and a process-wide registry
+exported in Prometheus text format.
+
+Buckets are log-linear: each power of two is split into 2^significant_bits
+equal sub-buckets, so every recorded value is known to within ~3% (5 bits)
+from a microsecond up to minutes, in a few KB of counts. record() only
+appends to a list; values are bucketed in vectorized batches when the list
+fills or the histogram is read.
+
+Instrumented components hold a histogram reference or None; when
+instrumentation is off the only cost is that None check.
+"""
+
+import math
+import threading
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+# Prometheus "le" bounds exported for every histogram (seconds)
+EXPORT_BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations in seconds.
+    """
+
+    def __init__(self, name: str, help_text: str = "", lowest: float = 1e-6,
+                 highest: float = 3600.0, significant_bits: int = 5, flush_every: int = 4096):
+        """
+        Initialize histogram.
+
+        Args:
+            name: Metric name (Prometheus conventions, e.g. engine_ingest_seconds)
+            help_text: One-line description
+            lowest, highest: Smallest and largest distinguishable values;
+                values outside are clamped into the end buckets
+            significant_bits: Sub-buckets per power of two = 2^bits
+            flush_every: Buffered values before they are bucketed
+        """
+        self.name = name
+        self.help_text = help_text
+        self.sub_buckets = 1 << significant_bits
+        self.min_exp = math.floor(math.log2(lowest))
+        self.max_exp = math.ceil(math.log2(highest)) + 1
+        self.counts = np.zeros((self.max_exp - self.min_exp) * self.sub_buckets, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.flush_every = flush_every
+        self._pending: List[float] = []
+        self._lock = threading.Lock()
+
+        edges = np.arange(len(self.counts))
+        exponents = edges // self.sub_buckets + self.min_exp
+        mantissas = 0.5 + (edges % self.sub_buckets + 1) / (2 * self.sub_buckets)
+        self.upper_edges = np.ldexp(mantissas, exponents)
+
+    def record(self, seconds: float):
+        """Record one value (list append; bucketing is deferred)."""
+        pending = self._pending
+        pending.append(seconds)
+        if len(pending) >= self.flush_every:
+            self.flush()
+
+    def record_many(self, seconds: Iterable[float]):
+        self._add(np.asarray(seconds, dtype=np.float64))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self._add(np.array(pending))
+
+    def _add(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        values = np.maximum(values, 0.0)
+        mantissa, exponent = np.frexp(values)
+        index = (exponent - self.min_exp) * self.sub_buckets + (
+            (mantissa - 0.5) * 2 * self.sub_buckets).astype(np.int64)
+        index = np.clip(index, 0, len(self.counts) - 1)
+        binned = np.bincount(index, minlength=len(self.counts))
+        with self._lock:
+            self.counts += binned
+            self.count += len(values)
+            self.sum += float(values.sum())
+            self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-th quantile (0 if empty)."""
+        self.flush()
+        if self.count == 0:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        bucket = int(np.searchsorted(cumulative, q * cumulative[-1], side='left'))
+        return float(min(self.upper_edges[bucket], self.max))
+
+    def summary(self) -> Dict:
+        """Count, mean, max and quantiles in milliseconds, for payloads."""
+        self.flush()
+        summary = {'count': self.count}
+        if self.count:
+            summary['mean_ms'] = 1000 * self.sum / self.count
+            summary['max_ms'] = 1000 * self.max
+            for q in SUMMARY_QUANTILES:
+                summary[f"p{q * 100:g}_ms"] = 1000 * self.quantile(q)
+        return summary
+
+    def prometheus_lines(self) -> List[str]:
+        self.flush()
+        cumulative = np.cumsum(self.counts)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for bound in EXPORT_BOUNDS:
+            # Buckets entirely below the bound; exact to one HDR sub-bucket
+            covered = int(np.searchsorted(self.upper_edges, bound, side='right'))
+            value = int(cumulative[covered - 1]) if covered else 0
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {value}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum:.9g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class HistogramRegistry:
+    """
+    Named histograms shared by the components of one process.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str = "", **kwargs) -> LatencyHistogram:
+        """Get or create a histogram."""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram(name, help_text, **kwargs)
+                self.histograms[name] = histogram
+            return histogram
+
+    def summary(self) -> Dict[str, Dict]:
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def prometheus_text(self) -> str:
+        lines: List[str] = []
+        for name in sorted(self.histograms):
+            lines.extend(self.histograms[name].prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = HistogramRegistry()
+
+
+def histogram_if(enabled: bool, name: str, help_text: str = "",
+                 registry: Optional[HistogramRegistry] = None) -> Optional[LatencyHistogram]:
+    """The named histogram when enabled, else None (instrumentation off)."""
+    if not enabled:
+        return None
+    return (registry or REGISTRY).histogram(name, help_text)
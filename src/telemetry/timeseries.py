@@ -0,0 +1,317 @@
+"""
+Metrics Time Series
+===================
+
+In-process history of the dashboard metrics (attribution shares, health,
+throughput) for range queries such as /history.
+
+Each published metrics dict is flattened to numeric series ('attribution.
+Search', 'health.ctr', 'pipeline.attribute.events_per_sec', ...) and folded
+into every resolution tier (by default 1 s for an hour, 1 min for a day,
+1 h for a month). A tier averages the samples of its open bucket; closed
+buckets go into a columnar ring buffer: one row per bucket, one float64
+column per series (NaN where a series had no sample). Series may appear at
+any time; the rings widen with them.
+
+With a directory, closed buckets are also appended to one file per tier in
+chunks (a JSON header with the chunk's columns and bucket range, then the
+bucket ids and the value block), so history outlives the rings and the
+process. Queries slice the rings and the overlapping chunks with NumPy;
+nothing is looped per point.
+"""
+
+import os
+import json
+import threading
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (bucket seconds, buckets kept in memory)
+DEFAULT_RESOLUTIONS = ((1, 3600), (60, 1440), (3600, 720))
+# Top-level metrics keys recorded by default
+DEFAULT_FIELDS = ('attribution', 'health', 'events_sec', 'total_events', 'pipeline')
+
+
+def flatten(metrics: Dict, fields: Iterable[str]) -> Dict[str, float]:
+    """Numeric leaves of metrics[field] for each field, keyed by dotted path."""
+    flat = {}
+    stack = [(field, metrics[field]) for field in fields if field in metrics]
+    while stack:
+        key, value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend((f"{key}.{k}", v) for k, v in value.items())
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[key] = float(value)
+    return flat
+
+
+class ResolutionTier:
+    """
+    Ring of closed buckets at one resolution, plus the open bucket.
+    """
+
+    def __init__(self, seconds: int, capacity: int, path: Optional[str] = None, spill_rows: int = 64):
+        """
+        Args:
+            seconds: Bucket width
+            capacity: Buckets kept in memory
+            path: Append-only spill file (None: memory only)
+            spill_rows: Closed buckets written per chunk
+        """
+        self.seconds = seconds
+        self.capacity = capacity
+        self.path = path
+        self.spill_rows = min(spill_rows, capacity)
+        self.columns: List[str] = []
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.values = np.full((capacity, 0), np.nan)
+        self.newest = -1
+        # First bucket closed by this process (older ones are only on disk)
+        self._ring_start: Optional[int] = None
+        # Open bucket: running sums and counts per column
+        self._open_id = -1
+        self._sums = np.zeros(0)
+        self._counts = np.zeros(0)
+        # First closed bucket not yet spilled
+        self._unspilled = None
+        # (first id, last id, file offset, header length) per chunk on disk
+        self.chunks: List[Tuple[int, int, int, int]] = []
+        if path is not None and os.path.exists(path):
+            self._scan()
+
+    def _widen(self, n_columns: int):
+        """Add NaN columns up to n_columns."""
+        extra = n_columns - self.values.shape[1]
+        self.values = np.hstack((self.values, np.full((self.capacity, extra), np.nan)))
+        self._sums = np.r_[self._sums, np.zeros(extra)]
+        self._counts = np.r_[self._counts, np.zeros(extra)]
+
+    def add(self, bucket_id: int, positions: np.ndarray, values: np.ndarray):
+        """Fold one sample into the open bucket (late samples join the open bucket too)."""
+        if bucket_id > self._open_id:
+            self.close()
+            self._open_id = bucket_id
+        self._sums[positions] += values
+        self._counts[positions] += 1
+
+    def close(self):
+        """Move the open bucket, if any, into the ring."""
+        if self._open_id < 0 or not self._counts.any():
+            return
+        slot = self._open_id % self.capacity
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.values[slot] = np.where(self._counts > 0, self._sums / self._counts, np.nan)
+        self.ids[slot] = self._open_id
+        self.newest = self._open_id
+        if self._ring_start is None:
+            self._ring_start = self._open_id
+        self._sums[:] = 0.0
+        self._counts[:] = 0.0
+        if self.path is not None:
+            if self._unspilled is None:
+                self._unspilled = self._open_id
+            if self._open_id - self._unspilled + 1 >= self.spill_rows:
+                self.spill()
+
+    def spill(self):
+        """Append closed, unspilled ring rows to the file."""
+        if self.path is None or self._unspilled is None:
+            return
+        ids, values = self._ring_range(self._unspilled, self.newest)
+        self._unspilled = self.newest + 1
+        if not len(ids):
+            return
+        header = json.dumps({'columns': self.columns, 'rows': len(ids),
+                             'first': int(ids[0]), 'last': int(ids[-1])}).encode()
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(ids.astype('<i8').tobytes())
+            f.write(values.astype('<f8').tobytes())
+        self.chunks.append((int(ids[0]), int(ids[-1]), offset, len(header)))
+
+    def _scan(self):
+        """Index the chunks of an existing spill file."""
+        with open(self.path, 'rb') as f:
+            offset = 0
+            while True:
+                prefix = f.read(8)
+                if len(prefix) < 8:
+                    break
+                length = int.from_bytes(prefix, 'little')
+                raw = f.read(length)
+                if len(raw) < length:
+                    break
+                header = json.loads(raw)
+                size = header['rows'] * 8 * (1 + len(header['columns']))
+                f.seek(size, os.SEEK_CUR)
+                self.chunks.append((header['first'], header['last'], offset, length))
+                offset += 8 + length + size
+        if self.chunks:
+            # Resume bucket numbering after what is on disk
+            self.newest = self.chunks[-1][1]
+
+    def _ring_range(self, first: int, last: int) -> Tuple[np.ndarray, np.ndarray]:
+        first = max(first, last - self.capacity + 1)
+        if last < first:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.columns)))
+        wanted = np.arange(first, last + 1)
+        slots = wanted % self.capacity
+        present = self.ids[slots] == wanted
+        return wanted[present], self.values[slots[present]]
+
+    def _disk_range(self, first: int, last: int, columns: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        ids, blocks = [], []
+        position = {name: i for i, name in enumerate(columns)}
+        overlapping = [c for c in self.chunks if c[1] >= first and c[0] <= last]
+        if not overlapping:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(columns)))
+        with open(self.path, 'rb') as f:
+            for _, _, offset, length in overlapping:
+                f.seek(offset + 8)
+                header = json.loads(f.read(length))
+                rows, width = header['rows'], len(header['columns'])
+                chunk_ids = np.frombuffer(f.read(rows * 8), dtype='<i8')
+                chunk = np.frombuffer(f.read(rows * width * 8), dtype='<f8').reshape(rows, width)
+                keep = (chunk_ids >= first) & (chunk_ids <= last)
+                block = np.full((int(keep.sum()), len(columns)), np.nan)
+                source = [i for i, name in enumerate(header['columns']) if name in position]
+                block[:, [position[header['columns'][i]] for i in source]] = chunk[keep][:, source]
+                ids.append(chunk_ids[keep])
+                blocks.append(block)
+        return np.concatenate(ids), np.vstack(blocks)
+
+    def query(self, first: int, last: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Buckets first..last as (ids, values): the ring, the spill file for
+        what the ring no longer holds, and the open bucket's running mean.
+        """
+        ring_first = self.newest + 1 if self._ring_start is None else \
+            max(self._ring_start, self.newest - self.capacity + 1)
+        ids, values = self._ring_range(max(first, ring_first), min(last, self.newest))
+        if self.chunks and first < ring_first:
+            disk_ids, disk_values = self._disk_range(first, min(last, ring_first - 1), self.columns)
+            ids = np.concatenate((disk_ids, ids))
+            values = np.vstack((disk_values, values))
+        if first <= self._open_id <= last and self._counts.any():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                partial = np.where(self._counts > 0, self._sums / self._counts, np.nan)
+            ids = np.r_[ids, self._open_id]
+            values = np.vstack((values, partial))
+        return ids, values
+
+
+class TimeSeriesStore:
+    """
+    Multi-resolution history of flattened metrics.
+    """
+
+    def __init__(self, resolutions: Iterable[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                 fields: Iterable[str] = DEFAULT_FIELDS, directory: Optional[str] = None,
+                 spill_rows: int = 64):
+        """
+        Args:
+            resolutions: (bucket seconds, buckets in memory) per tier
+            fields: Top-level metrics keys to record
+            directory: Spill closed buckets here (None: memory only)
+            spill_rows: Closed buckets per spilled chunk
+        """
+        self.fields = tuple(fields)
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.tiers = [
+            ResolutionTier(seconds, capacity,
+                           os.path.join(directory, f'history-{seconds}s.bin') if directory else None,
+                           spill_rows)
+            for seconds, capacity in sorted(resolutions)
+        ]
+        self.columns: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        # Columns already on disk keep their query positions after a restart
+        for tier in self.tiers:
+            if tier.chunks:
+                with open(tier.path, 'rb') as f:
+                    f.seek(tier.chunks[-1][2] + 8)
+                    for name in json.loads(f.read(tier.chunks[-1][3]))['columns']:
+                        self._position(name)
+        for tier in self.tiers:
+            tier._widen(len(self.columns))
+            tier.columns = list(self.columns)
+
+    def _position(self, name: str) -> int:
+        position = self._positions.get(name)
+        if position is None:
+            position = self._positions[name] = len(self.columns)
+            self.columns.append(name)
+        return position
+
+    def record(self, metrics: Dict, timestamp: float):
+        """Add one metrics sample to every tier."""
+        flat = flatten(metrics, self.fields)
+        if not flat:
+            return
+        with self.lock:
+            positions = np.fromiter((self._position(k) for k in flat), dtype=np.int64, count=len(flat))
+            values = np.fromiter(flat.values(), dtype=np.float64, count=len(flat))
+            n_columns = len(self.columns)
+            for tier in self.tiers:
+                if tier.values.shape[1] < n_columns:
+                    tier._widen(n_columns)
+                    tier.columns = list(self.columns)
+                tier.add(int(timestamp // tier.seconds), positions, values)
+
+    def flush(self):
+        """Close open buckets and spill everything closed."""
+        with self.lock:
+            for tier in self.tiers:
+                tier.close()
+                tier.spill()
+
+    def pick_resolution(self, start: float, end: float, max_points: int) -> ResolutionTier:
+        """Finest tier answering [start, end] in at most max_points buckets."""
+        for tier in self.tiers:
+            if (end - start) / tier.seconds <= max_points:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, start: float, end: float, resolution: Optional[int] = None,
+              prefixes: Optional[List[str]] = None, max_points: int = 2000) -> Dict:
+        """
+        Series between start and end (epoch seconds).
+
+        Args:
+            resolution: Bucket seconds of a tier (default: the finest one
+                within max_points)
+            prefixes: Only series whose name starts with one of these
+                (e.g. ['attribution', 'health.ctr'])
+            max_points: Point budget for choosing the resolution
+
+        Returns:
+            Dict with resolution, timestamps (bucket starts) and series by
+            name, as float64 arrays with NaN for gaps
+        """
+        with self.lock:
+            if resolution is None:
+                tier = self.pick_resolution(start, end, max_points)
+            else:
+                matching = [t for t in self.tiers if t.seconds == resolution]
+                if not matching:
+                    raise ValueError(f"Unknown resolution: {resolution}s "
+                                     f"(have {[t.seconds for t in self.tiers]})")
+                tier = matching[0]
+            ids, values = tier.query(int(start // tier.seconds), int(end // tier.seconds))
+            columns = list(tier.columns)
+        selected = [i for i, name in enumerate(columns)
+                    if not prefixes or any(name.startswith(p) for p in prefixes)]
+        return {
+            'resolution': tier.seconds,
+            'timestamps': ids * tier.seconds,
+            'series': {columns[i]: values[:, i] for i in selected},
+        }
+
+    def memory_usage(self) -> int:
+        """Bytes held by the rings."""
+        return sum(t.values.nbytes + t.ids.nbytes for t in self.tiers)